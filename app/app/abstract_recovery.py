@@ -0,0 +1,377 @@
+"""
+Recovery of missing abstracts from the papers' PDFs, off the search path.
+When a search is done, get_papers hands its papers without an abstract to
+recover() and moves on. A lookup thread answers from the permanent cache (the
+recovered_abstract table), the other DOIs queue for a bounded pool that streams
+the PDF to disk (open-access URL first, then Unpaywall's) and asks GROBID for
+its header. Every abstract found is set on the waiting papers and announced to
+their clients with a doi_patch event.
+
+    python -m app.abstract_recovery    # end to end against a local stand-in for GROBID and a PDF host
+"""
+import contextlib
+import datetime
+import logging
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from threading import Lock
+from typing import Dict, List
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from app import abstracts
+from app.database import engine
+from app.http_client import get_session, register_upstream
+from app.metrics import MeteredThreadPoolExecutor, registry
+from app.model import RecoveredAbstract
+from app.write_behind import write_behind
+
+logger = logging.getLogger('abstract_recovery')
+
+ABSTRACT_RECOVERY = os.environ.get("ABSTRACT_RECOVERY", "0") == "1"
+GROBID_URL = os.environ.get("GROBID_URL", "http://localhost:8070").rstrip("/")
+GROBID_WORKERS = int(os.environ.get("GROBID_WORKERS", "2"))
+PDF_MAX_BYTES = int(float(os.environ.get("PDF_MAX_MB", "20")) * 1024 * 1024)
+RECOVERY_QUEUE_MAX = int(os.environ.get("RECOVERY_QUEUE_MAX", "500"))
+RECOVERY_RETRY_DAYS = float(os.environ.get("RECOVERY_RETRY_DAYS", "30"))
+UNPAYWALL_EMAIL = os.environ.get("UNPAYWALL_EMAIL", os.environ.get("PYALEX_EMAIL", "nico@scholar.miage.dev"))
+CHUNK_BYTES = 64 * 1024
+LOOKUP_BATCH = 500
+
+_DOI_PREFIX = "https://doi.org/"
+
+# one connection per recovery worker
+register_upstream("unpaywall", pool_maxsize=GROBID_WORKERS, timeout=10)
+register_upstream("pdf", pool_maxsize=GROBID_WORKERS, timeout=30, retries=1)
+register_upstream("grobid", pool_maxsize=GROBID_WORKERS, timeout=45, retries=0)
+
+recovery_outcomes = registry.counter(
+    "scholar_abstract_recovery_total",
+    "DOIs handed to abstract recovery, by outcome: cached, known_missing, joined (already queued), dropped "
+    "(queue full), recovered, missing or failed.",
+    ("outcome",))
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _doi(paper):
+    """The DOI recovery works on, None for papers identified otherwise (arXiv ids, no doi)."""
+    doi = paper.get("doi") or ""
+    return doi if doi.startswith(_DOI_PREFIX) else None
+
+
+def download_pdf(url, max_bytes=PDF_MAX_BYTES) -> str | None:
+    """
+    Stream a PDF to a temporary file and return its path. None when the URL does
+    not serve a PDF, fails, or the file is larger than max_bytes.
+    """
+    try:
+        with get_session("pdf").get(url, stream=True, allow_redirects=True) as response:
+            if response.status_code != 200:
+                return None
+            length = response.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) > max_bytes:
+                logger.debug("skipping %s: %s bytes", url, length)
+                return None
+            content_type = response.headers.get("Content-Type", "").lower()
+            fd, path = tempfile.mkstemp(prefix="oa_pdf_", suffix=".pdf")
+            written = 0
+            keep = False
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_BYTES):
+                        if written == 0 and not chunk.startswith(b"%PDF") and "application/pdf" not in content_type:
+                            return None
+                        written += len(chunk)
+                        if written > max_bytes:
+                            logger.debug("skipping %s: larger than %d bytes", url, max_bytes)
+                            return None
+                        f.write(chunk)
+                keep = written > 0
+                return path if keep else None
+            finally:
+                if not keep:
+                    with contextlib.suppress(OSError):
+                        os.remove(path)
+    except Exception:
+        logger.debug("downloading %s failed", url, exc_info=True)
+        return None
+
+
+def grobid_abstract(pdf_path, grobid_url=GROBID_URL) -> str:
+    """Abstract of a PDF from GROBID's header extraction, "" when it finds none."""
+    with open(pdf_path, "rb") as f:
+        files = {"input": (os.path.basename(pdf_path), f, "application/pdf")}
+        response = get_session("grobid").post(f"{grobid_url}/api/processHeaderDocument", files=files,
+                                              headers={"Accept": "application/xml"})
+    if response.status_code != 200:
+        return ""
+    root = ET.fromstring(response.content)
+    return " ".join(" ".join(node.itertext()).strip() for node in root.findall(".//{*}abstract")).strip()
+
+
+def unpaywall_pdf_url(doi) -> str | None:
+    """Unpaywall's best open-access PDF for a DOI, or None."""
+    if not UNPAYWALL_EMAIL:
+        return None
+    try:
+        response = get_session("unpaywall").get(f"https://api.unpaywall.org/v2/{doi.removeprefix(_DOI_PREFIX)}",
+                                                params={"email": UNPAYWALL_EMAIL})
+        if response.status_code != 200:
+            return None
+        return (response.json().get("best_oa_location") or {}).get("url_for_pdf") or None
+    except Exception:
+        logger.debug("unpaywall lookup for %s failed", doi, exc_info=True)
+        return None
+
+
+def recover_abstract(doi, oa_url=None, grobid_url=GROBID_URL):
+    """
+    (abstract, PDF URL) for a DOI, ("", None) when no PDF gives one. Errors
+    talking to GROBID are raised, they say nothing about the paper.
+    """
+    tried = set()
+    for url in (oa_url, None):
+        url = url or unpaywall_pdf_url(doi)
+        if not url or url in tried:
+            continue
+        tried.add(url)
+        pdf_path = download_pdf(url)
+        if not pdf_path:
+            continue
+        try:
+            abstract = grobid_abstract(pdf_path, grobid_url)
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(pdf_path)
+        if abstract:
+            return abstract, url
+    return "", None
+
+
+def _write_abstracts(session, rows):
+    for row in rows:
+        updated = session.execute(update(RecoveredAbstract).where(RecoveredAbstract.doi == row["doi"]).values(**row))
+        if not updated.rowcount:
+            session.execute(insert(RecoveredAbstract).values(**row))
+
+
+write_behind.register("recovered_abstract", write=_write_abstracts)
+
+
+def _known(dois):
+    """{doi: (status, abstract, updated)} of the DOIs already in the permanent cache."""
+    known = {}
+    with Session(engine) as session:
+        for start in range(0, len(dois), LOOKUP_BATCH):
+            rows = session.execute(select(RecoveredAbstract.doi, RecoveredAbstract.status, RecoveredAbstract.abstract,
+                                          RecoveredAbstract.updated)
+                                   .where(RecoveredAbstract.doi.in_(dois[start:start + LOOKUP_BATCH])))
+            for doi, status, abstract, updated in rows:
+                if updated is not None and updated.tzinfo is None:
+                    updated = updated.replace(tzinfo=datetime.timezone.utc)
+                known[doi] = (status, abstract, updated)
+    return known
+
+
+def recovered(dois):
+    """{doi: abstract} of the DOIs whose abstract was recovered before."""
+    return {doi: abstract for doi, (status, abstract, _) in _known(list(dois)).items() if status == "found"}
+
+
+class AbstractRecovery:
+    """
+    Queue of DOIs whose abstract is being recovered, each with the papers (and
+    the emitt of their search) waiting for it. A DOI is recovered once however
+    many searches ask for it; past queue_max, new DOIs are dropped until the
+    queue drains.
+    """
+
+    def __init__(self, enabled=ABSTRACT_RECOVERY, workers=GROBID_WORKERS, queue_max=RECOVERY_QUEUE_MAX,
+                 grobid_url=GROBID_URL):
+        self.enabled = enabled
+        self.workers = workers
+        self.queue_max = queue_max
+        self.grobid_url = grobid_url
+        self._waiting: Dict[str, List] = {}  # doi -> [(paper, emitt)]
+        self._lock = Lock()
+        self._lookup_executor = None
+        self._executor = None
+
+    def _executors(self):
+        with self._lock:
+            if self._executor is None:
+                self._lookup_executor = MeteredThreadPoolExecutor("abstract_lookup", 1)
+                self._executor = MeteredThreadPoolExecutor("grobid", self.workers)
+            return self._lookup_executor, self._executor
+
+    @property
+    def pending(self):
+        return len(self._waiting)
+
+    def recover(self, papers, emitt):
+        """Look for the abstracts papers lack, in the background: returns right away."""
+        if not self.enabled:
+            return
+        missing = [paper for paper in papers if _doi(paper) and not paper.get("X-abstract")]
+        if missing:
+            lookup_executor, _ = self._executors()
+            lookup_executor.submit(self._dispatch, missing, emitt)
+
+    def _dispatch(self, papers, emitt):
+        by_doi: Dict[str, List] = {}
+        for paper in papers:
+            by_doi.setdefault(_doi(paper), []).append((paper, emitt))
+        try:
+            known = _known(list(by_doi))
+        except Exception:
+            logger.exception("reading recovered abstracts failed")
+            known = {}
+
+        retry_after = _now() - datetime.timedelta(days=RECOVERY_RETRY_DAYS)
+        for doi, waiting in by_doi.items():
+            status, abstract, updated = known.get(doi, (None, None, None))
+            if status == "found":
+                recovery_outcomes.inc("cached")
+                self._deliver(doi, abstract, waiting)
+            elif status == "missing" and updated is not None and updated > retry_after:
+                recovery_outcomes.inc("known_missing")
+            else:
+                self._enqueue(doi, waiting[0][0].get("X-OA-URL") or None, waiting)
+
+    def _enqueue(self, doi, oa_url, waiting):
+        with self._lock:
+            queued = self._waiting.get(doi)
+            if queued is not None:
+                queued.extend(waiting)
+                recovery_outcomes.inc("joined")
+                return
+            if len(self._waiting) >= self.queue_max:
+                recovery_outcomes.inc("dropped")
+                return
+            self._waiting[doi] = list(waiting)
+        _, executor = self._executors()
+        executor.submit(self._recover, doi, oa_url)
+
+    def _recover(self, doi, oa_url):
+        abstract = ""
+        try:
+            abstract, source = recover_abstract(doi, oa_url, self.grobid_url)
+        except Exception:
+            recovery_outcomes.inc("failed")
+            logger.warning("recovering the abstract of %s failed", doi, exc_info=True)
+        else:
+            recovery_outcomes.inc("recovered" if abstract else "missing")
+            write_behind.submit("recovered_abstract", {
+                "doi": doi, "abstract": abstract, "status": "found" if abstract else "missing", "source": source,
+                "updated": _now()})
+        finally:
+            with self._lock:
+                waiting = self._waiting.pop(doi, [])
+        if abstract:
+            self._deliver(doi, abstract, waiting)
+
+    def _deliver(self, doi, abstract, waiting):
+        for paper, _ in waiting:
+            paper["X-abstract"] = abstract
+        patch = abstracts.detach([{"doi": doi, "X-abstract": abstract}])[0]
+        for emitt in {id(emitt): emitt for _, emitt in waiting}.values():
+            try:
+                emitt("doi_patch", patch)
+            except Exception:
+                logger.exception("sending the abstract of %s failed", doi)
+
+
+abstract_recovery = AbstractRecovery()
+
+registry.gauge("scholar_abstract_recovery_pending", "DOIs queued for abstract recovery or being recovered.", (),
+               lambda: {(): abstract_recovery.pending})
+
+
+if __name__ == "__main__":
+    # a stand-in serving PDFs and GROBID's header endpoint on localhost; checks that
+    # recover() does not block, that the pool stays bounded and that a second
+    # search is answered from the permanent cache
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from app.model import init_schema
+    from app.records import Paper
+
+    logging.basicConfig(level=logging.WARNING)
+    UNPAYWALL_EMAIL = ""  # no Unpaywall from the demo
+    init_schema()
+
+    stand_in = {"grobid_calls": 0, "running": 0, "max_running": 0}
+    stand_in_lock = Lock()
+
+    class StandIn(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/pdf/"):
+                body, content_type = b"%PDF-1.4 " + self.path.encode() + b" " * 4096, "application/pdf"
+            elif self.path.startswith("/huge/"):
+                body, content_type = b"%PDF-1.4 " + b"0" * (PDF_MAX_BYTES + 1), "application/pdf"
+            else:
+                body, content_type = b"<html>landing page</html>", "text/html"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            with contextlib.suppress(ConnectionError):  # oversized PDFs are abandoned half-way
+                self.wfile.write(body)
+
+        def do_POST(self):
+            with stand_in_lock:
+                stand_in["grobid_calls"] += 1
+                stand_in["running"] += 1
+                stand_in["max_running"] = max(stand_in["max_running"], stand_in["running"])
+            self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(0.2)  # GROBID takes a while per document
+            body = (b'<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><profileDesc><abstract><p>'
+                    b'Recovered abstract.</p></abstract></profileDesc></teiHeader></TEI>')
+            with stand_in_lock:
+                stand_in["running"] -= 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    run = int(time.time())
+    kinds = ["pdf"] * 8 + ["landing", "huge"]
+    recovery = AbstractRecovery(enabled=True, workers=2, grobid_url=base)
+
+    def search(label):
+        papers = [Paper.from_wire({"doi": f"https://doi.org/10.5555/{run}.{i}", "title": f"paper {i}", "X-abstract": "",
+                                   "X-OA-URL": f"{base}/{kind}/{i}"}) for i, kind in enumerate(kinds)]
+        patches = []
+        started = time.perf_counter()
+        recovery.recover(papers, lambda event, data: patches.append((time.perf_counter(), event, data)))
+        returned_ms = (time.perf_counter() - started) * 1000
+        calls_before = stand_in["grobid_calls"]
+        deadline = time.monotonic() + 30
+        while (recovery.pending or len(patches) < 8) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        recovered = sum(1 for paper in papers if paper.get("X-abstract"))
+        last_ms = (patches[-1][0] - started) * 1000 if patches else 0
+        print(f"{label}: recover() returned in {returned_ms:.1f} ms; {len(patches)} doi_patch events "
+              f"(last after {last_ms:.0f} ms), {recovered}/{len(papers)} abstracts, "
+              f"{stand_in['grobid_calls'] - calls_before} GROBID calls")
+
+    search("first search ")
+    write_behind.flush()
+    search("second search")
+    print(f"GROBID requests in flight at most: {stand_in['max_running']} (pool of {recovery.workers})")
+    server.shutdown()
@@ -0,0 +1,56 @@
+"""
+Abstracts of search results, sent on demand rather than with every doi_results
+batch. Results leave for the client without their abstract (X-has-abstract tells
+whether there is one); the text stays in the in-process cache under the paper's
+doi and is fetched in batches through /abstracts?ids=... when the user needs it.
+The cache may evict it: business.find_abstracts then reads it back from a
+durable source.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from app.cache import memory_cache
+
+logger = logging.getLogger('abstracts')
+
+LAZY_ABSTRACTS = os.environ.get("LAZY_ABSTRACTS", "1") == "1"
+ABSTRACT_TTL = timedelta(hours=float(os.environ.get("ABSTRACT_TTL_HOURS", "24")))
+MAX_IDS = 200
+
+NAMESPACE = "abstract"
+
+
+def _key(paper_id):
+    return f"{NAMESPACE}|{paper_id}"
+
+
+def remember(paper_id, abstract):
+    memory_cache.put(NAMESPACE, _key(paper_id), abstract, len(abstract), ABSTRACT_TTL)
+
+
+def lookup(ids):
+    """{id: abstract} for the ids whose abstract is still held, at most MAX_IDS of them."""
+    found = {}
+    for paper_id in list(dict.fromkeys(ids))[:MAX_IDS]:
+        abstract = memory_cache.get(NAMESPACE, _key(paper_id))
+        if abstract is not None:
+            found[paper_id] = abstract
+    return found
+
+
+def detach(papers):
+    """
+    Wire dicts of papers with the abstracts moved to the cache. Papers without a
+    doi keep theirs inline, the client has no id to ask for it.
+    """
+    wire = []
+    for paper in papers:
+        fields = paper.to_wire() if hasattr(paper, "to_wire") else dict(paper)
+        if LAZY_ABSTRACTS and fields.get("doi"):
+            abstract = fields.pop("X-abstract", None)
+            if abstract:
+                remember(fields["doi"], abstract)
+            fields["X-has-abstract"] = bool(abstract)
+        wire.append(fields)
+    return wire
@@ -1,260 +1,23 @@
-from dataclasses import dataclass
 from typing import Callable, List, Optional
 import urllib.request as libreq
 from urllib.parse import quote
+import logging
 import xml.dom.minidom
-import atoma
-
-# Token types
-AND = 'AND'
-OR = 'OR'
-ID = 'ID'
-QUOT = 'QUOT'
-NUM = 'NUM'
-LP = 'LP'
-RP = 'RP'
-GT = 'GT'
-LT = 'LT'
-EOF = 'EOF'
-
-
-@dataclass
-class Tok:
-    typ: str
-    val: str
-
-
-def tokenize(s: str) -> List[Tok]:
-    tokens = []
-    i = 0
-    n = len(s)
-    while i < n:
-        c = s[i]
-        if c.isspace():
-            i += 1
-            continue
-
-        if c == '"':
-            j = i + 1
-            while j < n and s[j] != '"':
-                j += 1
-            if j >= n:
-                raise ValueError("Unterminated quote")
-            tokens.append(Tok(QUOT, s[i:j + 1]))
-            i = j + 1
-            continue
-
-        if c.isalpha():
-            j = i + 1
-            while j < n and (s[j].isalnum() or s[j] in "_-"):
-                j += 1
-            word = s[i:j]
-            up = word.upper()
-            if up == 'AND':
-                tokens.append(Tok(AND, 'AND'))
-            elif up == 'OR':
-                tokens.append(Tok(OR, 'OR'))
-            else:
-                tokens.append(Tok(ID, word))
-            i = j
-            continue
-
-        # numbers, including a single decimal part, e.g. 4.0
-        if c.isdigit():
-            j = i + 1
-            while j < n and s[j].isdigit():
-                j += 1
-            if j < n and s[j] == '.' and j + 1 < n and s[j + 1].isdigit():
-                k = j + 1
-                while k < n and s[k].isdigit():
-                    k += 1
-                tokens.append(Tok(NUM, s[i:k]))
-                i = k
-                continue
-            tokens.append(Tok(NUM, s[i:j]))
-            i = j
-            continue
-
-        if c == '(':
-            tokens.append(Tok(LP, '('))
-            i += 1
-            continue
-        if c == ')':
-            tokens.append(Tok(RP, ')'))
-            i += 1
-            continue
-        if c == '>':
-            tokens.append(Tok(GT, '>'))
-            i += 1
-            continue
-        if c == '<':
-            tokens.append(Tok(LT, '<'))
-            i += 1
-            continue
-
-        tokens.append(Tok(ID, c))
-        i += 1
-
-    tokens.append(Tok(EOF, ''))
-    return tokens
-
-
-# AST
-
-@dataclass
-class Node:
-    pass
-
-
-@dataclass
-class Term(Node):
-    text: str  # raw token text
-
-
-@dataclass
-class Year(Node):
-    op: str    # '>' or '<'
-    year: str  # digits
-
-
-@dataclass
-class Func(Node):
-    name: str
-    arg: Node
-
-
-@dataclass
-class Bin(Node):
-    op: str       # 'AND' or 'OR'
-    left: Node
-    right: Node
-
-
-class Parser:
-    def __init__(self, tokens: List[Tok]):
-        self.toks = tokens
-        self.i = 0
-
-    def peek(self) -> Tok:
-        return self.toks[self.i]
-
-    def consume(self) -> Tok:
-        tok = self.toks[self.i]
-        self.i += 1
-        return tok
-
-    def expect(self, typ: str) -> Tok:
-        tok = self.peek()
-        if tok.typ != typ:
-            raise ValueError(f"Expected {typ}, got {tok}")
-        return self.consume()
-
-    def parse(self) -> Node:
-        node = self.parse_or()
-        if self.peek().typ != EOF:
-            raise ValueError("Extra tokens at end")
-        return node
-
-    def parse_or(self) -> Node:
-        node = self.parse_and()
-        while self.peek().typ == OR:
-            self.consume()
-            rhs = self.parse_and()
-            node = Bin('OR', node, rhs)
-        return node
-
-    def parse_and(self) -> Node:
-        node = self.parse_primary()
-        while True:
-            tok = self.peek()
-            if tok.typ == AND:
-                self.consume()
-                rhs = self.parse_primary()
-                node = Bin('AND', node, rhs)
-            else:
-                # implicit AND between adjacent primaries
-                if tok.typ in (ID, QUOT, NUM, LP):
-                    rhs = self.parse_primary()
-                    node = Bin('AND', node, rhs)
-                else:
-                    break
-        return node
-
-    def parse_primary(self) -> Node:
-        tok = self.peek()
-        if tok.typ == LP:
-            self.consume()
-            expr = self.parse_or()
-            self.expect(RP)
-            return expr
-        if tok.typ == ID:
-            id_tok = self.consume()
-            name_up = id_tok.val.upper()
-            if name_up == 'PUBYEAR':
-                next_tok = self.peek()
-                if next_tok.typ == GT:
-                    self.consume()
-                    year_tok = self.expect(NUM)
-                    return Year('>', year_tok.val)
-                if next_tok.typ == LT:
-                    self.consume()
-                    year_tok = self.expect(NUM)
-                    return Year('<', year_tok.val)
-                raise ValueError("PUBYEAR must be followed by '>' or '<'")
-            if self.peek().typ == LP:
-                self.consume()
-                arg = self.parse_or()
-                self.expect(RP)
-                return Func(id_tok.val, arg)
-            return Term(id_tok.val)
-        if tok.typ == QUOT:
-            self.consume()
-            return Term(tok.val)
-        if tok.typ == NUM:
-            self.consume()
-            return Term(tok.val)
-        raise ValueError(f"Unexpected token {tok}")
-
-
-def distribute(node: Node) -> Node:
-    if isinstance(node, Bin):
-        return Bin(node.op, distribute(node.left), distribute(node.right))
-    if isinstance(node, Func):
-        return distribute_func(node.name, node.arg)
-    return node
 
+from app.lazy import lazy_module
+from app.metrics import upstream_call
+from app.single_flight import SingleFlight
+from app.query_compiler import Bin, Func, Node, Term, Year, compile_query
 
-def distribute_func(name: str, arg: Node) -> Node:
-    arg = distribute(arg)
-    if isinstance(arg, Bin):
-        return Bin(arg.op,
-                   distribute_func(name, arg.left),
-                   distribute_func(name, arg.right))
-    return Func(name, arg)
+atoma = lazy_module("atoma")
 
+logger = logging.getLogger('arxiv')
 
-def to_str(node: Node, parent_prec: int = 0) -> str:
-    if isinstance(node, Bin):
-        prec = 1 if node.op == 'OR' else 2
-        left_s = to_str(node.left, prec)
-        right_s = to_str(node.right, prec + 1)
-        s = f"{left_s} {node.op} {right_s}"
-        if prec < parent_prec:
-            return f"({s})"
-        return s
-    if isinstance(node, Func):
-        return f"{node.name}({to_str(node.arg, 0)})"
-    if isinstance(node, Year):
-        return f"PUBYEAR {node.op} {node.year}"
-    if isinstance(node, Term):
-        return node.text
-    raise TypeError(node)
+_flights = SingleFlight("arxiv")
 
 
 def canonicalize(query: str) -> Node:
-    tokens = tokenize(query)
-    ast = Parser(tokens).parse()
-    return distribute(ast)
+    return compile_query(query).distributed()
 
 
 # Conversion to target query language
@@ -349,6 +112,9 @@ def to_target(node: Node, parent_prec: int = 0,
         if node.op == '<':
             # PUBYEAR < YYYY -> [BEGIN_STR TO YYYY01010000]
             return f'submittedDate:[{BEGIN_STR} TO {node.year}01010000]'
+        if node.op == '=':
+            # PUBYEAR = YYYY -> [YYYY01010000 TO (YYYY+1)01010000]
+            return f'submittedDate:[{node.year}01010000 TO {int(node.year) + 1}01010000]'
         raise ValueError(f"Unknown PUBYEAR operator {node.op}")
 
     if isinstance(node, Term):
@@ -358,9 +124,36 @@ def to_target(node: Node, parent_prec: int = 0,
     raise TypeError(node)
 
 
+def _translate(query: str):
+    """
+    Translate once per compiled query. Returns (target, None) or
+    (None, (unsupported_messages, error)) so that failures can be replayed.
+    """
+    messages: List[str] = []
+    try:
+        return to_target(canonicalize(query), on_unsupported=messages.append), None
+    except ValueError as e:
+        return None, (messages, e)
+
+
 def convert_query(query: str, on_unsupported: Optional[Callable[[str], None]] = None) -> str:
-    ast = canonicalize(query)
-    return to_target(ast, on_unsupported=on_unsupported)
+    target, failure = compile_query(query).derive("arxiv", lambda: _translate(query))
+    if failure is not None:
+        messages, error = failure
+        if on_unsupported:
+            for msg in messages:
+                try:
+                    on_unsupported(msg)
+                except Exception:
+                    pass
+        raise ValueError(str(error))
+    return target
+
+
+def _fetch(query):
+    with upstream_call("arxiv"):
+        with libreq.urlopen(f'http://export.arxiv.org/api/query?search_query={query}&start=0&max_results=1000') as url:
+            return url.read()
 
 
 def get_arxiv_results(scopus_query: str,
@@ -368,9 +161,9 @@ def get_arxiv_results(scopus_query: str,
     
     try:
         query = quote(convert_query(scopus_query, on_unsupported=on_unsupported), safe='')
-        print(f"arxive query: {query}")
-        with libreq.urlopen(f'http://export.arxiv.org/api/query?search_query={query}&start=0&max_results=1000') as url:
-            return atoma.parse_atom_bytes(url.read())
+        logger.debug("arxiv query: %s", query)
+        body = _flights.do(query, lambda: _fetch(query))
+        return atoma.parse_atom_bytes(body)
     except:
         return atoma.parse_atom_bytes('<?xml version="1.0" encoding="UTF-8"?><feed xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" xmlns:arxiv="http://arxiv.org/schemas/atom" xmlns="http://www.w3.org/2005/Atom" ><id>https://arxiv.org/api/cHxbiOdZaP56ODnBPIenZhzg5f8</id></feed>'.encode("UTF-8"))
 
@@ -2,8 +2,7 @@
 import pickle
 import csv
 import datetime
-from datetime import timedelta, timezone
-import json
+from datetime import timezone
 import logging
 import os
 import re
@@ -11,29 +10,21 @@ import urllib.parse
 from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Iterable, List, Set, Tuple
-import tempfile
-import contextlib
+import time
 from urllib.error import HTTPError
 from concurrent.futures import as_completed, wait, FIRST_COMPLETED
 from threading import Lock
 
 
 # Third-party libraries
-import dateparser
-import pycountry
 import pytz
-import requests
-from Levenshtein.StringMatcher import distance
-from feedgen.feed import FeedGenerator
 from flask import copy_current_request_context
-from requests_cache import CachedSession, FileCache, RedisCache
+from requests_cache import RedisCache
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.exc import MultipleResultsFound
 from sqlalchemy import or_
-from urllib3.util import Retry
 
 # pyalex (third-party, grouped separately for clarity)
-import pyalex
 from pyalex import Authors, Funders, Institutions, Publishers, Sources, Topics, Works, config as pyalex_config
 
 # Local application
@@ -48,6 +39,23 @@ from app.main import (
 )
 from app.model import PublicationSource, Ranking, NetworkData
 from app.arxiv import get_arxiv_results
+from app.http_client import get_session, register_upstream
+from app.openalex_client import install as install_openalex_session
+from app.write_behind import write_behind
+from app.metrics import MeteredThreadPoolExecutor, PhaseTimer, registry
+from app.search_jobs import SearchJob, load_snapshot, search_jobs
+from app.query_analyzer import SubqueryScoreMemo
+from app.lazy import lazy_module
+from app import abstracts, jsoncodec
+from app.records import Paper
+from app.abstract_recovery import abstract_recovery, recovered
+
+# heavy and only needed on some paths: imported on first use
+dateparser = lazy_module("dateparser")
+pycountry = lazy_module("pycountry")
+feedgen_feed = lazy_module("feedgen.feed")
+string_matcher = lazy_module("Levenshtein.StringMatcher")
+citation_analytics = lazy_module("app.citation_analytics")
 
 pyalex_config.email = os.getenv("PYALEX_EMAIL", "nico@scholar.miage.dev")
 pyalex_config.max_retries = 3
@@ -66,66 +74,96 @@ def _get_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
     with _executor_lock:
         executor = _executor_pool.get(name)
         if executor is None:
-            executor = ThreadPoolExecutor(max_workers=max_workers)
+            executor = MeteredThreadPoolExecutor(name, max_workers)
             _executor_pool[name] = executor
         return executor
 
 
+OPENALEX_WORKERS = 8
+SCOPUS_WORKERS = 5
+
+
 def get_openalex_executor() -> ThreadPoolExecutor:
-    return _get_executor("openalex", 8)
+    return _get_executor("openalex", OPENALEX_WORKERS)
 
 
 def get_scopus_executor() -> ThreadPoolExecutor:
-    return _get_executor("scopus", 5)
+    return _get_executor("scopus", SCOPUS_WORKERS)
 
 
 def get_arxiv_executor() -> ThreadPoolExecutor:
     return _get_executor("arxiv", 3)
 
-_DOI_PREFIX_RE = re.compile(r"^https?://(?:dx\.)?doi\\.org/", flags=re.I)
-_OA_PREFIX_RE = re.compile(r"^https?://openalex\\.org/", flags=re.I)
 
+def get_query_analysis_executor() -> ThreadPoolExecutor:
+    return _get_executor("query_analysis", 4)
 
 
-def _cached_requests_session():
-    REDIS_URL = os.environ.get("REDIS_URL", "")
+def get_crossref_executor() -> ThreadPoolExecutor:
+    # Crossref's polite pool asks for a handful of concurrent requests at most
+    return _get_executor("crossref", 3)
 
-    if REDIS_URL:
-        redis_host, redis_port = REDIS_URL.split(":")
-        s = CachedSession(
-            'openAlexCAche',
-            backend='redis',
-            host=redis_host,
-            port=redis_port,
-            expire_after=timedelta(days=365),
-            allowable_methods=['GET'],
-            stale_if_error=True,
-        )
-    else:
-        s = CachedSession(
-            backend=FileCache(),
-            expire_after=timedelta(days=1),
-            allowable_methods=['GET'],
-            stale_if_error=True,
-        )
 
-    retries = Retry(
-        total=pyalex.config.max_retries,
-        backoff_factor=pyalex.config.retry_backoff_factor,
-        status_forcelist=pyalex.config.retry_http_codes,
-        allowed_methods=frozenset({"GET"}),
-    )
-    s.mount("https://", requests.adapters.HTTPAdapter(max_retries=retries))
-    return s
+# pooled sessions for the upstreams called from the executors above, one connection per worker
+register_upstream("scopus_abstract", pool_maxsize=SCOPUS_WORKERS, timeout=30)
+register_upstream("semanticscholar", pool_maxsize=OPENALEX_WORKERS, timeout=10)
+
+# one cached, pooled session for every pyalex call, sized to the openalex executor
+install_openalex_session(pool_maxsize=OPENALEX_WORKERS)
 
+_DOI_PREFIX_RE = re.compile(r"^https?://(?:dx\.)?doi\\.org/", flags=re.I)
+_OA_PREFIX_RE = re.compile(r"^https?://openalex\\.org/", flags=re.I)
 
-pyalex._get_requests_session = _cached_requests_session
 
 
 logger = logging.getLogger('business')
 
 MAX_RESULTS_QUERY = 1000
 
+# Entry fields of the Scopus search API read by load_response_from_scpus, load_response_from_openAlex_scopus,
+# get_first_auth_affil/get_first_auth_country and fetch_scopus_batch. Reading another field means adding it here.
+SCOPUS_SEARCH_FIELDS = (
+    "dc:identifier", "prism:doi", "dc:title", "dc:creator",
+    "prism:coverDate", "prism:coverDisplayDate", "prism:publicationName", "prism:issn", "prism:eIssn",
+    "openaccessFlag", "affilname", "affiliation-country",
+)
+SCPUS_SEARCH = f"{SCPUS_BACKEND}&field={','.join(SCOPUS_SEARCH_FIELDS)}"
+
+# what the projection may still return around the requested fields
+_SCOPUS_ENTRY_EXTRA = {"@_fa", "affiliation", "error", "link"}
+_SCOPUS_ENTRY_FIELDS = (set(SCOPUS_SEARCH_FIELDS) - {"affilname", "affiliation-country"}) | _SCOPUS_ENTRY_EXTRA
+
+scopus_shape_issues = registry.counter(
+    "scholar_scopus_shape_issues_total",
+    "Scopus search pages not shaped as expected: no_results_key, no_entries, unprojected (field= ignored).",
+    ("issue",))
+
+
+def check_scopus_shape(payload):
+    """
+    search-results of a Scopus search page, {} when missing. Deviations from the
+    projected shape are counted and logged, they mean the API changed under us.
+    """
+    results = payload.get("search-results") if isinstance(payload, dict) else None
+    if results is None:
+        scopus_shape_issues.inc("no_results_key")
+        logger.warning("scopus search page without search-results: %.200s", payload)
+        return {}
+    entries = results.get("entry")
+    if not isinstance(entries, list):
+        scopus_shape_issues.inc("no_entries")
+        return results
+    extra = {key for entry in entries for key in entry} - _SCOPUS_ENTRY_FIELDS
+    if extra:
+        scopus_shape_issues.inc("unprojected")
+        logger.warning("scopus ignored the field projection, got %s", sorted(extra)[:10])
+    return results
+
+
+def fetch_scopus_page(escaped_query, offset, count):
+    """One page of a Scopus search, projected on SCOPUS_SEARCH_FIELDS."""
+    return check_scopus_shape(session_scpus.get(SCPUS_SEARCH % (offset, count, escaped_query)).json())
+
 
 def get_sources():
     sources = db.session.query(PublicationSource).all()
@@ -139,7 +177,7 @@ def get_sources():
 
 
 def generate_rss(feed_items, id="id", query="query"):
-    fg = FeedGenerator()
+    fg = feedgen_feed.FeedGenerator()
     for item in reversed(feed_items):
         fe = fg.add_entry()
         for key, value in item.items():
@@ -228,7 +266,7 @@ def get_ranking(conf_or_journal):
     ranks = ranks.order_by(Ranking.source.desc()).all()
     for rank in ranks:
         rank_title = rank.title.lower().replace("proceedings of", "")
-        if rank_title in conf_or_journal_lower or conf_or_journal_lower in rank_title or distance(conf_or_journal_lower, rank_title) < 5:
+        if rank_title in conf_or_journal_lower or conf_or_journal_lower in rank_title or string_matcher.distance(conf_or_journal_lower, rank_title) < 5:
             rank_dto_title = rank_dto_converter(rank)
             break
 
@@ -296,27 +334,64 @@ def refresh_ranking():
 
 
 def get_ref_for_doi(doi):
-    resp = requests.get(SCPUS_ABTRACT_BACKEND %
-                        doi, headers={"Accept": "application/json"})
+    resp = get_session("scopus_abstract").get(SCPUS_ABTRACT_BACKEND %
+                                              doi, headers={"Accept": "application/json"})
     result = resp.json()
     #print(result)
 
 
+class SearchContext:
+    """
+    What counting a query already fetched: the counts, the first Scopus page and the
+    arXiv feed. Handed to get_papers so the fetch that follows a count does not
+    request them again.
+    """
+
+    PAGE_SIZE = 25
+
+    def __init__(self, query, include_arxiv, count_scopus=0, first_page=None, arxiv_entries=None):
+        self.query = query
+        self.include_arxiv = include_arxiv
+        self.count_scopus = count_scopus
+        self.first_page = first_page or []
+        self.arxiv_entries = arxiv_entries if arxiv_entries is not None else []
+        self.created = time.monotonic()
+        # speculative prefetch started for this count, see start_prefetch
+        self.prefetch: SearchJob | None = None
+
+    def cancel_prefetch(self, reason):
+        if self.prefetch is not None:
+            self.prefetch.cancel(reason)
+
+    @property
+    def count_arxiv(self):
+        return len(self.arxiv_entries)
+
+    def matches(self, query, include_arxiv, max_age=600):
+        return (self.query == query and self.include_arxiv == include_arxiv
+                and time.monotonic() - self.created < max_age)
+
+
 def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwargs: None,
-               existing_data={}, count_arxiv=0, arxiv_warning=None):
+               existing_data={}, count_arxiv=0, arxiv_warning=None, job: SearchJob | None = None,
+               search_context: SearchContext | None = None):
+    # cancelling the job drops the queued tasks, stops the loop below and silences emitt
+    job = job or SearchJob()
+    emitt = job.emitter(emitt)
+    phases = PhaseTimer("get_papers")
     context = type('', (object,), {"success": 0, "failed": 0, "arxiv": 0, "duplicate": 0})()
     context_lock = Lock()
     client_results_bucket_size = min(max(10, count_scopus / 20), 200)
     client_bucket = []
     title_lock = Lock()
-    title_index: Dict[str, Dict] = {}
+    title_index: Dict[str, Paper] = {}
 
     @copy_current_request_context
     def call_back(success, failure, arxiv=0, duplicate=0):
         emitt('doi_update', {"total": count_scopus + count_arxiv,
                              "done": success, "failed": failure, "arxiv": arxiv, "duplicate": duplicate})
 
-    def upsert_paper(paper: Dict, priority: str):
+    def upsert_paper(paper: Paper, priority: str):
         title = paper.get("title", "")
         if not title:
             return paper, False
@@ -335,20 +410,26 @@ def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwa
             title_index[title] = paper
             return paper, False
 
+    first_results = True
+
     def emit_results_if_needed():
-        nonlocal client_bucket
+        nonlocal client_bucket, first_results
         if len(client_bucket) > client_results_bucket_size:
             emitt('doi_results', client_bucket)
             client_bucket = []
+            if first_results:
+                phases.since_start("first_results")
+                first_results = False
+
+    escaped_query = escape_query(query)
 
     def fetch_scopus_batch(offset):
         try:
-            #print(f"SCPUS_BACKEND {SCPUS_BACKEND % (offset, 25, escape_query(query))}")
-            partial_results = session_scpus.get(
-                SCPUS_BACKEND % (offset, 25, escape_query(query))).json()
-
-            #print(f'{partial_results["search-results"]}')
-            entries = partial_results["search-results"]["entry"]
+            if offset == 0 and search_context is not None:
+                # fetched by the count already
+                entries = search_context.first_page
+            else:
+                entries = fetch_scopus_page(escaped_query, offset, 25)["entry"]
 
             entries = [entry for entry in entries if (entry.get(
                 'prism:doi') and f"https://doi.org/{entry.get('prism:doi').lower()}" not in existing_data.keys()) or not entry.get('prism:doi')]
@@ -358,6 +439,8 @@ def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwa
             return ("scopus", [])
 
     def fetch_arxiv_entries():
+        if search_context is not None:
+            return ("arxiv", search_context.arxiv_entries)
         try:
             return ("arxiv", get_arxiv_results(query, on_unsupported=arxiv_warning).entries)
         except ValueError:
@@ -367,10 +450,8 @@ def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwa
         bucket = []
         try:
             if xref:
-                logger.info("enriching from openalex")
                 extract_data_openalex_from_scopus(bucket, entry, context, call_back)
             else:
-                logger.info("not enriching from openalex")
                 extract_data_scopus(bucket, entry, context, call_back)
         except Exception as exc:
             logger.exception("Failed to enrich scopus entry", exc_info=exc)
@@ -400,7 +481,7 @@ def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwa
                 load_response_from_openAlex_arxiv(bucket, work, paper, override_id)
             else:
                 authors_list = [{"display_name": a.name, "orcid": "", "openalex": ""} for a in paper.authors]
-                bucket.append({
+                bucket.append(Paper.from_wire({
                     "doi": override_id,
                     "title": title,
                     "year": paper.published.year,
@@ -422,7 +503,7 @@ def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwa
                     "X-authors": ", ".join([a.name for a in paper.authors]),
                     "X-authors-list": authors_list,
                     "X-OA-URL": paper.links[0].href if paper.links else "",
-                })
+                }))
         except Exception as exc:
             logger.exception("Failed to enrich arXiv entry", exc_info=exc)
         return ("arxiv", bucket)
@@ -432,31 +513,34 @@ def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwa
 
     batch_offsets = list(range(0, min(MAX_RESULTS_QUERY, count_scopus), 25))
     for offset in batch_offsets:
-        provider_futures.add(get_scopus_executor().submit(fetch_scopus_batch, offset))
+        provider_futures.add(job.submit(get_scopus_executor(), fetch_scopus_batch, offset))
 
     if arxiv:
-        provider_futures.add(get_arxiv_executor().submit(fetch_arxiv_entries))
+        provider_futures.add(job.submit(get_arxiv_executor(), fetch_arxiv_entries))
 
     def submit_enrichment(provider_name, payload):
         if provider_name == "scopus":
             if xref:
                 #logger.debug("sumitting enrichment from openalex")
-                return get_openalex_executor().submit(enrich_scopus_entry, payload)
+                return job.submit(get_openalex_executor(), enrich_scopus_entry, payload)
             #logger.debug("just loading data from scopus")
-            return get_scopus_executor().submit(enrich_scopus_entry, payload)
+            return job.submit(get_scopus_executor(), enrich_scopus_entry, payload)
         if provider_name == "arxiv":
-            return get_openalex_executor().submit(enrich_arxiv_entry, payload)
+            return job.submit(get_openalex_executor(), enrich_arxiv_entry, payload)
         raise ValueError(f"Unknown provider {provider_name}")
 
-    while provider_futures or enrichment_futures:
-        done, _ = wait(provider_futures | enrichment_futures, return_when=FIRST_COMPLETED)
+    while (provider_futures or enrichment_futures) and not job.cancelled:
+        done, _ = wait(provider_futures | enrichment_futures | {job.signal}, return_when=FIRST_COMPLETED)
         for fut in done:
+            if job.cancelled:
+                break
             if fut in provider_futures:
                 provider_futures.remove(fut)
                 provider_name, payloads = fut.result()
                 for payload in payloads:
-                    logger.info(f"enrichment request submitted for {provider_name}")
                     enrichment_futures.add(submit_enrichment(provider_name, payload))
+                if not provider_futures:
+                    phases.mark("search")
             else:
                 enrichment_futures.remove(fut)
                 provider_name, bucket = fut.result()
@@ -474,11 +558,18 @@ def get_papers(count_scopus, query, xref, arxiv=False, emitt=lambda *args, **kwa
                             call_back(context.success, context.failed, context.arxiv, context.duplicate)
                 emit_results_if_needed()
 
+    if job.cancelled:
+        return list(title_index.values())
+
+    phases.mark("enrichment")
     if client_bucket:
         emitt('doi_results', client_bucket)
 
     dois = list(title_index.values())
     emitt('doi_export_done', dois)
+    # the search does not wait for these, they arrive later as doi_patch events
+    abstract_recovery.recover(dois, emitt)
+    phases.done()
     return dois
 
 
@@ -585,7 +676,7 @@ def extract_data_arxiv(dois, bucket, arxiv_results, context, call_back,
                 load_response_from_openAlex_arxiv(
                     local_bucket, work, paper, id_overrides.get(paper.id_, paper.id_))
             else:
-                local_bucket.append({"doi": id_overrides.get(paper.id_, paper.id_), "title": paper.title.value,
+                local_bucket.append(Paper.from_wire({"doi": id_overrides.get(paper.id_, paper.id_), "title": paper.title.value,
                                    "year": paper.published.year,
                                    "x-precise-date": str(paper.published),
                                    "pubtitle": "arXiv.org",
@@ -605,7 +696,7 @@ def extract_data_arxiv(dois, bucket, arxiv_results, context, call_back,
                                    "X-authors": ", ".join([a.name for a in paper.authors]),
                                    "X-authors-list":  authors_list,
                                    "X-OA-URL": paper.links[0].href
-                                   })
+                                   }))
             arxiv_added = 1
         return local_bucket, arxiv_added, duplicate_added
 
@@ -658,7 +749,7 @@ def load_response_from_scpus(bucket, entry):
         
     
     bucket.append(
-        {"doi": doi,
+        Paper.from_wire({"doi": doi,
          "issn": issn,
          "title": entry.get("dc:title", "-"),
          "year": year,
@@ -672,7 +763,7 @@ def load_response_from_scpus(bucket, entry):
          "X-FirstAuthor-ORCID": "",
          "X-authors": entry.get('dc:creator', "unknown"),
          "X-authors-list": authors_list
-         })
+         }))
 
 
 def get_first_auth_affil(entry):
@@ -698,13 +789,77 @@ def get_first_auth_country(entry):
 
 
 def inverted_abstrct_to_abstract(ia):
+    """Text of an OpenAlex abstract_inverted_index ({word: [positions]}), words placed by position."""
     if not ia:
         return ""
-    iaa = {}
-    for k, vv in ia.items():
-        for v in vv:
-            iaa[v] = k
-    return " ".join([iaa[k] for k in sorted(iaa.keys())])
+    words = []
+    for word, positions in ia.items():
+        for position in positions:
+            if position >= len(words):
+                words.extend([None] * (position + 1 - len(words)))
+            words[position] = word
+    return " ".join([word for word in words if word is not None])
+
+
+OPENALEX_DOI_BATCH = 50
+
+
+def openalex_abstracts(dois):
+    """{doi: abstract} read back from OpenAlex, OPENALEX_DOI_BATCH DOIs per request."""
+    wanted = {doi.lower(): doi for doi in dois if doi.startswith("https://doi.org/") and "," not in doi}
+    found = {}
+    keys = list(wanted)
+    for start in range(0, len(keys), OPENALEX_DOI_BATCH):
+        batch = keys[start:start + OPENALEX_DOI_BATCH]
+        try:
+            works = Works().filter(doi="|".join(batch)).select(["doi", "abstract_inverted_index"]) \
+                .get(per_page=OPENALEX_DOI_BATCH)
+        except Exception:
+            logger.warning("fetching %d abstracts from OpenAlex failed", len(batch), exc_info=True)
+            continue
+        for work in works:
+            doi = wanted.get((work.get("doi") or "").lower())
+            abstract = inverted_abstrct_to_abstract(work.get("abstract_inverted_index"))
+            if doi and abstract:
+                found[doi] = abstract
+    return found
+
+
+def _job_abstracts(job_id, ids):
+    job = search_jobs.get(job_id)
+    snapshot = job.snapshot() if job is not None else load_snapshot(job_id)
+    if snapshot is None:
+        return {}
+    wanted = set(ids)
+    return {paper["doi"]: paper["X-abstract"] for paper in snapshot["results"]
+            if paper.get("doi") in wanted and paper.get("X-abstract")}
+
+
+def find_abstracts(ids, job_id=None):
+    """
+    {id: abstract} of search results sent without their abstract (see app.abstracts).
+    The in-process cache answers first. What it no longer holds is read back from
+    the search job's persisted results, then from the recovered abstracts, then
+    from OpenAlex; whatever is found goes back into the cache.
+    """
+    ids = list(dict.fromkeys(ids))[:abstracts.MAX_IDS]
+    found = abstracts.lookup(ids)
+    sources = [recovered, openalex_abstracts]
+    if job_id is not None:
+        sources.insert(0, lambda missing: _job_abstracts(job_id, missing))
+    for source in sources:
+        missing = [paper_id for paper_id in ids if paper_id not in found]
+        if not missing:
+            break
+        try:
+            fetched = source(missing)
+        except Exception:
+            logger.exception("reading abstracts back failed")
+            continue
+        for paper_id, abstract in fetched.items():
+            abstracts.remember(paper_id, abstract)
+        found.update(fetched)
+    return found
 
 
 def _strip_markup(text: str) -> str:
@@ -730,7 +885,7 @@ def get_abstract_semanticscholar(doi: str):
     """
     url = f"https://api.semanticscholar.org/graph/v1/paper/DOI:{doi}"
     params = {"fields": "title,abstract"}
-    r = requests.get(url, timeout=10)
+    r = get_session("semanticscholar").get(url, params=params)
     if r.status_code != 200:
         logger.warning("Abstract retrieval from Semantic Scholar failed for DOI %s (status %s)", doi, r.status_code)
         return None
@@ -738,112 +893,6 @@ def get_abstract_semanticscholar(doi: str):
     return data.get("abstract", "") or ""
 
 
-def _download_pdf_to_temp(url: str) -> str | None:
-    """Download a PDF to a temporary file and return its filepath, or None on failure."""
-    try:
-        r = requests.get(url, timeout=30, allow_redirects=True)
-        if r.status_code != 200:
-            return None
-        content_type = r.headers.get("Content-Type", "").lower()
-        is_pdf = r.content.startswith(
-            b"%PDF") or "application/pdf" in content_type
-        if not is_pdf:
-            return None
-        fd, path = tempfile.mkstemp(prefix="oa_pdf_", suffix=".pdf")
-        with os.fdopen(fd, "wb") as f:
-            f.write(r.content)
-        return path
-    except Exception:
-        return None
-
-
-def _extract_abstract_from_pdf_file(pdf_path: str) -> str:
-    """Use a local GROBID service to extract abstract from a PDF file path."""
-    try:
-        with open(pdf_path, "rb") as f:
-            files = {"input": (os.path.basename(
-                pdf_path), f, "application/pdf")}
-            grobid = requests.post(
-                "http://localhost:8070/api/processHeaderDocument", files=files, timeout=45,
-                headers={"Accept": "application/xml"}
-            )
-        if grobid.status_code != 200:
-            return ""
-        import xml.etree.ElementTree as ET
-        root = ET.fromstring(grobid.text)
-        abs_nodes = root.findall(".//{*}abstract")
-        return " ".join(" ".join(n.itertext()).strip() for n in abs_nodes).strip()
-    except Exception:
-        return ""
-
-
-def _unpaywall_pdf_url(doi: str, email: str) -> str | None:
-    """Return Unpaywall best PDF URL for a DOI, or None."""
-    try:
-        url = f"https://api.unpaywall.org/v2/{doi}"
-        params = {"email": email}
-        r = requests.get(url, params=params, timeout=10)
-        if r.status_code != 200:
-            return None
-        data = r.json()
-        oa = data.get("best_oa_location") or {}
-        return oa.get("url_for_pdf") or None
-    except Exception:
-        return None
-
-
-def get_abstract_unpaywall(doi: str, email: str) -> str | None:
-    """
-    Retrieve abstract via Unpaywall (PDF) using GROBID. Returns empty string on failure.
-    The PDF download is delegated to a helper and the file is cleaned up.
-    """
-    pdf_url = _unpaywall_pdf_url(doi, email)
-    if not pdf_url:
-        return None
-    pdf_path = _download_pdf_to_temp(pdf_url)
-    if not pdf_path:
-        return ""
-    try:
-        return _extract_abstract_from_pdf_file(pdf_path)
-    finally:
-        with contextlib.suppress(Exception):
-            os.remove(pdf_path)
-
-
-def get_abstract_from_pdf_sources(doi: str, openalex_oa_url: str | None, email: str) -> str:
-    """
-    Try to extract abstract from a PDF by first downloading via OpenAlex OA URL,
-    then falling back to Unpaywall's PDF URL. Ensures temporary files are removed.
-    Returns empty string if extraction fails.
-    """
-    # 1) Try OpenAlex OA URL first
-    if openalex_oa_url:
-        pdf_path = _download_pdf_to_temp(openalex_oa_url)
-        if pdf_path:
-            try:
-                abstract = _extract_abstract_from_pdf_file(pdf_path)
-                if abstract:
-                    return abstract
-            finally:
-                with contextlib.suppress(Exception):
-                    os.remove(pdf_path)
-
-    # 2) Fallback: Unpaywall best PDF
-    pdf_url = _unpaywall_pdf_url(doi, email)
-    if pdf_url:
-        pdf_path = _download_pdf_to_temp(pdf_url)
-        if pdf_path:
-            try:
-                abstract = _extract_abstract_from_pdf_file(pdf_path)
-                if abstract:
-                    return abstract
-            finally:
-                with contextlib.suppress(Exception):
-                    os.remove(pdf_path)
-
-    return ""
-
-
 def load_response_from_openAlex_scopus(bucket, openalex_response, entry):
 
     
@@ -857,10 +906,7 @@ def load_response_from_openAlex_scopus(bucket, openalex_response, entry):
     #if not abstract:
     #    abstract = get_abstract_semanticscholar(openalex_response["doi"])
 
-    # it's too slow
-    # if not abstract:
-    #     abstract = get_abstract_from_pdf_sources(
-    #         r["doi"], oa_url, "nicolas.herbaut@u-bordeaux.fr")
+    # missing abstracts are recovered from the PDF once the search is done, see app.abstract_recovery
     if not abstract:
         abstract = ""
 
@@ -869,7 +915,7 @@ def load_response_from_openAlex_scopus(bucket, openalex_response, entry):
             'dc:creator', "unknown"), "orcid": "", "openalex": ""}]
     title = _strip_markup(openalex_response.get("title", ""))
 
-    bucket.append({"doi": openalex_response["doi"], "title": title,
+    bucket.append(Paper.from_wire({"doi": openalex_response["doi"], "title": title,
                    "year": openalex_response["publication_year"],
                    "x-precise-date": openalex_response["publication_date"],
                    "pubtitle": entry.get('prism:publicationName', ""),
@@ -890,7 +936,7 @@ def load_response_from_openAlex_scopus(bucket, openalex_response, entry):
                    "X-authors-list": authors_list,
                    "X-OA-URL": oa_url or ""
 
-                   })
+                   }))
 
 
 def load_response_from_openAlex_arxiv(bucket, work, paper, resolved_id):
@@ -929,7 +975,7 @@ def load_response_from_openAlex_arxiv(bucket, work, paper, resolved_id):
     primary_topic = from_obj(work, "primary_topic", {}) or {}
     subjects = from_obj(primary_topic, "display_name", "")
 
-    bucket.append({
+    bucket.append(Paper.from_wire({
         "doi": resolved_id,
         "title": from_obj(work, "title", paper.title.value if getattr(paper, "title", None) else ""),
         "year": from_obj(work, "publication_year", getattr(getattr(paper, "published", None), "year", "")),
@@ -951,7 +997,7 @@ def load_response_from_openAlex_arxiv(bucket, work, paper, resolved_id):
         "X-authors": ", ".join(a["display_name"] for a in authors_list) if authors_list else ", ".join([a.name for a in getattr(paper, "authors", [])]),
         "X-authors-list": authors_list if authors_list else [{"display_name": a.name, "orcid": "", "openalex": ""} for a in getattr(paper, "authors", [])],
         "X-OA-URL": oa_url or (paper.links[0].href if getattr(paper, "links", []) else "")
-    })
+    }))
 
 def load_response_from_xref(bucket, xref_json_resp, entry):
     first_author = [a for a in xref_json_resp.get(
@@ -983,7 +1029,7 @@ def load_response_from_xref(bucket, xref_json_resp, entry):
         rank_source = ""
         hindex = ""
 
-    bucket.append({"doi": xref_json_resp["DOI"], "title": xref_json_resp["title"][0],
+    bucket.append(Paper.from_wire({"doi": xref_json_resp["DOI"], "title": xref_json_resp["title"][0],
                    "year": xref_json_resp["created"]["date-parts"][0][0],
                    "x-precise-date": str(precise_date),
                    "pubtitle": xref_json_resp["container-title"][0],
@@ -1001,7 +1047,7 @@ def load_response_from_xref(bucket, xref_json_resp, entry):
                    "X-abstract": xref_json_resp.get("abstract", ""),
                    "X-authors": authors,
                    "X-authors-list": authors_list
-                   })
+                   }))
 
 
 def escape_query(query):
@@ -1009,21 +1055,114 @@ def escape_query(query):
 
 
 def count_results_for_query(query, include_arxiv=False, arxiv_warning=None):
-    # print(f"query with {API_KEY} API_KEY")
-    response = session_scpus.get(SCPUS_BACKEND %
-                                 (0, 1, escape_query(query))).json()
+    """
+    (scopus, arxiv) counts of query. Raises when Scopus gives no count rather than
+    reporting zero, so that a failed call is not taken (and memoized) as a real count.
+    """
+    results = fetch_scopus_page(escape_query(query), 0, 1)
 
-    if "search-results" in response:
+    if not results or "opensearch:totalResults" not in results:
+        raise RuntimeError(f"scopus returned no count for {query[:200]!r}")
+
+    count = int(results["opensearch:totalResults"])
+    if include_arxiv:
+        return count, len(get_arxiv_results(query, on_unsupported=arxiv_warning).entries)
+    return count, 0
+
+
+def count_search(query, include_arxiv=False, arxiv_warning=None) -> SearchContext:
+    """Count a query by fetching its first page of results, which get_papers then reuses."""
+    results = fetch_scopus_page(escape_query(query), 0, SearchContext.PAGE_SIZE)
+    if not results:
+        return SearchContext(query, include_arxiv)
+    arxiv_entries = get_arxiv_results(query, on_unsupported=arxiv_warning).entries if include_arxiv else []
+    return SearchContext(query, include_arxiv, int(results["opensearch:totalResults"]),
+                         results.get("entry", []), arxiv_entries)
+
+
+SPECULATIVE_PREFETCH = os.environ.get("SPECULATIVE_PREFETCH", "0") == "1"
+PREFETCH_MAX_RESULTS = int(os.environ.get("PREFETCH_MAX_RESULTS", "200"))
+PREFETCH_BUDGET = int(os.environ.get("PREFETCH_BUDGET", "1000"))  # upstream fetches per user and hour
+PREFETCH_WINDOW_SECONDS = 3600
+
+prefetch_tasks = registry.counter(
+    "scholar_prefetch_tasks_total", "Speculative fetches started after a count, by kind: page or enrichment.",
+    ("kind",))
+prefetch_denied = registry.counter(
+    "scholar_prefetch_budget_exhausted_total", "Speculative fetches skipped because the user's budget was spent.")
+
+
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    # small on purpose: speculative work must not take workers from real searches
+    return _get_executor("prefetch", 2)
+
+
+class PrefetchBudget:
+    """Upstream fetches a user may spend on speculative prefetch per window."""
+
+    def __init__(self, limit=PREFETCH_BUDGET, window=PREFETCH_WINDOW_SECONDS):
+        self.limit = limit
+        self.window = window
+        self._spent: Dict[str, Tuple[float, int]] = {}
+        self._lock = Lock()
+
+    def take(self, user):
+        now = time.monotonic()
+        with self._lock:
+            started, spent = self._spent.get(user, (now, 0))
+            if now - started > self.window:
+                started, spent = now, 0
+            if spent >= self.limit:
+                prefetch_denied.inc()
+                return False
+            self._spent[user] = (started, spent + 1)
+            return True
 
-        count = int(response["search-results"]["opensearch:totalResults"])
-        if include_arxiv:
-            return count, len(get_arxiv_results(query, on_unsupported=arxiv_warning).entries)
-            
-        else:
-            return count, 0
-    else:
 
-        return 0, 0
+prefetch_budget = PrefetchBudget()
+
+
+def start_prefetch(context: SearchContext, xref: bool, user: str) -> SearchJob | None:
+    """
+    Warm the caches for the get_dois that usually follows a count: the remaining
+    Scopus pages and, with xref, the OpenAlex work of each DOI, requested exactly
+    as get_papers will request them. get_papers then reads them from the in-process
+    cache, or joins the calls still in flight. Runs on the small prefetch executor
+    under the user's budget; cancel the returned job when the query changes.
+    """
+    if not SPECULATIVE_PREFETCH or not 0 < context.count_scopus <= PREFETCH_MAX_RESULTS:
+        return None
+    job = SearchJob()
+    executor = get_prefetch_executor()
+    escaped_query = escape_query(context.query)
+
+    def enrich(entries):
+        if not xref:
+            return
+        for entry in entries:
+            doi = entry.get("prism:doi")
+            if doi and prefetch_budget.take(user):
+                prefetch_tasks.inc("enrichment")
+                job.submit(executor, net_fetch_work, f"https://doi.org/{doi}")
+
+    def fetch_page(offset):
+        enrich(fetch_scopus_page(escaped_query, offset, SearchContext.PAGE_SIZE).get("entry", []))
+
+    for offset in range(SearchContext.PAGE_SIZE, min(MAX_RESULTS_QUERY, context.count_scopus), SearchContext.PAGE_SIZE):
+        if not prefetch_budget.take(user):
+            break
+        prefetch_tasks.inc("page")
+        job.submit(executor, fetch_page, offset)
+    enrich(context.first_page)
+    return job
+
+
+def count_results_for_query_sum(query):
+    return sum(count_results_for_query(query))
+
+
+# subquery scores shared by all query analyses, counts are cached for a day upstream anyway
+query_analysis_memo = SubqueryScoreMemo(max_entries=4096, ttl_seconds=3600)
 
 
 # NETWORK (BETA)
@@ -1110,6 +1249,7 @@ def net_extract_keywords(w: dict) -> List[str]:
 
 
 def net_get_graph_data(id):
+    write_behind.settle("networkdata", id)
     try:
         network_data = db.session.query(
             NetworkData).where(NetworkData.id == id).one()
@@ -1120,6 +1260,33 @@ def net_get_graph_data(id):
         return None, "Not Found"
 
 
+def net_get_graph_analytics(id, top_n: int = 50) -> dict | None:
+    """
+    Co-citation / bibliographic-coupling analytics of a stored network.
+    Graphs built before analytics were stored get them recomputed from their input works.
+    """
+    graph_data = net_get_graph_data(id)
+    if not isinstance(graph_data, (str, bytes)):
+        return None
+    graph = jsoncodec.loads(graph_data)
+    if "analytics" in graph:
+        return graph["analytics"]
+
+    executor = get_openalex_executor()
+    input_nodes = [n for n in graph.get("nodes", []) if n.get("type") == "work" and n.get("openalex")]
+    futures = {executor.submit(net_fetch_work, n["openalex"].rsplit("/", 1)[-1]): n["id"] for n in input_nodes}
+    works: Dict[str, dict] = {}
+    work_node_id: Dict[str, str] = {}
+    for fut in as_completed(futures):
+        w = fut.result()
+        if w:
+            wid = w["id"].rsplit("/", 1)[-1]
+            works[wid] = w
+            work_node_id[wid] = futures[fut]
+    min_count = (graph.get("meta") or {}).get("min_count", 2)
+    return citation_analytics.compute_citation_analytics(works, work_node_id, min_count=min_count, top_n=top_n)
+
+
 # -------------------------------------
 # Main function
 # -------------------------------------
@@ -1153,6 +1320,7 @@ def net_build_graph(
     # -------------------------
     if executor is None:
         executor = get_openalex_executor()
+    phases = PhaseTimer("net_build_graph")
 
     normalized_idents: List[str] = [
         net_normalize_input(raw) for raw in dois_or_ids]
@@ -1188,6 +1356,8 @@ def net_build_graph(
             "references_processed": 0
         })
 
+    phases.mark("fetch_inputs")
+
     # -----------------------------------
     # Phase 2a: build consistent work node IDs (FIX)
     # -----------------------------------
@@ -1216,6 +1386,12 @@ def net_build_graph(
             links_forward.append(
                 {"source": src, "target": rid, "kind": "forward"})
 
+    # -------------------------
+    # Phase 2b': co-citation / bibliographic-coupling analytics on the incidence matrix
+    # -------------------------
+    analytics = citation_analytics.compute_citation_analytics(works, work_node_id, min_count=min_count)
+    phases.mark("analytics")
+
     # -------------------------
     # Phase 2c: collect BACKWARD references (citing works)
     # -------------------------
@@ -1264,6 +1440,8 @@ def net_build_graph(
             "references_processed": len(counts_forward) + len(counts_back)
         })
 
+    phases.mark("fetch_citers")
+
     # -------------------------
     # Phase 3: build "work" nodes (inputs)
     # -------------------------
@@ -1328,6 +1506,8 @@ def net_build_graph(
             "references_processed": sum(counts_forward.values()) + len(nodes) + added_refs_fwd
         })
 
+    phases.mark("fetch_forward_refs")
+
     # -------------------------
     # Phase 4b: fetch retained BACKWARD reference works in parallel (NEW)
     # -------------------------
@@ -1366,6 +1546,8 @@ def net_build_graph(
             "references_processed": sum(counts_forward.values()) + sum(counts_back.values()) + len(nodes) + added_refs_back + added_refs_fwd
         })
 
+    phases.mark("fetch_backward_refs")
+
     # -------------------------
     # Phase 5: filter/assemble links
     # -------------------------
@@ -1388,10 +1570,12 @@ def net_build_graph(
     # Return graph
     # -------------------------
     top_keywords = dict(keyword_counter.most_common(200))
+    phases.done()
     return {
         "nodes": nodes,
         "links": links,
         "keywords": top_keywords,
+        "analytics": analytics,
         "meta": {
             "generated_at": datetime.date.today().isoformat(),
             "min_count": min_count,
@@ -1,113 +1,386 @@
 from requests_cache import CachedSession
 
 from requests_cache import CachedSession
+from collections import OrderedDict, defaultdict
 from datetime import timedelta
+from threading import Lock
 import os
 import logging
+import time
+
+import io
+import redis
+import requests
+import zlib
+from urllib3 import HTTPResponse
+from requests_cache import RedisCache
+from requests_cache.backends.redis import RedisDict
+from requests_cache.policy.expiration import get_expiration_datetime
+from requests_cache.serializers import SerializerPipeline, Stage, pickle_serializer
+
+from app.cache_maintenance import CACHE_BACKEND, NAMESPACES, make_file_backend, start_background_sweeps
+from app.metrics import MeteredHTTPAdapter, cache_requests, registry
+from app.single_flight import SingleFlight
+from app import jsoncodec
 
 logger = logging.getLogger('cache')
 
 
-def setup_fs_cache():
-    session_xref = CachedSession(
-        'xrefCache',
-        backend='filesystem',
-        use_cache_dir=True,
-        expire_after=timedelta(days=365),
-        allowable_methods=['GET'],
-        stale_if_error=True,
-    )
-    session_scpus = CachedSession(
-        'scpusCache',
-        backend='filesystem',
-        use_cache_dir=True,
-        expire_after=timedelta(days=1),
-        stale_if_error=True,
-    )
-    
-    session_orcid = CachedSession(
-        'orcid_session',
-       	backend='filesystem',
-        use_cache_dir=True,
-        expire_after=timedelta(days=7),
-        stale_if_error=True,
-    )
-    session_doi = CachedSession(
-        'session_doi',
-       	backend='filesystem',
-        use_cache_dir=True,
-        expire_after=timedelta(days=7),
-        stale_if_error=True,
-    )        
-        
-
-    return session_xref, session_scpus, session_orcid, session_doi
-
-
-def setup_redis_cache(redis_host, redis_port):
-    logger.info(f"setting up redis {redis_host} {redis_port}")
-    session_xref = CachedSession(
-        'xrefCache',
-        backend='redis',
-        host=redis_host,
-        port=redis_port,
-        expire_after=timedelta(days=365),
-        allowable_methods=['GET'],
-        stale_if_error=True,
-    )
-    session_scpus = CachedSession(
-        'scpusCache',
-        host=redis_host,
-        port=redis_port,
-        backend='redis',
-        use_cache_dir=True,
-        expire_after=timedelta(days=1),
-        stale_if_error=True,
-    )
-    
-    
-    session_orcid = CachedSession(
-        'orcid_session',
-        host=redis_host,
-        port=redis_port,
-        backend='redis',
-        use_cache_dir=True,
-        expire_after=timedelta(days=7),
-        stale_if_error=True,
-    )
-	
-    session_doi = CachedSession(
-        'session_doi',
-        host=redis_host,
-        port=redis_port,
-        backend='redis',
-        use_cache_dir=True,
-        expire_after=timedelta(days=7),
-        stale_if_error=True,
-    )
-    
-    
-    
+class JsonLRU:
+    """
+    In-process LRU of decoded JSON bodies (L1), in front of the requests-cache backends (L2).
+    Eviction is size-aware: entries are weighted by the size of their encoded body
+    and the least recently used ones are dropped once max_bytes is exceeded.
+    Each entry carries the TTL of its namespace. Cached bodies are shared, treat them as read-only.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (namespace, body, size, expires_at)
+        self._bytes = 0
+        self._lock = Lock()
+        self._counters = defaultdict(lambda: {"hits": 0, "misses": 0, "evictions": 0, "expired": 0})
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters[namespace]["misses"] += 1
+                return default
+            _, body, size, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self._counters[namespace]["expired"] += 1
+                self._counters[namespace]["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._counters[namespace]["hits"] += 1
+            return body
+
+    def put(self, namespace, key, body, size, ttl: timedelta):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (namespace, body, size, time.monotonic() + ttl.total_seconds())
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (evicted_namespace, _, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._counters[evicted_namespace]["evictions"] += 1
+
+    def contains(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[3] >= time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "namespaces": {namespace: dict(counters) for namespace, counters in self._counters.items()},
+            }
+
+
+memory_cache = JsonLRU(int(os.environ.get("MEMORY_CACHE_MB", "128")) * 1024 * 1024)
+registry.gauge("scholar_memory_cache_bytes", "Size of the bodies held by the in-process cache.", (),
+               lambda: {(): memory_cache.stats()["bytes"]})
+registry.gauge("scholar_memory_cache_entries", "Entries held by the in-process cache.", (),
+               lambda: {(): memory_cache.stats()["entries"]})
+
+
+class JsonResponse:
+    """
+    Response served from (or just stored to) the in-process cache.
+    json() returns the already decoded body; other attributes come from the
+    underlying response when there is one.
+    """
+
+    def __init__(self, body, url, response=None):
+        self._body = body
+        self._response = response
+        self.url = url
+        self.status_code = 200
+        self.ok = True
+        self.from_cache = response is None or getattr(response, "from_cache", False)
+
+    def json(self, **kwargs):
+        return self._body
+
+    def raise_for_status(self):
+        pass
+
+    def __getattr__(self, name):
+        if self._response is None:
+            raise AttributeError(name)
+        return getattr(self._response, name)
+
+
+class TwoTierSession:
+    """
+    GET-only front for a CachedSession: JSON bodies are looked up in the
+    in-process LRU first, then in the session's own backend, decoded once and
+    kept in memory for the namespace TTL. Concurrent misses on the same URL share
+    one request. Everything else is delegated to the session.
+    """
+
+    def __init__(self, namespace, session, ttl: timedelta, l1: JsonLRU = memory_cache):
+        self.namespace = namespace
+        self.session = session
+        self.ttl = ttl
+        self.l1 = l1
+        self.flights = SingleFlight(namespace)
+
+    def _key(self, url, params, headers):
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        accept = (headers or {}).get("Accept") or (headers or {}).get("accept") or ""
+        return f"{self.namespace}|{accept}|{full_url}"
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        key = self._key(url, params, headers)
+        body = self.l1.get(self.namespace, key, _MISS)
+        if body is not _MISS:
+            cache_requests.inc(self.namespace, "memory")
+            return JsonResponse(body, url)
+        return self.flights.do(key, lambda: self._fetch(key, url, params, headers, **kwargs))
+
+    def _fetch(self, key, url, params, headers, **kwargs):
+        response = self.session.get(url, params=params, headers=headers, **kwargs)
+        cache_requests.inc(self.namespace, "backend" if getattr(response, "from_cache", False) else "miss")
+        if response.status_code != 200:
+            return response
+        try:
+            body = jsoncodec.loads(response.content)
+        except ValueError:
+            return response
+        self.l1.put(self.namespace, key, body, len(response.content), self.ttl)
+        return JsonResponse(body, url, response)
+
+    def contains(self, url, params=None, headers=None):
+        """True when a GET for url would be answered by either cache tier."""
+        if self.l1.contains(self._key(url, params, headers)):
+            return True
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        return self.session.cache.contains(url=full_url)
+
+    def prefetch(self, urls):
+        """
+        Pull the backend's cached responses for urls into the in-process tier,
+        in a single round trip on Redis. Returns the urls now answered from memory.
+        """
+        held = {url for url in urls if self.l1.contains(self._key(url, None, None))}
+        missing = [url for url in dict.fromkeys(urls) if url not in held]
+        if not missing:
+            return held
+        cache = self.session.cache
+        keys = [cache.create_key(requests.Request("GET", url).prepare()) for url in missing]
+        for url, response in zip(missing, get_many(cache, keys)):
+            if response is None or response.is_expired or response.status_code != 200:
+                continue
+            try:
+                body = jsoncodec.loads(response.content)
+            except ValueError:
+                continue
+            self.l1.put(self.namespace, self._key(url, None, None), body, len(response.content), self.ttl)
+            held.add(url)
+        return held
 
-    return session_xref, session_scpus, session_orcid, session_doi
+    def store(self, url, body):
+        """
+        Cache body as the JSON answer to a GET for url, in both tiers, as if it had
+        been fetched: for answers obtained another way (a batch query) that later
+        per-URL lookups should find. Expires like the session's own responses.
+        """
+        content = jsoncodec.dumpb(body)
+        self.l1.put(self.namespace, self._key(url, None, None), body, len(content), self.ttl)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.request = requests.Request("GET", url).prepare()
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response._content = content
+        response.raw = HTTPResponse(body=io.BytesIO(content), headers=dict(response.headers), status=200,
+                                    preload_content=False, request_url=url)
+        cache = self.session.cache
+        cache.save_response(response, cache.create_key(response.request),
+                            expires=get_expiration_datetime(self.session.settings.expire_after))
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+_MISS = object()
+
+# in-process TTLs, per namespace
+NAMESPACE_TTLS = {
+    "xref": timedelta(days=365),
+    "scopus": timedelta(days=1),
+    "orcid": timedelta(days=7),
+    "doi": timedelta(days=7),
+    "openalex": timedelta(days=1),
+}
+
+
+def with_memory_cache(session_xref, session_scpus, session_orcid, session_doi):
+    return (TwoTierSession("xref", session_xref, NAMESPACE_TTLS["xref"]),
+            TwoTierSession("scopus", session_scpus, NAMESPACE_TTLS["scopus"]),
+            TwoTierSession("orcid", session_orcid, NAMESPACE_TTLS["orcid"]),
+            TwoTierSession("doi", session_doi, NAMESPACE_TTLS["doi"]))
 
 
 REDIS_URL = os.environ.get("REDIS_URL", "")
 
+# zlib over the pickled response: JSON bodies shrink several times, which is what travels on the wire
+redis_serializer = SerializerPipeline(
+    [*pickle_serializer.stages, Stage(dumps=zlib.compress, loads=zlib.decompress)],
+    name='pickle-zlib',
+    is_binary=True,
+)
+
+_redis_pool = None
+_redis_pool_lock = Lock()
+
+# what each namespace actually runs on, and why, for cache_health()
+backend_status = {}
+
+
+def redis_pool():
+    """
+    Process-wide connection pool built from REDIS_URL. Accepts redis://, rediss:// (TLS)
+    and unix:// URLs with credentials and db, as well as the legacy host:port form.
+    """
+    global _redis_pool
+    with _redis_pool_lock:
+        if _redis_pool is None:
+            url = REDIS_URL if "://" in REDIS_URL else f"redis://{REDIS_URL}"
+            _redis_pool = redis.ConnectionPool.from_url(
+                url,
+                max_connections=int(os.environ.get("REDIS_MAX_CONNECTIONS", "50")),
+                socket_timeout=float(os.environ.get("REDIS_SOCKET_TIMEOUT", "5")),
+                socket_connect_timeout=float(os.environ.get("REDIS_SOCKET_TIMEOUT", "5")),
+                health_check_interval=30,
+            )
+        return _redis_pool
+
+
+def redis_connection():
+    return redis.Redis(connection_pool=redis_pool())
+
+
+def make_redis_backend(cache_name):
+    return RedisCache(cache_name, connection=redis_connection(), serializer=redis_serializer)
+
+
+def redis_health():
+    """Ping Redis through the shared pool, with latency and pool usage."""
+    if REDIS_URL == "":
+        return {"configured": False}
+    try:
+        pool = redis_pool()
+    except ValueError as e:
+        return {"configured": True, "ok": False, "error": f"invalid REDIS_URL: {e}"}
+    report = {"configured": True, "url": pool.connection_kwargs.get("host") or pool.connection_kwargs.get("path"),
+              "db": pool.connection_kwargs.get("db", 0)}
+    started = time.monotonic()
+    try:
+        redis_connection().ping()
+        report.update({"ok": True, "latency_ms": round((time.monotonic() - started) * 1000, 2)})
+    except redis.RedisError as e:
+        report.update({"ok": False, "error": str(e)})
+    report["pool"] = {"created": getattr(pool, "_created_connections", None),
+                      "in_use": len(getattr(pool, "_in_use_connections", ())),
+                      "max": pool.max_connections}
+    return report
+
+
+def cache_health():
+    return {"redis": redis_health(), "backends": dict(backend_status)}
+
+
+def get_many(cache, keys):
+    """
+    Cached responses for keys, None where absent or unreadable.
+    On Redis this is one pipelined round trip instead of one per key.
+    """
+    responses = cache.responses
+    if isinstance(responses, RedisDict):
+        pipe = responses.connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(responses._bkey(key))
+        raw_values = pipe.execute()
+        values = []
+        for key, raw in zip(keys, raw_values):
+            try:
+                values.append(responses.deserialize(key, raw) if raw is not None else None)
+            except Exception:
+                values.append(None)
+        return values
+
+    values = []
+    for key in keys:
+        try:
+            values.append(responses[key])
+        except Exception:
+            values.append(None)
+    return values
+
+
+def _metered(session):
+    # requests that miss the cache are counted and timed per upstream
+    adapter = MeteredHTTPAdapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _local_session(namespace, **kwargs):
+    return _metered(CachedSession(backend=make_file_backend(namespace),
+                                  expire_after=NAMESPACES[namespace]["expire_after"], stale_if_error=True, **kwargs))
+
+
+def make_cached_session(namespace, **kwargs):
+    """CachedSession for one of the NAMESPACES, on Redis when REDIS_URL is set, on local disk otherwise."""
+    settings = NAMESPACES[namespace]
+    if REDIS_URL != "":
+        try:
+            if backend_status.get(namespace) != "redis":
+                redis_connection().ping()
+            backend_status[namespace] = "redis"
+            return _metered(CachedSession(backend=make_redis_backend(settings["cache_name"]),
+                                          expire_after=settings["expire_after"], stale_if_error=True, **kwargs))
+        except (redis.RedisError, ValueError) as e:
+            # ValueError: REDIS_URL could not be parsed
+            logger.error("redis unavailable for %s, falling back to the local disk: %s", namespace, e)
+            backend_status[namespace] = f"{CACHE_BACKEND} (redis unavailable: {e})"
+            start_background_sweeps()
+            return _local_session(namespace, **kwargs)
+    backend_status[namespace] = CACHE_BACKEND
+    start_background_sweeps()
+    return _local_session(namespace, **kwargs)
+
+
 cache_initialized=False
 
 if not cache_initialized:
 
-	try:
-		if REDIS_URL != "":
-			redis_host, redis_port = REDIS_URL.split(":")
-			session_xref, session_scpus, session_orcid,session_doi = setup_redis_cache(redis_host, redis_port)
-			logger.info("using redis cache")
-		else:
-			session_xref, session_scpus, session_orcid,session_doi = setup_fs_cache()
-			logger.info("using rs cache")
-	except:
-		session_xref, session_scpus, session_orcid,session_doi = setup_fs_cache()
-		logger.info("using rs cache")
+	session_xref = make_cached_session("xref", allowable_methods=['GET'])
+	session_scpus = make_cached_session("scopus")
+	session_orcid = make_cached_session("orcid")
+	session_doi = make_cached_session("doi")
+	logger.info("http cache backends: %s", backend_status)
+
+	session_xref, session_scpus, session_orcid, session_doi = with_memory_cache(
+		session_xref, session_scpus, session_orcid, session_doi)
     
-	cache_initialized=True
\ No newline at end of file
+	cache_initialized=True
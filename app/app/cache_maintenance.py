@@ -0,0 +1,322 @@
+import argparse
+import contextlib
+import fcntl
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterator
+
+from requests_cache import FileCache, SQLiteCache
+from requests_cache.backends.filesystem import FileDict
+
+logger = logging.getLogger('cache_maintenance')
+
+# requests-cache namespaces kept on local disk: cache name, user cache dir or cwd, expiry
+NAMESPACES = {
+    "xref": {"cache_name": "xrefCache", "use_cache_dir": True, "expire_after": timedelta(days=365)},
+    "scopus": {"cache_name": "scpusCache", "use_cache_dir": True, "expire_after": timedelta(days=1)},
+    "orcid": {"cache_name": "orcid_session", "use_cache_dir": True, "expire_after": timedelta(days=7)},
+    "doi": {"cache_name": "session_doi", "use_cache_dir": True, "expire_after": timedelta(days=7)},
+    "openalex": {"cache_name": "http_cache", "use_cache_dir": False, "expire_after": timedelta(days=1)},
+    "cite": {"cache_name": "citeCache", "use_cache_dir": True, "expire_after": timedelta(days=30)},
+}
+
+# "filesystem" (sharded directories) or "sqlite" (one file per namespace)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "filesystem")
+CACHE_MAX_MB = int(os.environ.get("CACHE_MAX_MB", "1024"))
+CACHE_SWEEP_INTERVAL = int(os.environ.get("CACHE_SWEEP_INTERVAL", "3600"))
+
+# yield to other greenlets every so many files while walking a namespace
+_YIELD_EVERY = 500
+
+
+def namespace_budget(namespace):
+    """Max bytes on disk for a namespace: CACHE_MAX_MB_<NAMESPACE>, defaulting to CACHE_MAX_MB."""
+    return int(os.environ.get(f"CACHE_MAX_MB_{namespace.upper()}", CACHE_MAX_MB)) * 1024 * 1024
+
+
+class ShardedFileDict(FileDict):
+    """
+    FileDict spreading responses over 256 sub-directories (first two hex digits of
+    the key), so no directory grows to millions of entries.
+    Reads refresh the file mtime, which is what LRU eviction orders on.
+    Files written flat by earlier versions are still read, compact() moves them.
+    """
+
+    def _shard_path(self, key: str) -> Path:
+        return Path(self.cache_dir) / key[:2] / f'{key}{self.extension}'
+
+    def _flat_path(self, key: str) -> Path:
+        return Path(self.cache_dir) / f'{key}{self.extension}'
+
+    def _existing_path(self, key: str) -> Path:
+        path = self._shard_path(key)
+        if path.exists():
+            return path
+        return self._flat_path(key)
+
+    def peek(self, key: str):
+        """Read a response without counting it as an access."""
+        mode = 'rb' if self.is_binary else 'r'
+        with self._try_io(key):
+            with self._existing_path(key).open(mode) as f:
+                return self.deserialize(key, f.read())
+
+    def __getitem__(self, key: str):
+        value = self.peek(key)
+        with contextlib.suppress(OSError):
+            os.utime(self._existing_path(key))
+        return value
+
+    def __setitem__(self, key, value):
+        path = self._shard_path(key)
+        with self._try_io(key):
+            path.parent.mkdir(exist_ok=True)
+            with path.open(mode='wb' if self.is_binary else 'w') as f:
+                f.write(self.serialize(value))
+
+    def __delitem__(self, key):
+        with self._try_io(key):
+            self._existing_path(key).unlink()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._shard_path(key).exists() or self._flat_path(key).exists()
+
+    def paths(self) -> Iterator[Path]:
+        cache_dir = Path(self.cache_dir)
+        with self._lock:
+            yield from cache_dir.glob(f'*{self.extension}')
+            yield from cache_dir.glob(f'??/*{self.extension}')
+
+
+class ShardedFileCache(FileCache):
+    """FileCache backed by ShardedFileDict. Relies on FileDict internals (lock, _try_io(key)) of requests-cache 1.3."""
+
+    def __init__(self, cache_name='http_cache', use_temp=False, decode_content=True, serializer=None, **kwargs):
+        super().__init__(cache_name, use_temp=use_temp, decode_content=decode_content, serializer=serializer,
+                         **kwargs)
+        skwargs = {'serializer': serializer, **kwargs} if serializer else kwargs
+        self.responses = ShardedFileDict(cache_name, use_temp=use_temp, decode_content=decode_content,
+                                         lock=self.responses.lock, **skwargs)
+
+
+def make_file_backend(namespace):
+    """Local backend for a namespace, according to CACHE_BACKEND."""
+    settings = NAMESPACES[namespace]
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteCache(settings["cache_name"], use_cache_dir=settings["use_cache_dir"], wal=True)
+    return ShardedFileCache(settings["cache_name"], use_cache_dir=settings["use_cache_dir"])
+
+
+_last_runs: Dict[str, dict] = {}
+_last_runs_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _exclusive(backend):
+    """Cross-process lock per namespace, so only one worker sweeps it at a time. Yields False if busy."""
+    cache_dir = Path(backend.cache_dir) if isinstance(backend, FileCache) else Path(backend.db_path).parent
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir / f".{Path(str(backend.cache_name)).name}.maintenance.lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _file_entries(backend):
+    """(path, size, mtime) for every response file of a filesystem namespace."""
+    for i, path in enumerate(backend.responses.paths()):
+        if i % _YIELD_EVERY == 0:
+            time.sleep(0)
+        with contextlib.suppress(OSError):
+            stat = path.stat()
+            yield path, stat.st_size, stat.st_mtime
+
+
+def _sweep_files(backend, max_bytes):
+    """Drop expired or unreadable responses, then the least recently used ones above max_bytes."""
+    responses = backend.responses
+    expired = 0
+    kept = []
+    for path, size, mtime in _file_entries(backend):
+        key = path.stem
+        try:
+            response = responses.peek(key) if isinstance(responses, ShardedFileDict) else responses[key]
+            stale = response is None or response.is_expired
+        except Exception:
+            stale = True
+        if stale:
+            with contextlib.suppress(OSError):
+                path.unlink()
+            expired += 1
+        else:
+            kept.append((mtime, size, path))
+
+    total = sum(size for _, size, _ in kept)
+    evicted = 0
+    if total > max_bytes:
+        kept.sort()
+        for _, size, path in kept:
+            if total <= max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                path.unlink()
+            total -= size
+            evicted += 1
+    return {"expired": expired, "evicted": evicted, "entries": len(kept) - evicted, "bytes": total}
+
+
+def _sweep_sqlite(backend, max_bytes, vacuum=False):
+    """Drop expired responses, then the oldest-written ones above max_bytes (expiry order)."""
+    responses = backend.responses
+    before = responses.count(expired=True)
+    backend.delete(expired=True)
+    expired = before - responses.count(expired=True)
+
+    with responses.connection() as con:
+        rows = con.execute(f'SELECT key, length(value) FROM {responses.table_name} '
+                           f'ORDER BY expires IS NULL, expires').fetchall()
+    total = sum(size or 0 for _, size in rows)
+    doomed = []
+    for key, size in rows:
+        if total <= max_bytes:
+            break
+        doomed.append(key)
+        total -= size or 0
+    if doomed:
+        responses.bulk_delete(doomed)
+    if vacuum or doomed or expired:
+        responses.vacuum()
+    return {"expired": expired, "evicted": len(doomed), "entries": len(rows) - len(doomed), "bytes": total}
+
+
+def _unshard_leftovers(backend):
+    """Move flat files written before sharding into their shard, drop empty shard directories."""
+    responses = backend.responses
+    moved = 0
+    cache_dir = Path(responses.cache_dir)
+    for path in cache_dir.glob(f'*{responses.extension}'):
+        target = responses._shard_path(path.stem)
+        target.parent.mkdir(exist_ok=True)
+        with contextlib.suppress(OSError):
+            os.replace(path, target)
+            moved += 1
+    for shard in cache_dir.glob('??'):
+        if shard.is_dir():
+            with contextlib.suppress(OSError):
+                shard.rmdir()
+    return moved
+
+
+def sweep(namespace, compact=False):
+    """
+    Expiry sweep and budget enforcement for one namespace. With compact, flat
+    legacy files are moved into shards (filesystem) or the database is vacuumed (sqlite).
+    Returns the run summary, or None if another process is sweeping it.
+    """
+    backend = make_file_backend(namespace)
+    started = time.monotonic()
+    with _exclusive(backend) as acquired:
+        if not acquired:
+            logger.info("cache namespace %s is being swept by another process", namespace)
+            return None
+        moved = 0
+        if isinstance(backend, SQLiteCache):
+            result = _sweep_sqlite(backend, namespace_budget(namespace), vacuum=compact)
+        else:
+            if compact:
+                moved = _unshard_leftovers(backend)
+            result = _sweep_files(backend, namespace_budget(namespace))
+    result.update({"namespace": namespace, "moved": moved, "max_bytes": namespace_budget(namespace),
+                   "backend": CACHE_BACKEND, "seconds": round(time.monotonic() - started, 3),
+                   "finished_at": time.time()})
+    with _last_runs_lock:
+        _last_runs[namespace] = result
+    logger.info("cache sweep %s: %s expired, %s evicted, %s entries, %s bytes", namespace,
+                result["expired"], result["evicted"], result["entries"], result["bytes"])
+    return result
+
+
+def sweep_all(compact=False):
+    return {namespace: sweep(namespace, compact=compact) for namespace in NAMESPACES}
+
+
+def inspect(namespace):
+    """Live entry count and size of a namespace, without modifying it."""
+    backend = make_file_backend(namespace)
+    if isinstance(backend, SQLiteCache):
+        entries = backend.responses.count(expired=True)
+        size = backend.responses.size()
+        flat = 0
+    else:
+        entries, size = 0, 0
+        for _, file_size, _ in _file_entries(backend):
+            entries += 1
+            size += file_size
+        flat = sum(1 for _ in Path(backend.cache_dir).glob(f'*{backend.responses.extension}'))
+    return {"namespace": namespace, "backend": CACHE_BACKEND, "entries": entries, "bytes": size,
+            "unsharded": flat, "max_bytes": namespace_budget(namespace)}
+
+
+def stats():
+    """Result of the last sweep of each namespace in this process (cheap, no disk walk)."""
+    with _last_runs_lock:
+        return {namespace: dict(run) for namespace, run in _last_runs.items()}
+
+
+_sweeper = None
+
+
+def start_background_sweeps(interval=CACHE_SWEEP_INTERVAL):
+    """Sweep every namespace every interval seconds in a daemon thread. interval <= 0 disables it."""
+    global _sweeper
+    if interval <= 0 or _sweeper is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                sweep_all()
+            except Exception:
+                logger.exception("cache sweep failed")
+
+    _sweeper = threading.Thread(target=run, name="cache-sweeper", daemon=True)
+    _sweeper.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and compact the local HTTP caches")
+    parser.add_argument("command", choices=["stats", "sweep", "compact"])
+    parser.add_argument("namespaces", nargs="*", help=f"default: all of {', '.join(NAMESPACES)}")
+    args = parser.parse_args(argv)
+
+    for namespace in args.namespaces or NAMESPACES:
+        if namespace not in NAMESPACES:
+            parser.error(f"unknown namespace {namespace}")
+        if args.command == "stats":
+            result = inspect(namespace)
+            print(f"{namespace:10} {result['entries']:>10} entries {result['bytes'] / 1e6:>10.1f} MB"
+                  f" / {result['max_bytes'] / 1e6:.0f} MB  unsharded: {result['unsharded']}")
+        else:
+            result = sweep(namespace, compact=args.command == "compact")
+            if result is None:
+                print(f"{namespace:10} busy, skipped")
+                continue
+            print(f"{namespace:10} {result['expired']:>8} expired {result['evicted']:>8} evicted "
+                  f"{result['moved']:>8} moved {result['entries']:>10} entries {result['bytes'] / 1e6:>10.1f} MB")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,146 @@
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger('citation_analytics')
+
+
+def _bare_id(openalex_url: str) -> str:
+    return openalex_url.rsplit("/", 1)[-1] if openalex_url else ""
+
+
+def build_incidence_matrix(works: Dict[str, dict]) -> Tuple[sparse.csr_matrix, List[str], List[str]]:
+    """
+    Build the sparse work x reference incidence matrix A from OpenAlex works.
+    A[i, j] = 1 when input work i references work j.
+    Returns (A, row_ids, col_ids) where ids are bare W-ids.
+    """
+    row_ids: List[str] = list(works.keys())
+    col_index: Dict[str, int] = {}
+    rows: List[int] = []
+    cols: List[int] = []
+
+    for i, wid in enumerate(row_ids):
+        seen = set()
+        for ref in (works[wid].get("referenced_works") or []):
+            if not isinstance(ref, str):
+                continue
+            rid = _bare_id(ref)
+            if not rid or rid in seen:
+                continue
+            seen.add(rid)
+            j = col_index.setdefault(rid, len(col_index))
+            rows.append(i)
+            cols.append(j)
+
+    col_ids: List[str] = [None] * len(col_index)
+    for rid, j in col_index.items():
+        col_ids[j] = rid
+
+    data = np.ones(len(rows), dtype=np.int32)
+    incidence = sparse.csr_matrix((data, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+                                  shape=(len(row_ids), len(col_ids)), dtype=np.int32)
+    return incidence, row_ids, col_ids
+
+
+def _top_upper_pairs(similarity: sparse.spmatrix, top_n: int, norm: np.ndarray | None = None):
+    """
+    Return the top_n (i, j, shared, cosine) entries of the strict upper triangle
+    of a symmetric sparse similarity matrix, ordered by shared count then cosine.
+    """
+    upper = sparse.triu(similarity, k=1).tocoo()
+    if upper.nnz == 0:
+        return []
+    shared = upper.data.astype(np.float64)
+    if norm is not None:
+        denom = np.sqrt(norm[upper.row] * norm[upper.col])
+        cosine = np.divide(shared, denom, out=np.zeros_like(shared), where=denom > 0)
+    else:
+        cosine = np.zeros_like(shared)
+
+    k = min(top_n, upper.nnz)
+    # lexsort's last key is the primary one
+    order = np.lexsort((-cosine, -shared))[:k]
+    return [(int(upper.row[o]), int(upper.col[o]), int(shared[o]), float(cosine[o])) for o in order]
+
+
+def compute_citation_analytics(works: Dict[str, dict],
+                               work_node_id: Dict[str, str] | None = None,
+                               min_count: int = 2,
+                               top_n: int = 50) -> dict:
+    """
+    Co-citation and bibliographic-coupling analytics over the input works.
+
+    - bibliographic coupling: B = A A^T, B[i, k] is the number of references
+      shared by input works i and k;
+    - co-citation: C = A^T A restricted to references cited by >= min_count
+      inputs, C[j, l] is the number of input works citing both j and l.
+
+    Both products stay sparse, so memory follows the number of nonzeros.
+    Node ids in the output match the ids used by net_build_graph.
+    """
+    work_node_id = work_node_id or {}
+    incidence, row_ids, col_ids = build_incidence_matrix(works)
+    n_works, n_refs = incidence.shape
+
+    result = {
+        "inputs": n_works,
+        "references": n_refs,
+        "nonzeros": int(incidence.nnz),
+        "central_references": [],
+        "related_inputs": [],
+        "cocited_references": [],
+    }
+    if incidence.nnz == 0:
+        return result
+
+    # references per input work (row degree) and citations per reference (column degree)
+    out_degree = np.asarray(incidence.sum(axis=1)).ravel().astype(np.float64)
+    in_degree = np.asarray(incidence.sum(axis=0)).ravel()
+
+    # bibliographic coupling between input works
+    coupling = (incidence @ incidence.T).tocsr()
+    for i, k, shared, cosine in _top_upper_pairs(coupling, top_n, out_degree):
+        result["related_inputs"].append({
+            "source": work_node_id.get(row_ids[i], row_ids[i]),
+            "target": work_node_id.get(row_ids[k], row_ids[k]),
+            "shared_references": shared,
+            "cosine": round(cosine, 4),
+        })
+
+    # co-citation among the retained references
+    retained = np.flatnonzero(in_degree >= min_count)
+    if retained.size == 0:
+        return result
+    retained_incidence = incidence[:, retained].tocsc()
+    cocitation = (retained_incidence.T @ retained_incidence).tocsr()
+
+    cocitation_off_diag = cocitation.copy()
+    cocitation_off_diag.setdiag(0)
+    # drop the explicit zeros left on the diagonal before counting partners
+    cocitation_off_diag.eliminate_zeros()
+    cocitation_strength = np.asarray(cocitation_off_diag.sum(axis=1)).ravel()
+    cocitation_partners = np.diff(cocitation_off_diag.indptr)
+
+    k = min(top_n, retained.size)
+    order = np.lexsort((-cocitation_strength, -in_degree[retained]))[:k]
+    for o in order:
+        result["central_references"].append({
+            "id": col_ids[retained[o]],
+            "cited_by_inputs": int(in_degree[retained[o]]),
+            "cocitation_strength": int(cocitation_strength[o]),
+            "cocited_with": int(cocitation_partners[o]),
+        })
+
+    ref_norm = in_degree[retained].astype(np.float64)
+    for j, l, shared, cosine in _top_upper_pairs(cocitation, top_n, ref_norm):
+        result["cocited_references"].append({
+            "source": col_ids[retained[j]],
+            "target": col_ids[retained[l]],
+            "cocitations": shared,
+            "cosine": round(cosine, 4),
+        })
+
+    return result
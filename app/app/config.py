@@ -9,9 +9,16 @@ class Config(object):
         IN_MEMORY = True
     else:
         IN_MEMORY = False
-    DEVELOPMENT = True
-    DEBUG = True  # some Flask specific configs
-    SECRET_KEY = 'ScphusHack2021!'
-    SQLALCHEMY_ECHO = False
+    DEVELOPMENT = os.environ.get("FLASK_DEBUG", "0") == "1"
+    DEBUG = DEVELOPMENT  # some Flask specific configs
+    SECRET_KEY = os.environ.get("SECRET_KEY", 'ScphusHack2021!')
+    SQLALCHEMY_ECHO = os.environ.get("SQLALCHEMY_ECHO", "0") == "1"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # engine pool, see app.database
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+    DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+    DB_SLOW_QUERY_MS = int(os.environ.get("DB_SLOW_QUERY_MS", "200"))
 
@@ -0,0 +1,103 @@
+import logging
+import os
+import time
+from collections import defaultdict
+from threading import Lock
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+from app.config import Config
+
+logger = logging.getLogger('database')
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def build_engine(config=Config()):
+    """
+    Engine with the pool settings from Config. SQLite files run in WAL mode with
+    a busy timeout, so readers do not block the writer and concurrent writers wait
+    instead of failing with "database is locked".
+    """
+    url = make_url(config.SQLALCHEMY_DATABASE_URI)
+    options = {"echo": config.SQLALCHEMY_ECHO, "pool_pre_ping": config.DB_POOL_PRE_PING}
+    if _is_memory_sqlite(url):
+        # one shared connection, pool sizing does not apply
+        from sqlalchemy.pool import StaticPool
+        options.update(poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        options.update(pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW,
+                       pool_recycle=config.DB_POOL_RECYCLE)
+        if url.get_backend_name() == "sqlite":
+            options["connect_args"] = {"check_same_thread": False, "timeout": config.DB_BUSY_TIMEOUT_MS / 1000}
+
+    new_engine = create_engine(url, **options)
+
+    if url.get_backend_name() == "sqlite" and not _is_memory_sqlite(url):
+        @event.listens_for(new_engine, "connect")
+        def _sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT_MS)}")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+    _instrument(new_engine, config.DB_SLOW_QUERY_MS / 1000)
+    return new_engine
+
+
+_statement_stats = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+_statement_stats_lock = Lock()
+
+
+def _instrument(target_engine, slow_seconds):
+    """Aggregate statement timings per statement kind, log the slow ones."""
+
+    @event.listens_for(target_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    @event.listens_for(target_engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["statement_started"].pop()
+        elapsed = time.perf_counter() - started
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        with _statement_stats_lock:
+            stats = _statement_stats[kind]
+            stats["count"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+        if elapsed > slow_seconds:
+            logger.warning("slow statement (%.0f ms): %s", elapsed * 1000, statement[:200])
+
+    @event.listens_for(target_engine, "handle_error")
+    def _failed(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("statement_started"):
+            connection.info["statement_started"].pop()
+
+
+def statement_stats():
+    with _statement_stats_lock:
+        return {kind: {"count": s["count"], "total_ms": round(s["total_ms"], 3), "max_ms": round(s["max_ms"], 3)}
+                for kind, s in _statement_stats.items()}
+
+
+# the process-wide engine, used by db.session and by the model metadata
+engine = build_engine()
+
+# pooled connections must not be shared with a forked worker (gunicorn --preload)
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+
+class SharedEngineSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy handing out the process-wide engine instead of building its own."""
+
+    def _make_engine(self, bind_key, options, app):
+        if bind_key is None:
+            return engine
+        return super()._make_engine(bind_key, options, app)
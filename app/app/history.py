@@ -0,0 +1,151 @@
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.model import QueryRollup, ScpusRequest
+from app.query_analyzer import canonical_subquery
+from app.sequences import IdAllocator
+from app.write_behind import write_behind
+
+logger = logging.getLogger('history')
+
+# opt-in: history rows older than this many days are deleted (their counts stay in the rollup); 0 keeps everything
+HISTORY_RETENTION_DAYS = int(os.environ.get("HISTORY_RETENTION_DAYS", "0"))
+RETENTION_INTERVAL_SECONDS = 3600
+RETENTION_CHUNK = 5000
+
+_ids = IdAllocator("history", ScpusRequest.id)
+_pruner = None
+_pruner_lock = threading.Lock()
+
+
+def query_hash(query):
+    """Rollup key: queries differing only by whitespace or case are the same query."""
+    return hashlib.sha1(canonical_subquery(query).encode("utf-8")).hexdigest()
+
+
+def record_query(query, count, ip="0.0.0.0", fetched=False):
+    """
+    Queue a history row and return its id right away; the row and its rollup are
+    written by the write-behind queue.
+    """
+    request_id = _ids.next_id()
+    write_behind.submit("history", {
+        "id": request_id,
+        "query": query,
+        "ip": ip,
+        "count": count,
+        "fetched": fetched,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc),
+    })
+    _ensure_pruner()
+    return request_id
+
+
+def _rollup(session, rows):
+    latest = {}
+    runs = {}
+    for row in rows:
+        key = query_hash(row["query"])
+        runs[key] = runs.get(key, 0) + 1
+        latest[key] = row
+    for key, row in latest.items():
+        values = {"query": row["query"], "last_seen": row["timestamp"], "last_count": row["count"],
+                  "last_request_id": row["id"]}
+        updated = session.execute(update(QueryRollup).where(QueryRollup.query_hash == key)
+                                  .values(runs=QueryRollup.runs + runs[key], **values))
+        if not updated.rowcount:
+            session.execute(insert(QueryRollup).values(query_hash=key, runs=runs[key],
+                                                       first_seen=row["timestamp"], **values))
+
+
+def _write_history(session, rows):
+    session.execute(insert(ScpusRequest), rows)
+    _rollup(session, rows)
+
+
+write_behind.register("history", write=_write_history)
+
+
+def backfill_rollup(bind=engine):
+    """
+    Build the rollup from the history rows when it is still empty, so that a
+    database from before the rollup keeps its popular queries. Returns the number
+    of queries rolled up; does nothing on later runs.
+    """
+    with Session(bind) as session:
+        if session.scalar(select(QueryRollup.query_hash).limit(1)) is not None:
+            return 0
+        rollup = {}
+        rows = session.execute(select(ScpusRequest.id, ScpusRequest.query, ScpusRequest.count,
+                                      ScpusRequest.timestamp).order_by(ScpusRequest.id)
+                               .execution_options(yield_per=RETENTION_CHUNK))
+        for request_id, query, count, timestamp in rows:
+            if not query:
+                continue
+            key = query_hash(query)
+            entry = rollup.get(key)
+            if entry is None:
+                rollup[key] = entry = {"query_hash": key, "runs": 0, "first_seen": timestamp}
+            entry.update(runs=entry["runs"] + 1, query=query, last_seen=timestamp, last_count=count,
+                         last_request_id=request_id)
+        entries = list(rollup.values())
+        for start in range(0, len(entries), RETENTION_CHUNK):
+            session.execute(insert(QueryRollup), entries[start:start + RETENTION_CHUNK])
+        session.commit()
+    if entries:
+        logger.info("rolled up %d queries from the existing history", len(entries))
+    return len(entries)
+
+
+def prune_history(retention_days=HISTORY_RETENTION_DAYS):
+    """Delete history rows older than retention_days, in chunks. The rollup keeps their counts."""
+    if retention_days <= 0:
+        return 0
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=retention_days)
+    removed = 0
+    while True:
+        with engine.begin() as conn:
+            chunk = select(ScpusRequest.id).where(ScpusRequest.timestamp < cutoff).limit(RETENTION_CHUNK)
+            deleted = conn.execute(delete(ScpusRequest).where(ScpusRequest.id.in_(chunk.scalar_subquery())))
+        removed += deleted.rowcount
+        if deleted.rowcount < RETENTION_CHUNK:
+            break
+        time.sleep(0)
+    if removed:
+        logger.info("pruned %d history rows older than %d days", removed, retention_days)
+    return removed
+
+
+def _run_pruner():
+    while True:
+        try:
+            prune_history()
+        except Exception:
+            logger.exception("history retention failed")
+        time.sleep(RETENTION_INTERVAL_SECONDS)
+
+
+def _ensure_pruner():
+    global _pruner
+    if _pruner is not None or HISTORY_RETENTION_DAYS <= 0:
+        return
+    with _pruner_lock:
+        if _pruner is None:
+            _pruner = threading.Thread(target=_run_pruner, name="history-retention", daemon=True)
+            _pruner.start()
+
+
+def popular_queries(limit=100):
+    """Most run queries first, from the rollup."""
+    with Session(engine) as session:
+        return session.scalars(select(QueryRollup)
+                               .order_by(QueryRollup.runs.desc(), QueryRollup.last_seen.desc())
+                               .limit(limit)).all()
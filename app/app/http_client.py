@@ -0,0 +1,84 @@
+import logging
+from threading import Lock
+from typing import Dict
+
+import requests
+from urllib3.util import Retry
+
+from app.cache import make_cached_session
+from app.metrics import MeteredHTTPAdapter
+
+logger = logging.getLogger('http_client')
+
+
+class TimeoutHTTPAdapter(MeteredHTTPAdapter):
+    """Metered HTTPAdapter applying a default timeout when the caller does not pass one."""
+
+    def __init__(self, timeout, *args, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+_upstreams: Dict[str, dict] = {}
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = Lock()
+
+
+def register_upstream(name: str, pool_maxsize: int = 10, timeout: float = 30, retries: int = 2,
+                      cache_namespace: str | None = None, match_headers=None):
+    """
+    Declare how the session for an upstream is built: connection pool size
+    (sized to the executor calling it), default timeout, retries on 429/5xx and,
+    with cache_namespace (see cache_maintenance.NAMESPACES), a requests-cache backend.
+    Registering again before the first get_session() replaces the settings.
+    """
+    _upstreams[name] = {
+        "pool_maxsize": pool_maxsize,
+        "timeout": timeout,
+        "retries": retries,
+        "cache_namespace": cache_namespace,
+        "match_headers": match_headers,
+    }
+
+
+def _build_session(name: str) -> requests.Session:
+    settings = _upstreams.get(name)
+    if settings is None:
+        raise KeyError(f"unknown upstream {name}")
+
+    if settings["cache_namespace"]:
+        session = make_cached_session(settings["cache_namespace"],
+                                      allowable_methods=['GET'],
+                                      match_headers=settings["match_headers"] or False)
+    else:
+        session = requests.Session()
+
+    retries = Retry(
+        total=settings["retries"],
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset({"GET"}),
+    )
+    adapter = TimeoutHTTPAdapter(settings["timeout"], pool_maxsize=settings["pool_maxsize"], max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(name: str) -> requests.Session:
+    """Process-wide keep-alive session for an upstream, built on first use."""
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _build_session(name)
+            _sessions[name] = session
+            logger.info("http session for %s ready (pool %s)", name, _upstreams[name]["pool_maxsize"])
+        return session
@@ -0,0 +1,136 @@
+"""
+JSON codec for the hot paths: upstream responses, Flask responses, Socket.IO packets
+and stored payloads. Uses orjson when it is installed and the standard library
+otherwise; values orjson refuses (integers over 64 bits, ...) go through the
+standard library too. Drop-in for json.dumps/json.loads, also usable as the
+`json` module of Socket.IO. Search records (app.records) encode to their wire format.
+
+    python -m app.jsoncodec    # encode/decode benchmark
+"""
+import json
+import logging
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import records
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+logger = logging.getLogger('jsoncodec')
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def _orjson_options(sort_keys):
+    options = orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        options |= orjson.OPT_SORT_KEYS
+    return options
+
+
+def _with_records(default):
+    """`default` hook that serializes search records (app.records) before trying the caller's."""
+    if default is None:
+        return records.to_wire
+
+    def record_or_default(obj):
+        if isinstance(obj, (records.Paper, records.Author)):
+            return obj.to_wire()
+        return default(obj)
+    return record_or_default
+
+
+def dumpb(obj, default=None, sort_keys=False) -> bytes:
+    """obj as compact UTF-8 JSON bytes."""
+    default = _with_records(default)
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=_orjson_options(sort_keys))
+        except TypeError:
+            pass
+    return json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj, default=None, sort_keys=False, indent=None, **kwargs) -> str:
+    """
+    obj as compact JSON text. Formatting arguments other than indent and sort_keys
+    (separators, ensure_ascii) are accepted for compatibility and ignored.
+    """
+    if indent is not None or orjson is None:
+        return json.dumps(obj, default=_with_records(default), sort_keys=sort_keys, indent=indent, ensure_ascii=False,
+                          separators=None if indent is not None else (",", ":"))
+    return dumpb(obj, default=default, sort_keys=sort_keys).decode("utf-8")
+
+
+def loads(data, **kwargs):
+    """Parse JSON from str, bytes or bytearray."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data, **kwargs)
+
+
+class JsonCodecProvider(DefaultJSONProvider):
+    """Flask JSON provider (jsonify, request.get_json) on top of this codec."""
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault("default", self.default)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        return dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return loads(s, **kwargs)
+
+
+if __name__ == "__main__":
+    # encode/decode time of a 1000-record doi_results set and of a large network graph,
+    # standard library against the codec
+    import random
+    import string
+    import time
+
+    random.seed(1)
+
+    def words(n):
+        return " ".join("".join(random.choices(string.ascii_lowercase, k=random.randint(3, 10))) for _ in range(n))
+
+    sample_records = [{
+        "doi": f"https://doi.org/10.{random.randint(1000, 9999)}/{i}", "title": words(12), "year": 2000 + i % 25,
+        "x-precise-date": "2021-03-04 00:00:00+00:00", "pubtitle": words(5), "pub_rank": "A", "rank_source": "core",
+        "hindex": random.random() * 100, "X-OA": i % 2 == 0, "X-FirstAuthor": words(2),
+        "X-Country-First-Author": "fra", "X-Country-First-affiliation": words(4), "X-FirstAuthor-ORCID": "",
+        "X-IsReferencedByCount": random.randint(0, 5000), "X-subject": words(3), "X-refcount": random.randint(0, 90),
+        "X-abstract": words(180), "X-authors": words(10),
+        "X-authors-list": [{"display_name": words(2), "orcid": "", "openalex": f"https://openalex.org/A{j}"}
+                           for j in range(6)],
+        "X-OA-URL": f"https://example.org/{i}.pdf",
+    } for i in range(1000)]
+    nodes = [{"id": f"W{i}", "type": random.choice(["work", "ref", "ref_back"]), "title": words(10),
+              "authors": [words(2) for _ in range(4)], "venue": words(4), "doi": f"https://doi.org/10.1/{i}",
+              "openalex": f"https://openalex.org/W{i}", "count": random.randint(2, 40)} for i in range(5000)]
+    graph = {"nodes": nodes,
+             "links": [{"source": f"W{random.randrange(5000)}", "target": f"W{random.randrange(5000)}",
+                        "kind": random.choice(["forward", "back"])} for _ in range(30000)],
+             "keywords": {words(1): random.randint(1, 100) for _ in range(200)}}
+
+    def best_of(fn, rounds=5):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
+
+    print(f"codec backend: {BACKEND}")
+    for name, payload in (("1000 records", sample_records), ("network graph", graph)):
+        text = json.dumps(payload)
+        print(f"{name} ({len(text) / 1e6:.1f} MB):")
+        print(f"  encode  json {best_of(lambda: json.dumps(payload)):7.1f} ms   "
+              f"codec {best_of(lambda: dumps(payload)):7.1f} ms")
+        print(f"  decode  json {best_of(lambda: json.loads(text)):7.1f} ms   "
+              f"codec {best_of(lambda: loads(text)):7.1f} ms")
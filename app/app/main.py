@@ -1,13 +1,16 @@
 from flask import Flask
+import logging
 import os
 from flask_socketio import SocketIO
-from flask_sqlalchemy import SQLAlchemy
 from app.config import Config
+from app.database import SharedEngineSQLAlchemy
+from app import jsoncodec
 
 
-print("creating flask application")
+logger = logging.getLogger('main')
+
 app = Flask(__name__)
-print("creating flask application done")
+app.json = jsoncodec.JsonCodecProvider(app)
 
 # Configure app and extensions
 with app.app_context():
@@ -18,15 +21,26 @@ with app.app_context():
     SCPUS_ABTRACT_BACKEND = f'https://api.elsevier.com/content/abstract/doi/%s?apiKey={API_KEY}'
     app.config.from_object(Config())
 
-    db = SQLAlchemy(app)
+    db = SharedEngineSQLAlchemy(app)
 
     if Config().IN_MEMORY:
-        print("### IN MEMORY DB")
-        db.create_all()
-        db.session.commit()
+        # throwaway default database: create the schema right away, deployments run `flask init-db`
+        from app.model import init_schema
+        logger.info("using the default database %s", Config.SQLALCHEMY_DATABASE_URI)
+        init_schema()
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create missing tables and indexes, and roll up the history recorded before the rollup existed."""
+    from app.model import init_schema
+    from app.history import backfill_rollup
+    init_schema()
+    backfill_rollup()
+    logger.info("schema ready on %s", Config.SQLALCHEMY_DATABASE_URI)
 
 # SocketIO (initialized outside app_context as recommended)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", json=jsoncodec)
 
 # Register routes and Socket.IO events
 from app import rest as _rest  # noqa: F401
@@ -0,0 +1,304 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('metrics')
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one series per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, _labels(self.label_names, label_values), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout (_bucket, _sum, _count)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[tuple, list] = {}  # label values -> [bucket counts, sum, count]
+        self._lock = Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (f"{self.name}_bucket", _labels(self.label_names, label_values, [("le", _number(bound))]),
+                       cumulative)
+            yield f"{self.name}_sum", _labels(self.label_names, label_values), total
+            yield f"{self.name}_count", _labels(self.label_names, label_values), count
+
+
+class Gauge:
+    """Value read when /metrics is scraped: collect() returns {label values: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect: Callable[[], Dict[tuple, float]] = dict):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        for label_values, value in sorted(self.collect().items()):
+            yield self.name, _labels(self.label_names, label_values), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._lock = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels=(), collect=dict):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                logger.exception("collecting %s failed", metric.name)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+upstream_requests = registry.counter(
+    "scholar_upstream_requests_total", "HTTP requests sent to upstream APIs (cache misses only).",
+    ("upstream", "status"))
+upstream_latency = registry.histogram(
+    "scholar_upstream_request_seconds", "Latency of HTTP requests sent to upstream APIs, retries included.",
+    ("upstream",))
+cache_requests = registry.counter(
+    "scholar_cache_requests_total", "GETs through the two-tier cache by the tier that answered: memory, backend or miss.",
+    ("namespace", "result"))
+socket_events = registry.counter(
+    "scholar_socket_events_emitted_total", "Socket.IO events emitted to clients.", ("event",))
+phase_latency = registry.histogram(
+    "scholar_phase_seconds", "Duration of the phases of long-running operations.", ("operation", "phase"),
+    buckets=PHASE_BUCKETS)
+
+# (host, path prefix, query parameter or None, upstream), first match wins
+_UPSTREAM_RULES = (
+    ("api.elsevier.com", "/content/search/scopus", None, "scopus_search"),
+    ("api.elsevier.com", "/content/abstract", None, "scopus_abstract"),
+    ("api.openalex.org", "/works", "filter", "openalex_filter"),
+    ("api.openalex.org", "/works", "search", "openalex_filter"),
+    ("api.openalex.org", "/works", None, "openalex_work"),
+    ("api.openalex.org", "", None, "openalex_other"),
+    ("export.arxiv.org", "", None, "arxiv"),
+    ("api.crossref.org", "", None, "crossref"),
+    ("pub.orcid.org", "", None, "orcid"),
+    ("orcid.org", "", None, "orcid"),
+    ("doi.org", "", None, "doi"),
+    ("dx.doi.org", "", None, "doi"),
+    ("api.semanticscholar.org", "", None, "semanticscholar"),
+    ("api.unpaywall.org", "", None, "unpaywall"),
+)
+
+
+def upstream_for(url):
+    """Upstream label for a request URL; unknown hosts are grouped under 'other'."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    for rule_host, prefix, parameter, upstream in _UPSTREAM_RULES:
+        if host == rule_host and parts.path.startswith(prefix) \
+                and (parameter is None or f"{parameter}=" in parts.query):
+            return upstream
+    if "grobid" in host or parts.path.startswith("/api/processHeaderDocument"):
+        return "grobid"
+    return "other"
+
+
+def observe_upstream(upstream, seconds, status):
+    upstream_latency.observe(seconds, upstream)
+    upstream_requests.inc(upstream, status)
+
+
+def _status_class(status_code):
+    return f"{status_code // 100}xx"
+
+
+class MeteredHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter recording a request counter and a latency histogram per upstream.
+    Adapters only see requests that reach the network, cached responses never get here.
+    """
+
+    def send(self, request, **kwargs):
+        upstream = upstream_for(request.url)
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            observe_upstream(upstream, time.perf_counter() - started, "error")
+            raise
+        observe_upstream(upstream, time.perf_counter() - started, _status_class(response.status_code))
+        return response
+
+
+@contextmanager
+def upstream_call(upstream):
+    """For upstreams not called through a requests session (arXiv goes through urllib)."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "2xx"
+    finally:
+        observe_upstream(upstream, time.perf_counter() - started, status)
+
+
+class PhaseTimer:
+    """
+    Records consecutive phases of one operation: mark(phase) observes the time
+    since the previous mark, done() the whole operation as phase "total".
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        phase_latency.observe(now - self._last, self.operation, phase)
+        self._last = now
+
+    def since_start(self, phase):
+        """Observe the time from the start of the operation, for milestones inside a phase."""
+        phase_latency.observe(time.perf_counter() - self.started, self.operation, phase)
+
+    def done(self):
+        phase_latency.observe(time.perf_counter() - self.started, self.operation, "total")
+
+
+class MeteredThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor reporting its queue depth and busy workers on /metrics."""
+
+    def __init__(self, name, max_workers):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self._active = 0
+        self._active_lock = Lock()
+        _executors.append(self)
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self._active_lock:
+                self._active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._active_lock:
+                    self._active -= 1
+        return super().submit(run)
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def queued(self):
+        return self._work_queue.qsize()
+
+
+_executors: List[MeteredThreadPoolExecutor] = []
+
+registry.gauge("scholar_executor_queued_tasks", "Tasks waiting for a worker, per executor.", ("executor",),
+               lambda: {(e.name,): e.queued for e in _executors})
+registry.gauge("scholar_executor_active_threads", "Workers running a task, per executor.", ("executor",),
+               lambda: {(e.name,): e.active for e in _executors})
+registry.gauge("scholar_executor_max_workers", "Worker cap, per executor.", ("executor",),
+               lambda: {(e.name,): e._max_workers for e in _executors})
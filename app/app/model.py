@@ -1,15 +1,14 @@
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, LargeBinary, Float, BigInteger
+from sqlalchemy import MetaData
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, LargeBinary, Float, BigInteger, Index
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm import deferred
 import pickle
-from app.config import Config
+from app.database import engine
 from sqlalchemy.orm import declarative_base
 import datetime
 
 Base = declarative_base()
 
-engine = create_engine(Config().SQLALCHEMY_DATABASE_URI, echo=True)
 db_session = scoped_session(sessionmaker(autocommit=False,
                                          autoflush=False,
                                          bind=engine))
@@ -43,6 +42,69 @@ class ScpusRequest(Base):
     timestamp = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
     fetched = Column(Boolean)
 
+    __table_args__ = (Index("ix_history_timestamp", "timestamp"),)
+
+
+class QueryRollup(Base):
+    """Per-query counters kept when history rows are pruned, keyed by a hash of the normalized query."""
+    __tablename__ = "history_rollup"
+    query_hash = Column(String(40), primary_key=True)
+    query = Column(String(2048))
+    runs = Column(Integer, default=0)
+    first_seen = Column(DateTime)
+    last_seen = Column(DateTime)
+    last_count = Column(Integer, default=-1)
+    last_request_id = Column(Integer)
+
+    __table_args__ = (Index("ix_history_rollup_runs", "runs"),
+                      Index("ix_history_rollup_last_seen", "last_seen"))
+
+
+class IdBlock(Base):
+    """Next free id per table, handed out in blocks so rows can be numbered before they are written."""
+    __tablename__ = "id_block"
+    name = Column(String(64), primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
+
+
+class SearchJobRecord(Base):
+    """A get_dois search, kept for re-attaching clients until it expires."""
+    __tablename__ = "search_job"
+    id = Column(Integer, primary_key=True)
+    query = Column(String(4096))
+    xref = Column(Boolean, default=False)
+    arxiv = Column(Boolean, default=False)
+    status = Column(String(16), default="running")
+    total = Column(Integer, default=0)
+    progress = Column(Text)
+    worker = Column(String(128))
+    created = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    updated = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+    __table_args__ = (Index("ix_search_job_updated", "updated"),)
+
+
+class SearchJobBatch(Base):
+    """One doi_results batch of a search job, as JSON; the final deduplicated list has final set."""
+    __tablename__ = "search_job_batch"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(Integer, nullable=False)
+    final = Column(Boolean, default=False)
+    results = Column(Text)
+
+    __table_args__ = (Index("ix_search_job_batch_job_id", "job_id"),)
+
+
+class RecoveredAbstract(Base):
+    """Abstract extracted from a paper's PDF by GROBID, or status "missing" when none could be."""
+    __tablename__ = "recovered_abstract"
+    doi = Column(String(512), primary_key=True)
+    abstract = Column(Text)
+    status = Column(String(16))
+    source = Column(String(2048))
+    updated = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+
+
 class NetworkData(Base):
     __tablename__="networkdata"
     id = Column(Integer, primary_key=True)
@@ -59,4 +121,10 @@ class ScpusFeed(Base):
     hit = Column(Integer, default=0)
 
 
-Base.metadata.create_all(bind=engine)
+def init_schema(bind=engine):
+    """Create missing tables and indexes. Run once per deployment (flask init-db), not at import."""
+    Base.metadata.create_all(bind=bind)
+    # create_all skips existing tables, so indexes added later are created one by one
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
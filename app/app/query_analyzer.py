@@ -1,6 +1,16 @@
+from __future__ import annotations
+
 import json
 import re
-import networkx as nx
+import time
+from collections import OrderedDict
+from concurrent.futures import as_completed
+from threading import Lock
+
+from app import query_compiler as qc
+from app.lazy import lazy_module
+
+nx = lazy_module("networkx")
 
 
 class Node:
@@ -15,320 +25,56 @@ class Node:
         return f"Node({self.label!r})"
 
 
-def _is_boundary(char):
-    return char is None or char.isspace() or char in "()"
-
-
-def _match_boolean_operator(expr: str, idx: int):
-    for op in ("AND", "OR"):
-        end = idx + len(op)
-        if expr[idx:end].upper() == op:
-            prev_ok = _is_boundary(expr[idx - 1] if idx > 0 else None)
-            next_ok = _is_boundary(expr[end] if end < len(expr) else None)
-            if prev_ok and next_ok:
-                return op
-    return None
-
-
-def _split_top_level_boolean(expr: str):
+def _arg_label(n) -> str:
     """
-    Split a function argument into top-level terms separated by AND/OR.
-    Only splits when the AND/OR is not inside quotes or parentheses.
+    Render a function argument left undistributed (implicit ANDs, e.g. INDUSTRY 4.0).
     """
-    terms = []
-    operators = []
-    buf = []
-    depth = 0
-    in_quote = False
-    i = 0
-    n = len(expr)
-
-    while i < n:
-        c = expr[i]
-
-        if c == '"':
-            in_quote = not in_quote
-            buf.append(c)
-            i += 1
-            continue
-
-        if not in_quote:
-            if c == '(':
-                depth += 1
-            elif c == ')':
-                depth = max(depth - 1, 0)
-
-            if depth == 0:
-                op = _match_boolean_operator(expr, i)
-                if op:
-                    terms.append("".join(buf).strip())
-                    operators.append(op)
-                    buf = []
-                    i += len(op)
-                    while i < n and expr[i].isspace():
-                        i += 1
-                    continue
-
-        buf.append(c)
-        i += 1
-
-    terms.append("".join(buf).strip())
-
-    if any(term == "" for term in terms) or len(terms) <= 1:
-        return [], []
-
-    return terms, operators
-
-
-def _unwrap_outer_parens(expr: str) -> str:
-    """
-    If the entire expression is wrapped in a single pair of parentheses, strip them.
-    Preserves inner spacing.
-    """
-    stripped = expr.strip()
-    if not (stripped.startswith("(") and stripped.endswith(")")):
-        return expr
-    depth = 0
-    for i, ch in enumerate(stripped):
-        if ch == "(":
-            depth += 1
-        elif ch == ")":
-            depth -= 1
-            if depth == 0 and i != len(stripped) - 1:
-                return expr  # closing before end -> not a single wrapper
-    if depth == 0:
-        inner = stripped[1:-1]
-        # keep original spacing around inner content that was inside the wrapper
-        leading = len(expr) - len(expr.lstrip())
-        trailing = len(expr) - len(expr.rstrip())
-        return (" " * leading) + inner + (" " * trailing)
-    return expr
-
-
-def distribute_function_on_boolean_terms(query: str) -> str:
-    """
-    Expand FUNCTION(a AND/OR b ...) into (FUNCTION(a) AND/OR FUNCTION(b) ...).
-    """
-    prev = None
-    current = query
-    while prev != current:
-        prev = current
-        current = _distribute_once(current)
-    return current
-
-
-def _distribute_once(query: str) -> str:
-    result = []
-    i = 0
-    n = len(query)
-
-    while i < n:
-        c = query[i]
-        if c.isalpha():
-            j = i
-            while j < n and (query[j].isalnum() or query[j] in "-_"):
-                j += 1
-            func_name = query[i:j]
-
-            if j < n and query[j] == '(':
-                depth = 0
-                k = j
-                while k < n:
-                    if query[k] == '(':
-                        depth += 1
-                    elif query[k] == ')':
-                        depth -= 1
-                        if depth == 0:
-                            k += 1
-                            break
-                    k += 1
-                if depth != 0:
-                    raise ValueError("Unbalanced parentheses in function call")
-
-                inner = query[j + 1:k - 1]
-                terms, operators = _split_top_level_boolean(inner)
-                if not operators:
-                    unwrapped = _unwrap_outer_parens(inner)
-                    terms, operators = _split_top_level_boolean(unwrapped)
-                if operators and len(terms) == len(operators) + 1:
-                    distributed = []
-                    for idx, term in enumerate(terms):
-                        if idx > 0:
-                            distributed.append(operators[idx - 1])
-                        distributed.append(f"{func_name}({term.strip()})")
-                    result.append("(" + " ".join(distributed) + ")")
-                    i = k
-                    continue
-                else:
-                    result.append(query[i:k])
-                    i = k
-                    continue
-
-        result.append(c)
-        i += 1
-
-    return "".join(result)
-
-
-def tokenize(query):
-    """
-    Tokenizer with support for:
-      - words and sequences of words (implicit AND between adjacent terms)
-      - quoted phrases: "machine learning" (single term)
-      - function terms: TITLE(A), TITLE-ABS-KEY(A AND B) (single term)
-      - PUBYEAR > number (single term)
-      - parentheses
-      - AND / OR
-    """
-    tokens = []
-    i = 0
-    n = len(query)
-
-    while i < n:
-        c = query[i]
-
-        # whitespace
-        if c.isspace():
-            i += 1
-            continue
-
-        # quoted phrase -> single term
-        if c == '"':
-            j = i + 1
-            while j < n and query[j] != '"':
-                j += 1
-            if j >= n:
-                raise ValueError("Unterminated quoted phrase")
-            phrase = query[i:j + 1]  # include quotes
-            tokens.append(phrase)
-            i = j + 1
-            continue
-
-        # function call NAME(...), NAME may contain '-'
-        if c.isalpha():
-            j = i
-            while j < n and (query[j].isalnum() or query[j] in "-_"):
-                j += 1
-            word = query[i:j]
-            upper_word = word.upper()
-
-            # special term: PUBYEAR > number
-            if upper_word == "PUBYEAR":
-                m = re.match(r'PUBYEAR\s*>\s*\d+', query[i:], flags=re.IGNORECASE)
-                if m:
-                    tokens.append(m.group(0).upper())
-                    i += m.end()
-                    continue
-
-            # function call?
-            if j < n and query[j] == '(':
-                # find matching closing ')', handling nested parentheses
-                depth = 0
-                k = j
-                while k < n:
-                    if query[k] == '(':
-                        depth += 1
-                    elif query[k] == ')':
-                        depth -= 1
-                        if depth == 0:
-                            k += 1
-                            break
-                    k += 1
-                if depth != 0:
-                    raise ValueError("Unbalanced parentheses in function call")
-                func_call = query[i:k]
-                tokens.append(func_call.upper())
-                i = k
-                continue
-
-            # keyword or simple word
-            if upper_word in ("AND", "OR"):
-                tokens.append(upper_word)
-            else:
-                tokens.append(word.upper())
-            i = j
-            continue
+    if isinstance(n, qc.Bin):
+        left = _arg_label(n.left)
+        right = _arg_label(n.right)
+        if n.implicit:
+            return f"{left} {right}"
+        return f"({left} {n.op} {right})"
+    if isinstance(n, qc.Func):
+        return f"{n.name.upper()}({_arg_label(n.arg)})"
+    if isinstance(n, qc.Year):
+        return f"PUBYEAR {n.op} {n.year}"
+    return n.text.upper()
+
+
+def _leaf_label(n) -> str:
+    if isinstance(n, qc.Func):
+        return f"{n.name.upper()}({_arg_label(n.arg)})"
+    if isinstance(n, qc.Year):
+        return f"PUBYEAR {n.op} {n.year}"
+    if n.text.startswith('"'):
+        # quoted phrases are kept as typed
+        return n.text
+    return n.text.upper()
+
+
+def tree_from_compiled(ast):
+    """
+    Build the analyzer tree from a compiled (distributed) query.
+    Compiled subtrees are shared, so every occurrence gets its own Node here:
+    the analyzer addresses terms by position (see reconstruct_query_excluding).
+    """
+    if isinstance(ast, qc.Bin):
+        left = tree_from_compiled(ast.left)
+        right = tree_from_compiled(ast.right)
+        label = f"({left.label} {ast.op} {right.label})"
+        return Node(label=label, left=left, right=right, op=ast.op)
+    return Node(_leaf_label(ast))
 
-        # parentheses
-        if c in "()":
-            tokens.append(c)
-            i += 1
-            continue
 
-        # everything else as part of a token until whitespace or parenthesis
-        j = i
-        while j < n and (not query[j].isspace()) and query[j] not in "()":
-            j += 1
-        token = query[i:j]
-        tokens.append(token.upper())
-        i = j
-
-    return tokens
-
-
-class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
-
-    def current(self):
-        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
-
-    def eat(self, expected=None):
-        tok = self.current()
-        if tok is None:
-            raise SyntaxError("Unexpected end of input")
-        if expected is not None and tok != expected:
-            raise SyntaxError(f"Expected {expected}, got {tok}")
-        self.pos += 1
-        return tok
-
-    def parse(self):
-        node = self.parse_expr()
-        if self.current() is not None:
-            raise SyntaxError(f"Unexpected token: {self.current()}")
-        return node
-
-    def parse_expr(self):
-        """
-        expr := term ( (AND|OR) term | term )*
-        No precedence between AND and OR.
-        Adjacency between terms is treated as implicit AND.
-        """
-        node = self.parse_term()
-        while True:
-            tok = self.current()
-            if tok in ("AND", "OR"):
-                # explicit operator
-                op = self.eat()
-                right = self.parse_term()
-                label = f"({node.label} {op} {right.label})"
-                node = Node(label=label, left=node, right=right, op=op)
-            elif tok is not None and tok != ")":
-                # implicit AND between adjacent terms
-                op = "AND"
-                right = self.parse_term()
-                label = f"({node.label} {op} {right.label})"
-                node = Node(label=label, left=node, right=right, op=op)
-            else:
-                break
-        return node
-
-    def parse_term(self):
-        """
-        term := IDENT | FUNCTION_CALL | PHRASE | PUBYEAR_TERM | '(' expr ')'
-        """
-        tok = self.current()
-        if tok == '(':
-            self.eat('(')
-            node = self.parse_expr()
-            self.eat(')')
-            return node
-        if tok is not None and tok not in ("AND", "OR", ")"):
-            # any non-operator, non-parenthesis token is a term
-            self.eat()
-            return Node(tok)
-        raise SyntaxError(f"Unexpected token in term: {tok}")
+def parse_query(query):
+    """
+    Compile the query (shared LRU with the arXiv translator) and build the analyzer tree.
+    Operators are grouped the way Scopus evaluates them, OR before AND, so the
+    subqueries rebuilt from the tree mean what was typed. Functions are
+    distributed over explicit AND/OR only.
+    """
+    return tree_from_compiled(qc.compile_query(query, or_first=True).distributed(implicit=False))
 
 
 def build_directed_graph(root):
@@ -593,7 +339,47 @@ def collect_nodes_and_parent_edge(root):
 
 
 
-def compute_node_scores(root, scorer, graph=None):
+def canonical_subquery(query):
+    """
+    Canonical form used to deduplicate and memoize subqueries:
+    whitespace collapsed and upper-cased (Scopus queries are case-insensitive).
+    """
+    return " ".join(query.split()).upper()
+
+
+class SubqueryScoreMemo:
+    """
+    Bounded, time-limited memo of subquery scores keyed by canonical subquery.
+    Shared between analyses so that repeated terms are only counted once.
+    """
+
+    def __init__(self, max_entries=2048, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            score, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return score
+
+    def put(self, key, score):
+        with self._lock:
+            self._entries[key] = (score, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def compute_node_scores(root, scorer, graph=None, executor=None, memo=None, on_score=None):
     """
     For node N with parent edge '+':
         score(N) = score(full_query) - score(query_without_N)
@@ -604,9 +390,15 @@ def compute_node_scores(root, scorer, graph=None):
     The root node score is the score of the full query.
     Each node also receives a metadata field:
         graph.nodes[n]["subquery_without"] = reconstructed_query_excluding(root, n)
+
+    When a graph is given, only nodes still present in it are scored.
+    Distinct subqueries (by canonical string) are scored once, concurrently
+    when an executor is given, and looked up in / stored to memo if provided;
+    only real counts are stored, a scorer failure (exception or None) propagates.
+    on_score(node, score, subquery) is called from the caller's thread as
+    soon as each node score is known.
     """
     full_query = reconstruct_query(root)
-    full_score = scorer(full_query)
 
     nodes, parent_edge = collect_nodes_and_parent_edge(root)
     scores = {}
@@ -617,45 +409,93 @@ def compute_node_scores(root, scorer, graph=None):
             graph.nodes[n]["score"] = None
             graph.nodes[n]["subquery_without"] = None
 
-    # ROOT
-    scores[root] = full_score
-    if graph is not None and root in graph:
-        graph.nodes[root]["score"] = full_score
-        graph.nodes[root]["subquery_without"] = None
-
-    # OTHER NODES
+    # Collect the distinct subqueries to score
+    full_key = canonical_subquery(full_query)
+    subqueries = {full_key: full_query}
+    waiting = {}  # canonical subquery -> [(node, subquery)]
     for n in nodes:
         if n is root:
             continue
-
-        edge = parent_edge[n]
-        if edge not in ('+', '-'):
+        if parent_edge[n] not in ('+', '-'):
             # no meaningful operator from parent
             continue
-
+        if graph is not None and n not in graph:
+            continue
         subquery = reconstruct_query_excluding(root, n)
-        sub_score = scorer(subquery)
+        key = canonical_subquery(subquery)
+        subqueries.setdefault(key, subquery)
+        waiting.setdefault(key, []).append((n, subquery))
 
-        if edge == '+':
-            s = full_score - sub_score
-        else:  # edge == '-'
-            s = sub_score - full_score
+    results = {}
+    full_score = None
 
+    def _set_score(n, s, subquery):
         scores[n] = s
-
         if graph is not None and n in graph:
             graph.nodes[n]["score"] = s
             graph.nodes[n]["subquery_without"] = subquery
+        if on_score is not None:
+            on_score(n, s, subquery)
+
+    def _resolve(key):
+        nonlocal full_score
+        if key == full_key:
+            full_score = results[key]
+            # ROOT
+            _set_score(root, full_score, None)
+            ready = [k for k in results if k in waiting]
+        elif full_score is not None:
+            ready = [key]
+        else:
+            return
+        # OTHER NODES
+        for k in ready:
+            for n, subquery in waiting.pop(k, []):
+                if parent_edge[n] == '+':
+                    s = full_score - results[k]
+                else:  # edge == '-'
+                    s = results[k] - full_score
+                _set_score(n, s, subquery)
+
+    def _score(key):
+        # a scorer that cannot count raises (or returns None): nothing is memoized then
+        value = scorer(subqueries[key])
+        if value is None:
+            raise RuntimeError(f"no score for {subqueries[key]!r}")
+        if memo is not None:
+            memo.put(key, value)
+        return value
+
+    to_run = []
+    for key in subqueries:
+        cached = memo.get(key) if memo is not None else None
+        if cached is not None:
+            results[key] = cached
+        else:
+            to_run.append(key)
+
+    # the full query first, so that node scores can be released as soon as possible
+    to_run.sort(key=lambda k: k != full_key)
+    for key in list(results):
+        _resolve(key)
+
+    if executor is None:
+        for key in to_run:
+            results[key] = _score(key)
+            _resolve(key)
+    else:
+        futures = {executor.submit(_score, key): key for key in to_run}
+        for fut in as_completed(futures):
+            key = futures[fut]
+            results[key] = fut.result()
+            _resolve(key)
 
     return scores
 
 
-
-
-
-def export_graph_to_json(root, G):
+def graph_to_dict(G):
     """
-    Export the directed graph with metadata to a JSON structure.
+    Convert the directed graph with metadata to a JSON-serializable structure.
 
     The structure is:
 
@@ -678,11 +518,10 @@ def export_graph_to_json(root, G):
         ]
     }
 
-    Node identifiers are stable integers for JSON export.
+    Node identifiers are stable integers for JSON export (see node_ids).
     """
 
-    # Assign stable integer IDs to nodes
-    node_id_map = {node: idx for idx, node in enumerate(G.nodes())}
+    node_id_map = node_ids(G)
 
     # Build nodes list
     json_nodes = []
@@ -705,25 +544,32 @@ def export_graph_to_json(root, G):
         })
 
     # Aggregate
-    data = {
+    return {
         "nodes": json_nodes,
         "edges": json_edges
     }
 
-    # Return JSON string
-    return json.dumps(data, indent=2)
 
+def node_ids(G):
+    """Assign stable integer IDs to nodes."""
+    return {node: idx for idx, node in enumerate(G.nodes())}
+
+
+def export_graph_to_json(root, G):
+    """
+    Export the directed graph with metadata to a JSON string (see graph_to_dict).
+    """
+    return json.dumps(graph_to_dict(G), indent=2)
 
-def get_json_analyzed_query(query,query_performer):
 
-    expanded_query = distribute_function_on_boolean_terms(query)
-    tokens = tokenize(expanded_query)
-    parser = Parser(tokens)
-    root = parser.parse()
+def build_analysis_graph(query):
+    """
+    Parse the query and build the flattened, labelled analysis graph (without scores).
+    """
+    root = parse_query(query)
 
     G = build_directed_graph(root)
 
-    compute_node_scores(root, query_performer, G)
     flatten_or_leaf_siblings(G)
     annotate_term_labels(root, G)
 
@@ -738,7 +584,35 @@ def get_json_analyzed_query(query,query_performer):
         elif labels and all(l == "-" for l in labels):
             G.nodes[node]["term_label"] = "AND"
 
-    return export_graph_to_json(root,G)
+    return root, G
+
+
+def get_json_analyzed_query(query, query_performer, executor=None, memo=None):
+
+    root, G = build_analysis_graph(query)
+    compute_node_scores(root, query_performer, G, executor=executor, memo=memo)
+
+    return export_graph_to_json(root, G)
+
+
+def stream_analyzed_query(query, query_performer, graph_callback, score_callback, executor=None, memo=None):
+    """
+    Same as get_json_analyzed_query, but reports progressively:
+    graph_callback(graph_dict) once with the unscored graph, then
+    score_callback({"id", "score", "subquery_without"}) for every node as its score arrives.
+    Returns the final JSON export.
+    """
+    root, G = build_analysis_graph(query)
+    node_id_map = node_ids(G)
+    graph_callback(graph_to_dict(G))
+
+    def on_score(n, score, subquery):
+        if n in node_id_map:
+            score_callback({"id": node_id_map[n], "score": score, "subquery_without": subquery})
+
+    compute_node_scores(root, query_performer, G, executor=executor, memo=memo, on_score=on_score)
+
+    return export_graph_to_json(root, G)
 
 if __name__ == "__main__":
     query = (
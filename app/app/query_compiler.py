@@ -0,0 +1,323 @@
+import re
+import weakref
+from dataclasses import dataclass
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, Dict, List
+
+# Token types
+AND = 'AND'
+OR = 'OR'
+ID = 'ID'
+QUOT = 'QUOT'
+NUM = 'NUM'
+LP = 'LP'
+RP = 'RP'
+GT = 'GT'
+LT = 'LT'
+EQ = 'EQ'
+EOF = 'EOF'
+
+
+@dataclass(frozen=True)
+class Tok:
+    typ: str
+    val: str
+
+
+# one alternation, scanned left to right with finditer: linear in the query length
+_TOKEN_RE = re.compile(r'''
+    (?P<WS>\s+)
+  | (?P<QUOT>"[^"]*")
+  | (?P<UNTERMINATED>")
+  | (?P<WORD>[^\W\d_][\w\-]*)
+  | (?P<NUM>\d+(?:\.\d+)?)
+  | (?P<LP>\()
+  | (?P<RP>\))
+  | (?P<GT>>)
+  | (?P<LT><)
+  | (?P<EQ>=)
+  | (?P<OTHER>[^\s()"<>=]+)
+''', re.VERBOSE)
+
+
+_GLUED = ('WORD', 'NUM', 'OTHER')
+
+
+def tokenize(s: str) -> List[Tok]:
+    tokens = []
+    prev_kind, prev_end = None, -1
+    for m in _TOKEN_RE.finditer(s):
+        kind = m.lastgroup
+        val = m.group()
+        if kind == 'WS':
+            prev_kind = None
+            continue
+        if kind == 'UNTERMINATED':
+            raise ValueError("Unterminated quote")
+        glued = kind in _GLUED and prev_kind in _GLUED and m.start() == prev_end
+        prev_kind, prev_end = kind, m.end()
+        if glued:
+            # fragments written without whitespace form one term: C++, 0000-0002-1825-0097
+            tokens[-1] = Tok(ID, tokens[-1].val + val)
+            continue
+        if kind == 'WORD':
+            up = val.upper()
+            if up == 'AND':
+                tokens.append(Tok(AND, 'AND'))
+            elif up == 'OR':
+                tokens.append(Tok(OR, 'OR'))
+            else:
+                tokens.append(Tok(ID, val))
+        elif kind == 'OTHER':
+            tokens.append(Tok(ID, val))
+        else:
+            tokens.append(Tok(kind, val))
+    tokens.append(Tok(EOF, ''))
+    return tokens
+
+
+# AST
+#
+# Nodes are immutable and hash-consed: structurally identical subtrees are the
+# same object, so identity comparison is structural equality and per-node
+# memoization (distribution, translation) is shared across the whole tree.
+
+@dataclass(frozen=True, eq=False)
+class Node:
+    pass
+
+
+@dataclass(frozen=True, eq=False)
+class Term(Node):
+    text: str  # raw token text
+
+
+@dataclass(frozen=True, eq=False)
+class Year(Node):
+    op: str    # '>', '<' or '='
+    year: str  # digits
+
+
+@dataclass(frozen=True, eq=False)
+class Func(Node):
+    name: str
+    arg: Node
+
+
+@dataclass(frozen=True, eq=False)
+class Bin(Node):
+    op: str         # 'AND' or 'OR'
+    left: Node
+    right: Node
+    implicit: bool = False  # AND between adjacent terms, no operator in the source
+
+
+_interned: "weakref.WeakValueDictionary[tuple, Node]" = weakref.WeakValueDictionary()
+_interned_lock = Lock()
+
+
+def _hashcons(cls, *fields) -> Node:
+    key = (cls,) + fields
+    with _interned_lock:
+        node = _interned.get(key)
+        if node is None:
+            node = cls(*fields)
+            _interned[key] = node
+        return node
+
+
+def term(text: str) -> Term:
+    return _hashcons(Term, text)
+
+
+def year(op: str, value: str) -> Year:
+    return _hashcons(Year, op, value)
+
+
+def func(name: str, arg: Node) -> Func:
+    return _hashcons(Func, name, arg)
+
+
+def binop(op: str, left: Node, right: Node, implicit: bool = False) -> Bin:
+    return _hashcons(Bin, op, left, right, implicit)
+
+
+# PUBYEAR comparisons, Scopus also spells them out
+_YEAR_OPS = {'>': '>', '<': '<', '=': '=', 'AFT': '>', 'BEF': '<', 'IS': '='}
+
+
+class Parser:
+    """
+    Recursive descent parser, adjacent primaries are joined by an implicit AND.
+    AND binds tighter than OR by default; with or_first=True OR binds tighter,
+    which is how Scopus groups `a OR b AND c`: (a OR b) AND c.
+    """
+
+    def __init__(self, tokens: List[Tok], or_first: bool = False):
+        self.toks = tokens
+        self.i = 0
+        # operators from the loosest level to the tightest
+        self.levels = (AND, OR) if or_first else (OR, AND)
+
+    def peek(self) -> Tok:
+        return self.toks[self.i]
+
+    def consume(self) -> Tok:
+        tok = self.toks[self.i]
+        self.i += 1
+        return tok
+
+    def expect(self, typ: str) -> Tok:
+        tok = self.peek()
+        if tok.typ != typ:
+            raise ValueError(f"Expected {typ}, got {tok}")
+        return self.consume()
+
+    def parse(self) -> Node:
+        node = self.parse_expr()
+        if self.peek().typ != EOF:
+            raise ValueError("Extra tokens at end")
+        return node
+
+    def parse_expr(self) -> Node:
+        return self.parse_level(0)
+
+    def _operator(self):
+        """(operator, implicit) at the cursor, None when the expression ends here."""
+        typ = self.peek().typ
+        if typ in (AND, OR):
+            return typ, False
+        if typ in (ID, QUOT, NUM, LP):
+            return AND, True
+        return None
+
+    def parse_level(self, level: int) -> Node:
+        if level == len(self.levels):
+            return self.parse_primary()
+        op = self.levels[level]
+        node = self.parse_level(level + 1)
+        while True:
+            found = self._operator()
+            if found is None or found[0] != op:
+                break
+            implicit = found[1]
+            if not implicit:
+                self.consume()
+            rhs = self.parse_level(level + 1)
+            node = binop(op, node, rhs, implicit)
+        return node
+
+    def parse_primary(self) -> Node:
+        tok = self.peek()
+        if tok.typ == LP:
+            self.consume()
+            expr = self.parse_expr()
+            self.expect(RP)
+            return expr
+        if tok.typ == ID:
+            id_tok = self.consume()
+            if id_tok.val.upper() == 'PUBYEAR':
+                op_tok = self.peek()
+                if op_tok.typ in (GT, LT, EQ, ID) and op_tok.val.upper() in _YEAR_OPS:
+                    self.consume()
+                    year_tok = self.expect(NUM)
+                    return year(_YEAR_OPS[op_tok.val.upper()], year_tok.val)
+                raise ValueError("PUBYEAR must be followed by '>', '<', '=', AFT, BEF or IS")
+            if self.peek().typ == LP:
+                self.consume()
+                arg = self.parse_expr()
+                self.expect(RP)
+                return func(id_tok.val, arg)
+            return term(id_tok.val)
+        if tok.typ in (QUOT, NUM):
+            self.consume()
+            return term(tok.val)
+        raise ValueError(f"Unexpected token {tok}")
+
+
+def distribute(node: Node, implicit: bool = True) -> Node:
+    """
+    Push functions down boolean terms: FUNC(a OR b) -> FUNC(a) OR FUNC(b).
+    With implicit=False, implicit ANDs are kept inside the function
+    (TITLE(network slicing) stays a single function call).
+    Shared subtrees are only rewritten once.
+    """
+    memo: Dict[Node, Node] = {}
+
+    def push(name: str, arg: Node) -> Node:
+        if isinstance(arg, Bin) and (implicit or not arg.implicit):
+            return binop(arg.op, push(name, arg.left), push(name, arg.right), arg.implicit)
+        return func(name, arg)
+
+    # iterative post-order walk: long AND/OR chains are deep left spines
+    stack = [node]
+    while stack:
+        n = stack[-1]
+        if n in memo:
+            stack.pop()
+            continue
+        if isinstance(n, Bin):
+            pending = [c for c in (n.left, n.right) if c not in memo]
+            if pending:
+                stack.extend(pending)
+                continue
+            memo[n] = binop(n.op, memo[n.left], memo[n.right], n.implicit)
+        elif isinstance(n, Func):
+            if n.arg not in memo:
+                stack.append(n.arg)
+                continue
+            memo[n] = push(n.name, memo[n.arg])
+        else:
+            memo[n] = n
+        stack.pop()
+
+    return memo[node]
+
+
+def to_str(node: Node, parent_prec: int = 0) -> str:
+    if isinstance(node, Bin):
+        prec = 1 if node.op == 'OR' else 2
+        left_s = to_str(node.left, prec)
+        right_s = to_str(node.right, prec + 1)
+        s = f"{left_s} {node.op} {right_s}"
+        if prec < parent_prec:
+            return f"({s})"
+        return s
+    if isinstance(node, Func):
+        return f"{node.name}({to_str(node.arg, 0)})"
+    if isinstance(node, Year):
+        return f"PUBYEAR {node.op} {node.year}"
+    if isinstance(node, Term):
+        return node.text
+    raise TypeError(node)
+
+
+class CompiledQuery:
+    """
+    A parsed query with its distributed forms and the translations derived
+    from it, computed once and shared by every consumer of the same query string.
+    """
+
+    def __init__(self, source: str, ast: Node):
+        self.source = source
+        self.ast = ast
+        self._derived: Dict[object, object] = {}
+
+    def distributed(self, implicit: bool = True) -> Node:
+        return self.derive(("distributed", implicit), lambda: distribute(self.ast, implicit))
+
+    def derive(self, key, build: Callable[[], object]):
+        """Memoize build() under key for this query. Races only duplicate work."""
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = build()
+            self._derived[key] = value
+            return value
+
+
+@lru_cache(maxsize=512)
+def compile_query(query: str, or_first: bool = False) -> CompiledQuery:
+    """Tokenize and parse a Scopus query once; subsequent calls hit the LRU. or_first: see Parser."""
+    return CompiledQuery(query, Parser(tokenize(query), or_first).parse())
@@ -0,0 +1,210 @@
+"""
+Compact records for search results. A search holds up to a thousand papers per
+client, kept as slotted objects rather than 23-key dicts, with the strings that
+repeat across papers (venues, countries, affiliations, author names and ids)
+interned so every paper of a venue or author shares one copy.
+
+Records read and write like the dicts they replace (paper["X-abstract"],
+paper.get("doi"), paper.items()); to_wire() is the one place that turns them
+into the wire format sent to clients and stored with search jobs.
+
+    python -m app.records    # memory of 1000 results, dicts against records
+"""
+import re
+import sys
+
+_MISSING = object()
+
+# wire keys of a paper, in the order clients have always received them
+PAPER_FIELDS = ("doi", "issn", "title", "year", "x-precise-date", "pubtitle", "scopis_id", "pub_rank",
+                "rank_source", "hindex", "X-OA", "X-FirstAuthor", "X-Country-First-Author",
+                "X-Country-First-affiliation", "X-FirstAuthor-ORCID", "X-FirstAuthor-OpenAlex",
+                "X-IsReferencedByCount", "X-subject", "X-refcount", "X-abstract", "X-authors", "X-authors-list",
+                "X-OA-URL")
+
+# values shared by many papers of a search
+INTERNED_FIELDS = frozenset(("issn", "pubtitle", "pub_rank", "rank_source", "X-FirstAuthor",
+                             "X-Country-First-Author", "X-Country-First-affiliation", "X-FirstAuthor-ORCID",
+                             "X-FirstAuthor-OpenAlex", "X-subject"))
+
+
+def _attribute(key):
+    return re.sub(r"\W", "_", key).lower()
+
+
+_ATTRIBUTES = {key: _attribute(key) for key in PAPER_FIELDS}
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Author:
+    """One entry of X-authors-list; fields the source did not provide stay out of the wire format."""
+
+    __slots__ = ("display_name", "orcid", "openalex")
+
+    def __init__(self, display_name, orcid=_MISSING, openalex=_MISSING):
+        self.display_name = _intern(display_name)
+        if orcid is not _MISSING:
+            self.orcid = _intern(orcid)
+        if openalex is not _MISSING:
+            self.openalex = _intern(openalex)
+
+    @classmethod
+    def from_wire(cls, author):
+        if isinstance(author, Author):
+            return author
+        return cls(author.get("display_name", ""), author.get("orcid", _MISSING), author.get("openalex", _MISSING))
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def to_wire(self):
+        return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+
+    def __reduce__(self):
+        return Author.from_wire, (self.to_wire(),)
+
+    def __repr__(self):
+        return f"Author({self.to_wire()!r})"
+
+
+class Paper:
+    """
+    A search result. Keys outside PAPER_FIELDS are accepted and kept aside in
+    `extra`, so providers can add fields without touching this class.
+    """
+
+    __slots__ = tuple(_ATTRIBUTES.values()) + ("extra",)
+
+    @classmethod
+    def from_wire(cls, fields):
+        if isinstance(fields, Paper):
+            return fields
+        paper = cls()
+        for key, value in fields.items():
+            paper[key] = value
+        return paper
+
+    def __setitem__(self, key, value):
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is None:
+            try:
+                self.extra[key] = value
+            except AttributeError:
+                self.extra = {key: value}
+            return
+        if key in INTERNED_FIELDS:
+            value = _intern(value)
+        elif key == "X-authors-list" and value:
+            value = [Author.from_wire(author) for author in value]
+        setattr(self, attribute, value)
+
+    def get(self, key, default=None):
+        attribute = _ATTRIBUTES.get(key)
+        if attribute is None:
+            return getattr(self, "extra", {}).get(key, default)
+        return getattr(self, attribute, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def items(self):
+        for key, attribute in _ATTRIBUTES.items():
+            value = getattr(self, attribute, _MISSING)
+            if value is not _MISSING:
+                yield key, value
+        yield from getattr(self, "extra", {}).items()
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def to_wire(self):
+        """The paper as the dict clients receive."""
+        wire = {}
+        for key, value in self.items():
+            if key == "X-authors-list" and value:
+                value = [author.to_wire() if isinstance(author, Author) else author for author in value]
+            wire[key] = value
+        return wire
+
+    def __reduce__(self):
+        return Paper.from_wire, (self.to_wire(),)
+
+    def __repr__(self):
+        return f"Paper({self.to_wire()!r})"
+
+
+def to_wire(obj):
+    """JSON `default` hook for records; other objects are left to the caller."""
+    if isinstance(obj, (Paper, Author)):
+        return obj.to_wire()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if __name__ == "__main__":
+    # memory held by the results of one 1000-paper search, as decoded from upstream
+    # JSON (every string its own object) and kept as dicts or as records
+    import gc
+    import json
+    import random
+    import string
+    import tracemalloc
+
+    random.seed(1)
+
+    def words(n):
+        return " ".join("".join(random.choices(string.ascii_lowercase, k=random.randint(3, 10))) for _ in range(n))
+
+    venues = [words(5) for _ in range(60)]
+    affiliations = [words(4) for _ in range(150)]
+    authors = [{"display_name": words(2), "orcid": f"0000-0002-{i:04d}-0000",
+                "openalex": f"https://openalex.org/A{i}"} for i in range(400)]
+    source = []
+    for i in range(1000):
+        paper_authors = random.sample(authors, 6)
+        source.append({
+            "doi": f"https://doi.org/10.{random.randint(1000, 9999)}/{i}", "title": words(12),
+            "year": 2000 + i % 25, "x-precise-date": "2021-03-04", "pubtitle": random.choice(venues),
+            "pub_rank": "", "rank_source": "", "hindex": "", "X-OA": i % 2 == 0,
+            "X-FirstAuthor": paper_authors[0]["display_name"], "X-Country-First-Author": random.choice(["fra", "usa"]),
+            "X-Country-First-affiliation": random.choice(affiliations), "X-FirstAuthor-ORCID": "",
+            "X-FirstAuthor-OpenAlex": "", "X-IsReferencedByCount": random.randint(0, 5000),
+            "X-subject": random.choice(venues[:20]), "X-refcount": random.randint(0, 90),
+            "X-abstract": words(180), "X-authors": ", ".join(a["display_name"] for a in paper_authors),
+            "X-authors-list": paper_authors, "X-OA-URL": f"https://example.org/{i}.pdf"})
+    payload = json.dumps(source)
+    del source
+
+    def retained(build):
+        gc.collect()
+        tracemalloc.start()
+        results = build()
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return size, results
+
+    dict_size, dicts = retained(lambda: json.loads(payload))
+    record_size, records = retained(lambda: [Paper.from_wire(paper) for paper in json.loads(payload)])
+    assert [paper.to_wire() for paper in records] == dicts
+    del dicts
+    gc.collect()
+    abstracts = sum(sys.getsizeof(paper["X-abstract"]) for paper in records)
+    print(f"1000 results: dicts {dict_size / 1e6:.2f} MB, records {record_size / 1e6:.2f} MB "
+          f"({100 * (1 - record_size / dict_size):.0f}% less); abstracts alone {abstracts / 1e6:.2f} MB")
+    print(f"without abstracts: dicts {(dict_size - abstracts) / 1e6:.2f} MB, "
+          f"records {(record_size - abstracts) / 1e6:.2f} MB")
@@ -1,6 +1,11 @@
-import json
+import html
+import logging
 import re
+import time
 from collections import Counter
+from urllib.parse import urlencode
+from concurrent.futures import as_completed
+from threading import Lock
 import os
 import pyalex
 from pyalex import (Authors, Funders, Institutions, Publishers, Sources,
@@ -10,6 +15,13 @@ from pyalex import (Authors, Funders, Institutions, Publishers, Sources,
 
 pyalex.config.email = os.getenv("PYALEX_EMAIL","nico@scholar.miage.dev")
 from app.cache import session_doi, session_orcid, session_xref
+from app.business import get_crossref_executor
+from app import jsoncodec
+
+logger = logging.getLogger('researchers')
+
+_DOI_URL_PREFIX = re.compile(r"^https?://(?:dx\.)?doi\.org/", flags=re.I)
+
 
 def lookup_doi_data(doi):
     url = "http://dx.doi.org/" + doi
@@ -92,7 +104,8 @@ def _compute_acronym_from_title(title: str) -> str | None:
     return None
 
 
-def extract_acronym(event_name: str) -> str | None:
+def explicit_acronym(event_name: str) -> str | None:
+    """Acronym written in the event name itself, None if it would have to be computed."""
     # Case 1: starts with acronym (uppercase letters), optionally followed by digits (e.g., year).
     m = re.match(r"^([A-Z]{2,})(?:\d{2,4})?\b", event_name)
     if m:
@@ -108,14 +121,49 @@ def extract_acronym(event_name: str) -> str | None:
     if m:
         return m.group(1).upper()
 
+    return None
+
+
+def extract_acronym(event_name: str) -> str | None:
     # Fallback: compute from title.
-    return _compute_acronym_from_title(event_name)
+    return explicit_acronym(event_name) or _compute_acronym_from_title(event_name)
 
 
 def count_acronyms(event_names: list[str]) -> dict[str, int]:
     return dict(Counter(filter(None, (extract_acronym(s) for s in event_names))))
 
 
+# only what the venue profile needs, keeps the 200-work pages small
+OPENALEX_VENUE_FIELDS = "id,doi,title,publication_year,primary_location"
+# sources that do not identify where the work was actually published
+_AMBIGUOUS_SOURCE_TYPES = {"repository", "ebook platform", "book series", "other"}
+
+
+def _venue_name(name):
+    """OpenAlex source name, unescaped and with whitespace collapsed like Crossref titles."""
+    return _MULTI_WS.sub(" ", html.unescape(name)).strip(" .,;") if name else name
+
+
+def _openalex_venue(work):
+    """
+    Venue and acronym hint from the work's own OpenAlex source.
+    Returns (None, "") when the source is missing or ambiguous, so that Crossref is asked instead.
+    """
+    source = (work.get("primary_location") or {}).get("source")
+    if not source or not source.get("display_name"):
+        return None, ""
+    name = _venue_name(source["display_name"])
+    source_type = (source.get("type") or "").lower()
+    if source_type in _AMBIGUOUS_SOURCE_TYPES:
+        return None, ""
+    if source_type == "conference":
+        acronym = explicit_acronym(name)
+        if not acronym:
+            return None, ""
+        return acronym, name
+    return name, ""
+
+
 def get_venue_for_openalex(openalex_id, venue_callback=my_yield, author_callback=lambda *args, **kwargs: None):
 
     author = Authors()[openalex_id]
@@ -123,11 +171,19 @@ def get_venue_for_openalex(openalex_id, venue_callback=my_yield, author_callback
     venues = []
     dois = []
     bad = {}
-    for work_page in Works().filter(authorships={"author": {"id": openalex_id}}).paginate(per_page=200):
+    works = Works().filter(authorships={"author": {"id": openalex_id}}).select(OPENALEX_VENUE_FIELDS)
+    for work_page in works.paginate(per_page=200):
         for work in work_page:
-            if "doi" in work:
+            venue, aka = _openalex_venue(work)
+            if venue:
+                venues.append(venue)
+                venue_callback(jsoncodec.dumps(
+                    {"venue": venue, "doi": work.get("doi") or work.get("id"), "publication_year": work.get("publication_year"),
+                     "publication_title": [work.get("title") or ""], "aka": aka}))
+            elif work.get("doi"):
                 dois.append(work["doi"])
 
+    # Crossref only for the works OpenAlex could not place
     extract_doi_with_xref(venue_callback, dois, venues, bad)
 
     return venues
@@ -151,28 +207,136 @@ def get_venue_for_orcid(orcid, venue_callback=my_yield, author_callback=lambda *
     return venues
 
 
+class RateLimiter:
+    """Thread-safe limiter spacing acquisitions to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+CROSSREF_WORKS = "https://api.crossref.org/works"
+CROSSREF_SELECT = "DOI,event,assertion,container-title,short-container-title,created,title"
+CROSSREF_BATCH_SIZE = 40
+crossref_rate_limiter = RateLimiter(float(os.getenv("CROSSREF_RATE", "10")))
+
+
+def _bare_doi(doi: str) -> str:
+    return _DOI_URL_PREFIX.sub("", doi).strip().lower()
+
+
+def _crossref_selected_url(doi):
+    """
+    Single-DOI filter query restricted to CROSSREF_SELECT: the cache key of the partial
+    records this module reads. /works/{doi} stays reserved for full records.
+    """
+    return f"{CROSSREF_WORKS}?" + urlencode({"filter": f"doi:{_bare_doi(doi)}", "select": CROSSREF_SELECT, "rows": 1,
+                                             "mailto": pyalex.config.email})
+
+
+def _fetch_crossref_single(doi, throttle=False):
+    """Per-DOI lookup, used for DOIs already in the cache and as a fallback."""
+    if throttle:
+        crossref_rate_limiter.acquire()
+    response = session_xref.get(_crossref_selected_url(doi))
+    if response.status_code != 200:
+        return {}
+    return {_bare_doi(item["DOI"]): item for item in response.json()["message"].get("items", []) if "DOI" in item}
+
+
+def _fetch_crossref_batch(dois):
+    """
+    One filter=doi:...,doi:... query for a batch of DOIs, restricted to the fields we use.
+    Each work found is also cached as the answer of its single-DOI query, so the
+    next profile naming it is served from the cache.
+    """
+    crossref_rate_limiter.acquire()
+    response = session_xref.get(CROSSREF_WORKS, params={
+        "filter": ",".join(f"doi:{_bare_doi(doi)}" for doi in dois),
+        "select": CROSSREF_SELECT,
+        "rows": len(dois),
+        "mailto": pyalex.config.email,
+    })
+    if response.status_code != 200:
+        logger.warning("crossref batch lookup failed (%s), falling back to single lookups", response.status_code)
+        found = {}
+        for doi in dois:
+            found.update(_fetch_crossref_single(doi, throttle=True))
+        return found
+    found = {_bare_doi(item["DOI"]): item for item in response.json()["message"].get("items", []) if "DOI" in item}
+    for doi in dois:
+        item = found.get(_bare_doi(doi))
+        if item is not None:
+            session_xref.store(_crossref_selected_url(doi), {
+                "status": "ok", "message-type": "work-list",
+                "message": {"total-results": 1, "items": [item], "items-per-page": 1}})
+    return found
+
+
+def _xref_venue(response_json):
+    aka = ""
+    venue = None
+    if "event" in response_json:
+        venue = extract_acronym(response_json["event"]["name"])
+        aka = response_json["event"]["name"]
+
+    if not venue and "assertion" in response_json:
+        conf_accr = [assertion["value"] for assertion in response_json["assertion"]
+                     if assertion["name"] == "conference_acronym"]
+        if len(conf_accr) > 0:
+            venue = conf_accr[0]
+            aka = conf_accr[0]
+    if not venue and "short-container-title" in response_json and len(response_json["short-container-title"]) > 0:
+        venue = response_json["short-container-title"][-1]
+    if (not venue or len(venue) == 0) and "container-title" in response_json and len(response_json["container-title"]) > 0:
+        venue = response_json["container-title"][-1]
+    return venue, aka
+
+
 def extract_doi_with_xref(venue_callback, dois, venues, bad):
+    """
+    Resolve the venue of each DOI through Crossref.
+    DOIs already cached are read one by one, the others are looked up in
+    batched filter=doi: queries, concurrently under the polite-pool rate limit.
+    venue_callback is called from the caller's thread as results arrive.
+    """
+    by_key = {}
     for doi in dois:
-        aka=""
-        venue = None
-        response = session_xref.get(f"https://api.crossref.org/works/{doi}")
-        if response.status_code == 200:
-            response_json = response.json()["message"]
-
-            if "event" in response_json:
-                venue = extract_acronym(response_json["event"]["name"])
-                aka=response_json["event"]["name"]
-
-            if not venue and "assertion" in response_json:
-                conf_accr = [assertion["value"] for assertion in response_json["assertion"]
-                             if assertion["name"] == "conference_acronym"]
-                if len(conf_accr) > 0:
-                    venue = conf_accr[0]
-                    aka=conf_accr[0]
-            if not venue and "short-container-title" in response_json and len(response_json["short-container-title"]) > 0:
-                venue = response_json["short-container-title"][-1]
-            if (not venue or len(venue) == 0) and "container-title" in response_json and len(response_json["container-title"]) > 0:
-                venue = response_json["container-title"][-1]
+        if doi:
+            by_key.setdefault(_bare_doi(doi), doi)
+
+    # one pipelined read warms the in-process cache for every DOI the backend already holds
+    urls = {key: _crossref_selected_url(doi) for key, doi in by_key.items()}
+    held = session_xref.prefetch(list(urls.values()))
+    cached = [key for key in by_key if urls[key] in held]
+    cached_set = set(cached)
+    missing = sorted(key for key in by_key if key not in cached_set)
+
+    executor = get_crossref_executor()
+    futures = [executor.submit(_fetch_crossref_single, by_key[key]) for key in cached]
+    futures += [executor.submit(_fetch_crossref_batch, [by_key[key] for key in missing[i:i + CROSSREF_BATCH_SIZE]])
+                for i in range(0, len(missing), CROSSREF_BATCH_SIZE)]
+
+    for fut in as_completed(futures):
+        try:
+            found = fut.result()
+        except Exception as e:
+            logger.exception("crossref lookup failed", exc_info=e)
+            continue
+        for key, response_json in found.items():
+            doi = by_key.get(key)
+            if doi is None:
+                continue
+            venue, aka = _xref_venue(response_json)
             if not venue:
                 bad[doi] = response_json
             else:
@@ -180,5 +344,5 @@ def extract_doi_with_xref(venue_callback, dois, venues, bad):
                 publication_year = response_json["created"]["date-parts"][0][0]
                 publication_title = response_json["title"]
 
-                venue_callback(json.dumps(
+                venue_callback(jsoncodec.dumps(
                     {"venue": venue, "doi": doi, "publication_year": publication_year, "publication_title": publication_title, "aka":aka}))
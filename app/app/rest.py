@@ -1,18 +1,25 @@
-import requests
-
 from app.main import app, db
 from app.model import ScpusFeed, ScpusRequest, PublicationSource, NetworkData
-from app.business import count_results_for_query, get_papers, update_feed, generate_rss, get_sources, \
-    get_ref_for_doi, get_ranking, refresh_ranking, net_get_graph_data
+from app.business import count_search, get_papers, update_feed, generate_rss, get_sources, \
+    get_ref_for_doi, get_ranking, refresh_ranking, net_get_graph_data, net_get_graph_analytics, \
+    count_results_for_query_sum, get_query_analysis_executor, query_analysis_memo, find_abstracts
 from app.query_analyzer import get_json_analyzed_query
+from app.cache import cache_health, memory_cache
+from app import cache_maintenance
+from app.http_client import get_session, register_upstream
 from flask import abort, Response, render_template, request, session, redirect, url_for, send_from_directory
 # from mendeley import Mendeley
 # from mendeley.session import MendeleySession
 # from mendeley.exception import MendeleyException, MendeleyApiException
-import json
 import pickle
 import os
 from app.researchers import get_venue_for_orcid, get_venue_for_openalex
+from app.history import popular_queries
+from app.write_behind import write_behind
+from app.database import statement_stats
+from app import metrics
+from app import abstracts, jsoncodec
+from app.search_jobs import search_jobs, load_snapshot
 from collections import Counter
 
 # mendeley = Mendeley(MENDELEY_CLIENT_ID, MENDELEY_SECRET, redirect_uri="http://localhost:5000/oauth")
@@ -35,7 +42,7 @@ def list_sources():
     sources = [{"short_name": ps.short_name, "full_text_name": ps.full_text_name, "code": ps.code} for ps in
                db.session.query(PublicationSource).all()]
     response = app.response_class(
-        response=json.dumps(sources),
+        response=jsoncodec.dumps(sources),
         status=200,
         mimetype='application/json'
     )
@@ -76,6 +83,7 @@ def list_feeds():
 
 @app.route("/feed/<id>.rss", methods=["DELETE"])
 def remove_rss(id):
+    write_behind.settle("feed", id)
     try:
         feed = db.session.query(ScpusFeed).filter(ScpusFeed.id == id).one()
         db.session.delete(feed)
@@ -88,6 +96,7 @@ def remove_rss(id):
 
 @app.route("/feed/<id>.rss/items", methods=["DELETE"])
 def purge_items(id):
+    write_behind.settle("feed", id)
     try:
         feed = db.session.query(ScpusFeed).filter(ScpusFeed.id == id).one()
     except db.orm.exc.NoResultFound as e:
@@ -100,16 +109,17 @@ def purge_items(id):
 
 @app.route("/feed/<id>.rss")
 def get_feed(id):
+    write_behind.settle("feed", id)
     try:
         feed = db.session.query(ScpusFeed).filter(ScpusFeed.id == id).one()
     except db.orm.exc.NoResultFound as e:
         return abort(404, description="No feed with this id")
 
-    count_scopus, count_arxiv = count_results_for_query(
-        feed.query, include_arxiv=True)
-    if count_scopus+count_arxiv != feed.count:
-        dois = get_papers(count_scopus, feed.query, arxiv=True, xref=True,
-                          existing_data=pickle.loads(feed.feed_content), count_arxiv=count_arxiv)
+    context = count_search(feed.query, include_arxiv=True)
+    if context.count_scopus+context.count_arxiv != feed.count:
+        dois = get_papers(context.count_scopus, feed.query, arxiv=True, xref=True,
+                          existing_data=pickle.loads(feed.feed_content), count_arxiv=context.count_arxiv,
+                          search_context=context)
     else:
         dois = []
     if feed.feed_content is not None:
@@ -118,7 +128,7 @@ def get_feed(id):
         feed_content = {}
 
     update_feed(dois, feed_content)
-    feed.count = count_scopus+count_arxiv
+    feed.count = context.count_scopus + context.count_arxiv
     feed.feed_content = pickle.dumps(feed_content)
     feed.hit += 1
     db.session.commit()
@@ -179,21 +189,27 @@ def get_info_for_doi(doi1, doi2):
 def get_doi_for_title():
     title = request.args.get('title')
     query = f"TITLE({title})"
-    count_scopus, _ = count_results_for_query(query)
-    dois = get_papers(count_scopus, query, False)
+    context = count_search(query)
+    dois = get_papers(context.count_scopus, query, False, search_context=context)
     if (len(dois) == 0):
         abort(404)
     return app.response_class(
-        response=json.dumps(dois[0]["doi"]),
+        response=jsoncodec.dumps(dois[0]["doi"]),
         status=200,
         mimetype='application/json'
     )
 
 
+# formatted citations are cached per (doi, style): the style travels in the Accept header
+register_upstream("cite", pool_maxsize=10, timeout=15, cache_namespace="cite", match_headers=['Accept'])
+
+
 @app.route("/cite", methods=["GET"])
 def cite():
     doi = request.args.get('doi')
     style = request.args.get('style')
+    if not doi:
+        abort(400, description="Missing doi")
     if style == "bibtex":
         accept = "application/x-bibtex"
         headers = {'Accept': f"{accept}"}
@@ -202,10 +218,10 @@ def cite():
         accept = "text/x-bibliography"
         headers = {'Accept': f"{accept}; style={style}"}
 
-    resp = requests.get(f"https://doi.org/{doi}", headers=headers)
+    resp = get_session("cite").get(f"https://doi.org/{doi.strip().lower()}", headers=headers)
     if resp.status_code == 200:
         return app.response_class(
-            response=json.dumps(
+            response=jsoncodec.dumps(
                 {"doi": doi, "citation": resp.content.decode("utf-8")}),
             status=200,
             mimetype='application/json'
@@ -220,18 +236,27 @@ def history():
     limit = request.args.get('limit')
     if limit is None:
         limit = 100
-    queries = db.session.query(ScpusRequest).order_by(
-        ScpusRequest.id.desc()).limit(limit).all()
-    accepts = request.headers["Accept"].split(",")
+    popular = request.args.get('popular') == "1"
+    if popular:
+        queries = popular_queries(int(limit))
+    else:
+        queries = db.session.query(ScpusRequest).order_by(
+            ScpusRequest.id.desc()).limit(limit).all()
+    accepts = request.headers.get("Accept", "").split(",")
     if "application/json" in accepts:
+        if popular:
+            payload = [{"query": q.query, "runs": q.runs, "last_seen": q.last_seen.isoformat(),
+                        "last_count": q.last_count} for q in queries]
+        else:
+            payload = [q.query for q in queries]
         return app.response_class(
-            response=json.dumps([q.query for q in queries]),
+            response=jsoncodec.dumps(payload),
             status=200,
             mimetype='application/json'
         )
 
     else:
-        return render_template('history.html', queries=queries, active_page="history")
+        return render_template('history.html', queries=queries, popular=popular, active_page="history")
 
 
 @app.route("/refresh_ranking", methods=["GET"])
@@ -269,7 +294,7 @@ def getRanking():
     else:
         if res is not None:
             return app.response_class(
-                response=json.dumps(res),
+                response=jsoncodec.dumps(res),
                 status=200,
                 mimetype='application/json'
             )
@@ -283,10 +308,10 @@ def snowball():
     if "application/json" in accepts:
         title = request.args.get('title')
         query = f"REFTITLE(\"{title}\")"
-        count = count_results_for_query(query)
-        dois = get_papers(count, query, False)
+        context = count_search(query)
+        dois = get_papers(context.count_scopus, query, False, search_context=context)
         return app.response_class(
-            response=json.dumps([doi["doi"] for doi in dois]),
+            response=jsoncodec.dumps([doi["doi"] for doi in dois]),
             status=200,
             mimetype='application/json'
         )
@@ -376,6 +401,70 @@ def get_network_data(id):
     )
 
 
+@app.route("/network/analytics/<id>", methods=["GET"])
+def get_network_analytics(id):
+    analytics = net_get_graph_analytics(id)
+    if analytics is None:
+        return abort(404, description="No network with this id")
+    return app.response_class(
+        response=jsoncodec.dumps(analytics),
+        status=200,
+        mimetype='application/json'
+    )
+
+
+@app.route("/db/stats", methods=["GET"])
+def get_db_stats():
+    return app.response_class(
+        response=jsoncodec.dumps({"statements": statement_stats(), "write_behind": write_behind.metrics()}),
+        status=200,
+        mimetype='application/json'
+    )
+
+
+@app.route("/search/<int:job_id>", methods=["GET"])
+def get_search_job(job_id):
+    job = search_jobs.get(job_id)
+    snapshot = job.snapshot() if job is not None else load_snapshot(job_id)
+    if snapshot is None:
+        return abort(404, description="No search with this id, or it has expired")
+    return app.response_class(
+        response=jsoncodec.dumps(snapshot, default=str),
+        status=200,
+        mimetype='application/json'
+    )
+
+
+@app.route("/abstracts", methods=["GET"])
+def get_abstracts():
+    ids = request.args.getlist("ids")
+    if not ids:
+        return abort(400, description="ids is required")
+    if len(ids) > abstracts.MAX_IDS:
+        return abort(400, description=f"at most {abstracts.MAX_IDS} ids per request")
+    job_id = request.args.get("job", type=int)
+    return app.response_class(
+        response=jsoncodec.dumps(find_abstracts(ids, job_id)),
+        status=200,
+        mimetype='application/json'
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.registry.render(), status=200, content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/cache/stats", methods=["GET"])
+def get_cache_stats():
+    return app.response_class(
+        response=jsoncodec.dumps({"memory": memory_cache.stats(), "disk": cache_maintenance.stats(),
+                             "health": cache_health()}),
+        status=200,
+        mimetype='application/json'
+    )
+
+
 @app.route('/network/<work_list_id>', methods=["GET"])
 def get_network_page(work_list_id):
     return render_template('network.html', work_list_id=work_list_id,  sources=get_sources())
@@ -400,6 +489,7 @@ def query_analysis_page():
 
 @app.route('/query/analysis/<query_id>', methods=["GET"])
 def query_analysis_saved(query_id: int):
+    write_behind.settle("history", query_id)
     try:
         saved_request = db.session.query(ScpusRequest).filter(
             ScpusRequest.id == int(query_id)).one()
@@ -414,9 +504,8 @@ def analyze_query():
     query = payload.get("query")
     if not query:
         return abort(400, description="Missing query")
-    def count_results_for_query_sum(query):
-        return sum(count_results_for_query(query))
-    data = get_json_analyzed_query(query, count_results_for_query_sum)
+    data = get_json_analyzed_query(query, count_results_for_query_sum,
+                                   executor=get_query_analysis_executor(), memo=query_analysis_memo)
     return app.response_class(
         response=data,
         status=200,
@@ -426,7 +515,8 @@ def analyze_query():
 
 @app.route('/permalink/<query_id>', methods=["GET"])
 def permalink(query_id: int):
-
+    # the id is handed out before its history row is written
+    write_behind.settle("history", query_id)
     try:
         request = db.session.query(ScpusRequest).filter(
             ScpusRequest.id == int(query_id)).one()
@@ -0,0 +1,356 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Event, Lock
+from typing import Dict, Set
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app import jsoncodec
+from app.metrics import registry
+from app.model import SearchJobBatch, SearchJobRecord
+from app.sequences import IdAllocator
+from app.write_behind import write_behind
+
+logger = logging.getLogger('search_jobs')
+
+SEARCH_REATTACH_SECONDS = float(os.environ.get("SEARCH_REATTACH_SECONDS", "60"))
+SEARCH_STALE_SECONDS = float(os.environ.get("SEARCH_STALE_SECONDS", "60"))
+SEARCH_JOB_TTL_HOURS = float(os.environ.get("SEARCH_JOB_TTL_HOURS", "24"))
+HEARTBEAT_SECONDS = 10
+PRUNE_INTERVAL_SECONDS = 600
+
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+
+jobs_cancelled = registry.counter(
+    "scholar_search_jobs_cancelled_total",
+    "Search jobs cancelled, by reason: disconnect, superseded, or attached (prefetch taken over by get_dois).",
+    ("reason",))
+tasks_saved = registry.counter(
+    "scholar_search_tasks_saved_total",
+    "Executor tasks of cancelled searches that never ran: dequeued before starting, or skipped when picked up.",
+    ("how",))
+emits_skipped = registry.counter(
+    "scholar_search_emits_skipped_total", "Socket events of cancelled searches that were not sent.")
+reattached = registry.counter(
+    "scholar_search_jobs_reattached_total", "Clients re-attached to a search, by job state: running, done or resumed.",
+    ("state",))
+
+_ids = IdAllocator("search_job", SearchJobRecord.id)
+_pruner = None
+_pruner_lock = Lock()
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+def _result_key(paper):
+    return paper.get("doi") or paper.get("title") or id(paper)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class SearchJob:
+    """
+    The executor work of one search, cancellable as a whole. Tasks go through submit():
+    cancel() drops those still queued and makes the others return without running.
+    `signal` is a future completed on cancel, add it to the set given to wait()
+    so a waiting loop wakes up right away.
+
+    Jobs with an id are also streamed (see stream()): their results are kept and
+    persisted batch by batch, so clients can re-attach by id until the job expires.
+    """
+
+    def __init__(self, sid=None, job_id=None, query="", xref=False, arxiv=False, carried=()):
+        self.sid = sid
+        self.id = job_id
+        self.query = query
+        self.xref = xref
+        self.arxiv = arxiv
+        self.status = "running"
+        self.total = 0
+        self.progress = {}
+        self.clients: Set[str] = {sid} if sid else set()
+        self.signal = Future()
+        self._cancelled = Event()
+        self._futures: Set[Future] = set()
+        self._lock = Lock()
+        # results of an interrupted run this one resumes, merged into the final list
+        self._carried = list(carried)
+        self._results = OrderedDict((_result_key(paper), paper) for paper in self._carried)
+        self._heartbeat = 0.0
+
+    @property
+    def room(self):
+        return f"search-{self.id}"
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def submit(self, executor, fn, *args, **kwargs):
+        """executor.submit(fn, ...) on behalf of the job; once cancelled, returns an already cancelled future."""
+        if self.cancelled:
+            future = Future()
+            future.cancel()
+            return future
+
+        def run():
+            if self.cancelled:
+                tasks_saved.inc("skipped")
+                raise SearchCancelled()
+            return fn(*args, **kwargs)
+
+        future = executor.submit(run)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def emitter(self, emitt):
+        """emitt that stays silent once the job is cancelled."""
+        def emit_unless_cancelled(*args, **kwargs):
+            if self.cancelled:
+                emits_skipped.inc()
+                return None
+            return emitt(*args, **kwargs)
+        return emit_unless_cancelled
+
+    def cancel(self, reason):
+        with self._lock:
+            if self.cancelled:
+                return
+            self._cancelled.set()
+            futures = list(self._futures)
+        dequeued = sum(1 for future in futures if future.cancel())
+        tasks_saved.inc("dequeued", amount=dequeued)
+        jobs_cancelled.inc(reason)
+        self.signal.set_result(None)
+        logger.info("search %s for %s cancelled (%s): %d queued tasks dropped, %d running",
+                    self.id, self.sid, reason, dequeued, len(futures) - dequeued)
+
+    def stream(self, broadcast):
+        """
+        emitt for get_papers: records progress and results, persists each doi_results
+        batch, then hands the event to broadcast(event, data).
+        """
+        def emit_and_record(event, data):
+            if event == "doi_update":
+                with self._lock:
+                    self.progress = data
+                    self.total = data.get("total", self.total)
+                if time.monotonic() - self._heartbeat > HEARTBEAT_SECONDS:
+                    self._persist()
+            elif event == "doi_results":
+                with self._lock:
+                    for paper in data:
+                        self._results[_result_key(paper)] = paper
+                write_behind.submit("search_job_batch", {"job_id": self.id, "final": False,
+                                                         "results": jsoncodec.dumps(data, default=str)})
+                self._persist()
+            elif event == "doi_export_done":
+                if self._carried:
+                    merged = OrderedDict((_result_key(paper), paper) for paper in self._carried)
+                    merged.update((_result_key(paper), paper) for paper in data)
+                    data = list(merged.values())
+                self.status = "done"
+                write_behind.submit("search_job_batch", {"job_id": self.id, "final": True,
+                                                         "results": jsoncodec.dumps(data, default=str)})
+                self._persist()
+            broadcast(event, data)
+        return emit_and_record
+
+    def _persist(self):
+        self._heartbeat = time.monotonic()
+        with self._lock:
+            progress = jsoncodec.dumps(self.progress)
+        write_behind.submit("search_job", {
+            "id": self.id, "query": self.query, "xref": self.xref, "arxiv": self.arxiv, "status": self.status,
+            "total": self.total, "progress": progress, "worker": WORKER, "updated": _now()})
+
+    def snapshot(self):
+        with self._lock:
+            return {"job_id": self.id, "query": self.query, "xref": self.xref, "arxiv": self.arxiv,
+                    "status": self.status, "total": self.total, "progress": dict(self.progress),
+                    "results": list(self._results.values())}
+
+
+def _write_jobs(session, rows):
+    for row in rows:
+        updated = session.execute(update(SearchJobRecord).where(SearchJobRecord.id == row["id"]).values(**row))
+        if not updated.rowcount:
+            session.execute(insert(SearchJobRecord).values(created=row["updated"], **row))
+
+
+write_behind.register("search_job", write=_write_jobs)
+write_behind.register("search_job_batch", SearchJobBatch)
+
+
+def load_snapshot(job_id):
+    """Snapshot of a search job from the database, None once expired. Running jobs nobody updates are 'interrupted'."""
+    write_behind.settle("search_job", job_id)
+    with Session(engine) as session:
+        record = session.get(SearchJobRecord, job_id)
+        if record is None:
+            return None
+        batches = session.scalars(select(SearchJobBatch).where(SearchJobBatch.job_id == job_id)
+                                  .order_by(SearchJobBatch.id)).all()
+    final = [batch for batch in batches if batch.final]
+    if final:
+        results = jsoncodec.loads(final[-1].results)
+    else:
+        merged = OrderedDict()
+        for batch in batches:
+            merged.update((_result_key(paper), paper) for paper in jsoncodec.loads(batch.results))
+        results = list(merged.values())
+
+    status = record.status
+    updated = record.updated if record.updated.tzinfo else record.updated.replace(tzinfo=datetime.timezone.utc)
+    if status == "running" and (_now() - updated).total_seconds() > SEARCH_STALE_SECONDS:
+        status = "interrupted"
+    return {"job_id": record.id, "query": record.query, "xref": record.xref, "arxiv": record.arxiv,
+            "status": status, "total": record.total, "progress": jsoncodec.loads(record.progress or "{}"),
+            "results": results}
+
+
+def prune_jobs(ttl_hours=SEARCH_JOB_TTL_HOURS):
+    """Delete search jobs, and their batches, not updated for ttl_hours."""
+    cutoff = _now() - datetime.timedelta(hours=ttl_hours)
+    with engine.begin() as conn:
+        expired = select(SearchJobRecord.id).where(SearchJobRecord.updated < cutoff).scalar_subquery()
+        conn.execute(delete(SearchJobBatch).where(SearchJobBatch.job_id.in_(expired)))
+        removed = conn.execute(delete(SearchJobRecord).where(SearchJobRecord.updated < cutoff)).rowcount
+    if removed:
+        logger.info("pruned %d search jobs older than %s hours", removed, ttl_hours)
+    return removed
+
+
+def _run_pruner():
+    while True:
+        try:
+            prune_jobs()
+        except Exception:
+            logger.exception("search job retention failed")
+        time.sleep(PRUNE_INTERVAL_SECONDS)
+
+
+def _ensure_pruner():
+    global _pruner
+    if _pruner is not None:
+        return
+    with _pruner_lock:
+        if _pruner is None:
+            _pruner = threading.Thread(target=_run_pruner, name="search-job-retention", daemon=True)
+            _pruner.start()
+
+
+class SearchJobs:
+    """
+    Searches running in this process and the Socket.IO sessions attached to them.
+    A new search from a session supersedes the one it was attached to; a job left
+    without clients is cancelled if nobody re-attaches within SEARCH_REATTACH_SECONDS.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[int, SearchJob] = {}
+        self._by_sid: Dict[str, SearchJob] = {}
+        self._lock = Lock()
+
+    def start(self, sid, query, xref=False, arxiv=False):
+        job = SearchJob(sid, _ids.next_id(), query, xref, arxiv)
+        self._register(sid, job)
+        job._persist()
+        _ensure_pruner()
+        return job
+
+    def resume(self, sid, snapshot):
+        """Run an interrupted job again under its id, keeping the results it already had."""
+        job = SearchJob(sid, snapshot["job_id"], snapshot["query"], snapshot["xref"], snapshot["arxiv"],
+                        carried=snapshot["results"])
+        self._register(sid, job)
+        job._persist()
+        reattached.inc("resumed")
+        return job
+
+    def _register(self, sid, job):
+        with self._lock:
+            previous = self._by_sid.get(sid)
+            self._by_sid[sid] = job
+            self._jobs[job.id] = job
+            superseded = previous is not None and previous is not job and self._drop_client(previous, sid)
+        if superseded:
+            previous.cancel("superseded")
+
+    def _drop_client(self, job, sid):
+        """Detach sid from job; True when the job has no client left."""
+        job.clients.discard(sid)
+        return not job.clients
+
+    def get(self, job_id):
+        """The job, when it runs in this process."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def attach(self, sid, job_id):
+        """Attach sid to job_id. Returns the job's snapshot (None once expired) and the live job, if it runs here."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                previous = self._by_sid.get(sid)
+                if previous is not None and previous is not job:
+                    self._drop_client(previous, sid)
+                job.clients.add(sid)
+                self._by_sid[sid] = job
+        if job is not None:
+            reattached.inc("running")
+            return job.snapshot(), job
+        snapshot = load_snapshot(job_id)
+        if snapshot is not None and snapshot["status"] != "interrupted":
+            reattached.inc(snapshot["status"])
+        return snapshot, None
+
+    def detach(self, sid):
+        """The session went away: its job keeps running for a while in case the client comes back."""
+        with self._lock:
+            job = self._by_sid.pop(sid, None)
+            orphaned = job is not None and self._drop_client(job, sid)
+        if orphaned:
+            timer = threading.Timer(SEARCH_REATTACH_SECONDS, self._expire, (job,))
+            timer.daemon = True
+            timer.start()
+
+    def _expire(self, job):
+        with self._lock:
+            orphaned = not job.clients and self._jobs.get(job.id) is job
+        if orphaned:
+            job.cancel("disconnect")
+
+    def finish(self, job):
+        if job.status == "running":
+            job.status = "cancelled" if job.cancelled else "failed"
+            job._persist()
+        with self._lock:
+            if self._jobs.get(job.id) is job:
+                del self._jobs[job.id]
+            for sid in [sid for sid, attached in self._by_sid.items() if attached is job]:
+                del self._by_sid[sid]
+
+
+search_jobs = SearchJobs()
+
+registry.gauge("scholar_search_jobs_running", "Searches running in this process.", (),
+               lambda: {(): len(search_jobs._jobs)})
@@ -0,0 +1,53 @@
+import logging
+from threading import Lock
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import engine
+from app.model import IdBlock
+
+logger = logging.getLogger('sequences')
+
+
+class IdAllocator:
+    """
+    Hands out primary keys for a table without inserting the row first.
+    Blocks of block_size ids are reserved in the id_block table: the UPDATE takes
+    the row (SQLite: database) write lock, so processes never get the same block.
+    The first block starts after the largest id already in the table.
+    """
+
+    def __init__(self, name, id_column, block_size=100):
+        self.name = name
+        self.id_column = id_column
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = Lock()
+
+    def _reserve_block(self):
+        for _ in range(3):
+            with engine.begin() as conn:
+                updated = conn.execute(update(IdBlock).where(IdBlock.name == self.name)
+                                       .values(next_id=IdBlock.next_id + self.block_size))
+                if updated.rowcount:
+                    end = conn.execute(select(IdBlock.next_id).where(IdBlock.name == self.name)).scalar_one()
+                    return end - self.block_size, end
+            try:
+                with engine.begin() as conn:
+                    start = (conn.execute(select(func.max(self.id_column))).scalar() or 0) + 1
+                    conn.execute(IdBlock.__table__.insert().values(name=self.name, next_id=start))
+            except IntegrityError:
+                # another process created the row first, take a block from it
+                pass
+        raise RuntimeError(f"could not reserve ids for {self.name}")
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block()
+                logger.debug("reserved ids [%s, %s) for %s", self._next, self._end, self.name)
+            value = self._next
+            self._next += 1
+            return value
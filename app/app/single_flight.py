@@ -0,0 +1,50 @@
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, Dict
+
+from app.metrics import registry
+
+flights = registry.counter(
+    "scholar_single_flight_calls_total",
+    "Fetches by role: leader (made the upstream call) or coalesced (shared a leader's in-flight call).",
+    ("group", "role"))
+
+
+class SingleFlight:
+    """
+    Concurrent calls for the same key share one execution: the first caller runs
+    fn, the others wait for its result (or its exception). Nothing is kept once
+    the call returns, caching is left to the layers below.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self._in_flight: Dict[object, Future] = {}
+        self._lock = Lock()
+
+    def do(self, key, fn: Callable):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            flights.inc(self.group, "coalesced")
+            return future.result()
+
+        flights.inc(self.group, "leader")
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
@@ -0,0 +1,72 @@
+"""
+Startup benchmark: imports app.main under `python -X importtime` in fresh
+interpreters and fails when the median import time exceeds the budget, or when
+a module that is meant to load lazily is imported at startup.
+
+    python -m app.startup_budget [--budget-ms 900] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# imported on first use (see app.lazy), must not show up at startup
+DEFERRED_MODULES = ("dateparser", "networkx", "scipy", "numpy", "pycountry", "feedgen", "atoma", "Levenshtein",
+                    "app.citation_analytics")
+
+DEFAULT_BUDGET_MS = int(os.environ.get("IMPORT_BUDGET_MS", "900"))
+
+
+def parse_importtime(stderr):
+    """{module: (self_us, cumulative_us)} from -X importtime output."""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure(target="app.main"):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {target}"],
+                               capture_output=True, text=True, env=env,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if completed.returncode != 0:
+        raise RuntimeError(f"importing {target} failed:\n{completed.stderr[-2000:]}")
+    return parse_importtime(completed.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=int, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    runs = [measure() for _ in range(args.runs)]
+    totals_ms = [run["app.main"][1] / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+
+    last = runs[-1]
+    print(f"import app.main: median {median_ms:.0f} ms over {args.runs} runs "
+          f"(min {min(totals_ms):.0f}, max {max(totals_ms):.0f}), budget {args.budget_ms} ms")
+    print("heaviest modules (self time):")
+    for name, (self_us, cumulative_us) in sorted(last.items(), key=lambda kv: kv[1][0], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+
+    failures = []
+    eager = [name for name in DEFERRED_MODULES if name in last]
+    if eager:
+        failures.append(f"imported at startup instead of lazily: {', '.join(eager)}")
+    if median_ms > args.budget_ms:
+        failures.append(f"median import time {median_ms:.0f} ms exceeds the {args.budget_ms} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
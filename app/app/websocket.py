@@ -1,13 +1,61 @@
-from flask_socketio import emit
+from flask import request
+from flask_socketio import emit as socketio_emit, join_room
 from typing import Dict, Iterable, List, Set, Tuple
 from app.main import socketio, db
-from app.business import count_results_for_query, get_papers, net_build_graph
+from app.business import count_search, get_papers, net_build_graph, count_results_for_query_sum, \
+    get_query_analysis_executor, query_analysis_memo, SearchContext, start_prefetch
+from app.query_analyzer import stream_analyzed_query
 from app.model import ScpusFeed, ScpusRequest, NetworkData
 from app.researchers import get_venue_for_orcid, get_venue_for_openalex
-import json
+from app.history import record_query
+from app.sequences import IdAllocator
+from app.write_behind import write_behind
+from app.metrics import socket_events
+from app.search_jobs import search_jobs
+from app import abstracts, jsoncodec
+import logging
 import pickle
 from collections import Counter
 
+logger = logging.getLogger('websocket')
+
+
+def emit(event, *args, **kwargs):
+    socket_events.inc(event)
+    return socketio_emit(event, *args, **kwargs)
+
+
+# events carrying search results, sent without their abstracts (see app.abstracts)
+RESULT_EVENTS = ("doi_results", "doi_export_done")
+
+
+def room_emitter(room):
+    """Emit to every client in room, from any thread."""
+    def emit_to_room(event, data):
+        if event in RESULT_EVENTS:
+            data = abstracts.detach(data)
+        socket_events.inc(event)
+        socketio.emit(event, data, to=room)
+    return emit_to_room
+
+
+# rows created from socket handlers are written behind, their ids are handed out up front
+feed_ids = IdAllocator("feed", ScpusFeed.id)
+network_ids = IdAllocator("networkdata", NetworkData.id)
+write_behind.register("feed", ScpusFeed)
+write_behind.register("networkdata", NetworkData)
+
+# per connection: what the last count fetched, reused by the get_dois that follows it
+search_contexts: Dict[str, SearchContext] = {}
+
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    context = search_contexts.pop(request.sid, None)
+    if context is not None:
+        context.cancel_prefetch("disconnect")
+    search_jobs.detach(request.sid)
+
 
 @socketio.on('create_network_graph_data')
 def net_create_graph_data(json_data):
@@ -16,22 +64,19 @@ def net_create_graph_data(json_data):
         emit("nework_report",  nework_report)
 
     result = net_build_graph(json_data["ids"], 2, emitt=network_emit)
-    graph_data = NetworkData(
-        query=json_data["query"], network_data=pickle.dumps(json.dumps(result)))
-    db.session.add(graph_data)
-    db.session.commit()
+    network_id = network_ids.next_id()
+    write_behind.submit("networkdata", {
+        "id": network_id, "query": json_data["query"], "network_data": pickle.dumps(jsoncodec.dumps(result))})
 
-    emit("nework_report_done", {"network_id": graph_data.id})
+    emit("nework_report_done", {"network_id": network_id})
 
 
 @socketio.on('create_feed')
 def create_feed(json_data):
-    feed = ScpusFeed(query=json_data["query"])
+    feed_id = feed_ids.next_id()
+    write_behind.submit("feed", {"id": feed_id, "query": json_data["query"]})
 
-    db.session.add(feed)
-    db.session.commit()
-
-    emit("feed_generated", {"feed_id": feed.id})
+    emit("feed_generated", {"feed_id": feed_id})
 
 
 @socketio.on('count')
@@ -45,19 +90,47 @@ def handle_count(json_data, log_query=False):
         def arxiv_warning(message: str):
             pass
 
-    count_scopus, count_arxiv = count_results_for_query(
-        json_data["query"], include_arxiv=include_arxiv, arxiv_warning=arxiv_warning)
+    context = count_search(json_data["query"], include_arxiv=include_arxiv, arxiv_warning=arxiv_warning)
+    previous = search_contexts.get(request.sid)
+    if previous is not None:
+        previous.cancel_prefetch("superseded")
+    context.prefetch = start_prefetch(context, json_data.get("xref", False), user=next(iter(request.access_route), request.sid))
+    search_contexts[request.sid] = context
+    count_scopus, count_arxiv = context.count_scopus, context.count_arxiv
 
-    n = ScpusRequest(query=json_data["query"],
-                     ip="0.0.0.0", count=count_scopus+count_arxiv, fetched=False)
-    db.session.add(n)
-    db.session.commit()
+    query_id = record_query(json_data["query"], count_scopus+count_arxiv)
 
-    emit("query_id", n.id)
+    emit("query_id", query_id)
 
     emit("count", count_scopus+count_arxiv)
 
 
+@socketio.on('analyze_query')
+def handle_analyze_query(json_data):
+    def graph_emit(graph):
+        emit("query_analysis_graph", graph)
+
+    def score_emit(score):
+        emit("query_analysis_score", score)
+
+    query = json_data.get("query") if isinstance(json_data, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        emit("query_analysis_error", {"message": "query is required"})
+        return
+    try:
+        data = stream_analyzed_query(query, count_results_for_query_sum, graph_emit, score_emit,
+                                     executor=get_query_analysis_executor(), memo=query_analysis_memo)
+    except ValueError as e:
+        # the query does not parse
+        emit("query_analysis_error", {"message": str(e)})
+        return
+    except Exception:
+        logger.exception("analyzing query %.200r failed", query)
+        emit("query_analysis_error", {"message": "the query could not be analyzed, try again later"})
+        return
+    emit("query_analysis_done", jsoncodec.loads(data))
+
+
 @socketio.on("get_venue_openalex")
 def get_venue_openalex(openalex_id):
     def venue_emit(venue):
@@ -67,7 +140,7 @@ def get_venue_openalex(openalex_id):
         emit("author_name",  author_name)
     venues = dict(Counter(get_venue_for_openalex(
         openalex_id, venue_emit, author_emit)))
-    emit("venues", json.dumps(venues))
+    emit("venues", jsoncodec.dumps(venues))
 
 
 @socketio.on("get_venue")
@@ -78,7 +151,7 @@ def handle_get_venues(orcid):
     def author_emit(author_name):
         emit("author_name",  author_name)
     venues = dict(Counter(get_venue_for_orcid(orcid, venue_emit, author_emit)))
-    emit("venues", json.dumps(venues))
+    emit("venues", jsoncodec.dumps(venues))
 
 
 @socketio.on('get_dois')
@@ -94,10 +167,52 @@ def handle_get_dois(json_data):
         def arxiv_warning(message: str):
             pass
 
-    count_scopus, count_arxiv = count_results_for_query(
-        the_query, include_arxiv=arxiv, arxiv_warning=arxiv_warning)
-    dois = get_papers(count_scopus, the_query, xref=xref,
-                      arxiv=arxiv, emitt=emit, count_arxiv=count_arxiv,
-                      arxiv_warning=arxiv_warning)
+    # a new search from the same client supersedes the one still running
+    context = search_contexts.pop(request.sid, None)
+    if context is not None:
+        # get_papers joins the prefetched pages and the calls still in flight, the queued rest is its own work now
+        context.cancel_prefetch("attached")
+        if not context.matches(the_query, arxiv):
+            context = None
+
+    job = search_jobs.start(request.sid, the_query, xref=xref, arxiv=arxiv)
+    join_room(job.room)
+    emit("search_job", {"job_id": job.id})
+    run_search(job, arxiv_warning, context=context)
 
     #emit("dois", {"dois": dois})
+
+
+def run_search(job, arxiv_warning, existing_data={}, context=None):
+    # results go to the job's room, so re-attached clients get the rest of the stream
+    try:
+        if context is None:
+            context = count_search(job.query, include_arxiv=job.arxiv, arxiv_warning=arxiv_warning)
+        return get_papers(context.count_scopus, job.query, xref=job.xref,
+                          arxiv=job.arxiv, emitt=job.stream(room_emitter(job.room)), count_arxiv=context.count_arxiv,
+                          arxiv_warning=arxiv_warning, existing_data=existing_data, job=job,
+                          search_context=context)
+    finally:
+        search_jobs.finish(job)
+
+
+@socketio.on('attach_search')
+def handle_attach_search(json_data):
+    try:
+        job_id = int(json_data["job_id"])
+    except (KeyError, TypeError, ValueError):
+        emit("search_snapshot", {"job_id": None, "status": "expired"})
+        return
+
+    join_room(f"search-{job_id}")
+    snapshot, job = search_jobs.attach(request.sid, job_id)
+    if snapshot is None:
+        emit("search_snapshot", {"job_id": job_id, "status": "expired"})
+        return
+    emit("search_snapshot", dict(snapshot, results=abstracts.detach(snapshot["results"])))
+
+    if snapshot["status"] == "interrupted":
+        # the worker running it went away: carry on from the results it had persisted
+        job = search_jobs.resume(request.sid, snapshot)
+        existing = {paper["doi"]: paper for paper in snapshot["results"] if paper.get("doi")}
+        run_search(job, lambda message: None, existing_data=existing)
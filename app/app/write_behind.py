@@ -0,0 +1,162 @@
+import atexit
+import logging
+import os
+import queue
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.database import engine
+
+logger = logging.getLogger('write_behind')
+
+WRITE_BEHIND_FLUSH_SECONDS = float(os.environ.get("WRITE_BEHIND_FLUSH_SECONDS", "0.5"))
+WRITE_BEHIND_BATCH_SIZE = 200
+SHUTDOWN_FLUSH_TIMEOUT = 10
+LAG_WARNING_MS = 5000
+
+
+class WriteBehindQueue:
+    """
+    Rows queued by request handlers and written by one background thread, a batch
+    per transaction. Each kind of row has a writer, write(session, rows); by default
+    a bulk INSERT into its model. Rows carry their primary key (see sequences.IdAllocator),
+    so callers can hand the id out before the row is written; readers that may race
+    the writer call settle(kind, id).
+    """
+
+    def __init__(self, flush_seconds=WRITE_BEHIND_FLUSH_SECONDS, batch_size=WRITE_BEHIND_BATCH_SIZE):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self._writers: Dict[str, Callable] = {}
+        self._queue = queue.Queue()
+        self._pending_ids = {}
+        self._outstanding = OrderedDict()  # submitted and not yet written: token -> enqueue time
+        self._tokens = itertools.count()
+        self._settled = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"batches": 0, "rows": 0, "failed_rows": 0, "last_lag_ms": 0.0, "max_lag_ms": 0.0}
+
+    def register(self, kind, model=None, write=None):
+        """Writer for a kind of row: write(session, rows), or a plain bulk insert into model."""
+        if write is None:
+            def write(session, rows):
+                session.execute(insert(model), rows)
+        self._writers[kind] = write
+
+    def submit(self, kind, row):
+        if kind not in self._writers:
+            raise KeyError(f"no writer registered for {kind}")
+        token = next(self._tokens)
+        enqueued = time.monotonic()
+        with self._settled:
+            self._pending_ids.setdefault(kind, set()).add(row.get("id"))
+            self._outstanding[token] = enqueued
+        self._queue.put((kind, row, enqueued, token))
+        self._wake.set()
+        self._ensure_thread()
+
+    def settle(self, kind, row_id, timeout=5):
+        """Wait until a queued row with this id has been written (or dropped)."""
+        try:
+            row_id = int(row_id)
+        except (TypeError, ValueError):
+            return
+        with self._settled:
+            self._settled.wait_for(lambda: row_id not in self._pending_ids.get(kind, ()), timeout=timeout)
+
+    def _drain(self):
+        items = []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items):
+        by_kind = {}
+        for kind, row, _, _ in items:
+            by_kind.setdefault(kind, []).append(row)
+        for kind, rows in by_kind.items():
+            for attempt in (1, 2):
+                try:
+                    with Session(engine) as session, session.begin():
+                        self._writers[kind](session, rows)
+                    break
+                except Exception:
+                    # retried once: a concurrent writer may have raced us on a unique row
+                    if attempt == 2:
+                        logger.exception("dropping %d %s rows", len(rows), kind)
+                        with self._metrics_lock:
+                            self._metrics["failed_rows"] += len(rows)
+
+        lag_ms = (time.monotonic() - min(enqueued for _, _, enqueued, _ in items)) * 1000
+        with self._metrics_lock:
+            self._metrics["batches"] += 1
+            self._metrics["rows"] += len(items)
+            self._metrics["last_lag_ms"] = round(lag_ms, 3)
+            self._metrics["max_lag_ms"] = round(max(self._metrics["max_lag_ms"], lag_ms), 3)
+        if lag_ms > LAG_WARNING_MS:
+            logger.warning("write-behind lag %.0f ms for %d rows", lag_ms, len(items))
+        with self._settled:
+            for kind, row, _, token in items:
+                self._pending_ids.get(kind, set()).discard(row.get("id"))
+                self._outstanding.pop(token, None)
+            self._settled.notify_all()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # let a burst accumulate into one transaction
+            time.sleep(self.flush_seconds)
+            self._wake.clear()
+            # rows stay in the queue until written here or by flush()
+            with self._write_lock:
+                while True:
+                    items = self._drain()
+                    if not items:
+                        break
+                    self._write(items)
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=SHUTDOWN_FLUSH_TIMEOUT):
+        """Write everything queued so far from the calling thread."""
+        deadline = time.monotonic() + timeout
+        with self._write_lock:
+            while time.monotonic() < deadline:
+                items = self._drain()
+                if not items:
+                    return True
+                self._write(items)
+        logger.error("write-behind flush timed out, %d rows left", self._queue.qsize())
+        return False
+
+    def metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        with self._settled:
+            oldest = next(iter(self._outstanding.values()), None)
+            metrics["queued"] = len(self._outstanding)
+        metrics["oldest_queued_ms"] = round((time.monotonic() - oldest) * 1000, 3) if oldest is not None else 0.0
+        return metrics
+
+
+write_behind = WriteBehindQueue()
+atexit.register(write_behind.flush)
@@ -0,0 +1,22 @@
+from app import query_analyzer as qa
+from app import query_compiler as qc
+
+
+def test_analyzer_groups_or_before_and_like_scopus():
+    assert qa.parse_query("a OR b AND c").label == "((A OR B) AND C)"
+    assert qa.parse_query("a AND b OR c").label == "(A AND (B OR C))"
+
+
+def test_analyzer_keeps_explicit_grouping():
+    assert qa.parse_query("a OR (b AND c)").label == "(A OR (B AND C))"
+
+
+def test_compiler_default_binds_and_tighter():
+    tree = qa.tree_from_compiled(qc.compile_query("a OR b AND c").distributed(implicit=False))
+    assert tree.label == "(A OR (B AND C))"
+
+
+def test_pubyear_word_operators():
+    assert qa.parse_query("TITLE-ABS-KEY(x) AND PUBYEAR AFT 2019").label == "(TITLE-ABS-KEY(X) AND PUBYEAR > 2019)"
+    assert qa.parse_query("PUBYEAR BEF 2001").label == "PUBYEAR < 2001"
+    assert qa.parse_query("PUBYEAR IS 2010").label == "PUBYEAR = 2010"
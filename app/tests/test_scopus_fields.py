@@ -0,0 +1,101 @@
+"""
+The Scopus search is projected on SCOPUS_SEARCH_FIELDS (field=...); a key read
+from an entry but left out of the projection silently comes back empty. These
+tests run the entry readers over a page of the projected shape and check that
+every key they touch is requested.
+"""
+import json
+from pathlib import Path
+
+import app.main  # noqa: F401  business is imported through the app, not on its own
+from app import business
+
+FIXTURE = Path(__file__).parent / "fixtures" / "scopus_search_page.json"
+
+# the projection of affilname/affiliation-country comes back nested under "affiliation"
+CONTAINERS = {"affiliation"}
+
+
+class Recorder(dict):
+    """A dict noting every key read from it, and from the dicts nested in it, into `read`."""
+
+    def __init__(self, data, read):
+        super().__init__({key: _wrap(value, read) for key, value in data.items()})
+        self.read = read
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.read.add(key)
+        return super().__contains__(key)
+
+
+def _wrap(value, read):
+    if isinstance(value, dict):
+        return Recorder(value, read)
+    if isinstance(value, list):
+        return [_wrap(item, read) for item in value]
+    return value
+
+
+def _page():
+    return json.loads(FIXTURE.read_text())
+
+
+def _entries(read):
+    return [Recorder(entry, read) for entry in _page()["search-results"]["entry"]]
+
+
+def _openalex_work(entry):
+    return {"doi": f"https://doi.org/{entry.get('prism:doi', '')}", "title": entry["dc:title"],
+            "publication_year": 2021, "publication_date": "2021-03-01", "open_access": {"is_oa": False},
+            "authorships": [], "cited_by_count": 0, "referenced_works_count": 0, "primary_topic": None}
+
+
+def _assert_projected(read):
+    assert read, "the readers did not touch the entries"
+    missing = read - set(business.SCOPUS_SEARCH_FIELDS) - CONTAINERS
+    assert not missing, f"read but not in SCOPUS_SEARCH_FIELDS: {sorted(missing)}"
+
+
+def test_fixture_has_the_projected_shape():
+    before = list(business.scopus_shape_issues.samples())
+    results = business.check_scopus_shape(_page())
+    assert len(results["entry"]) == 3
+    assert list(business.scopus_shape_issues.samples()) == before
+
+
+def test_load_response_from_scpus_reads_projected_fields():
+    read = set()
+    bucket = []
+    for entry in _entries(read):
+        business.load_response_from_scpus(bucket, entry)
+    _assert_projected(read)
+    assert [paper["doi"] for paper in bucket] == ["https://doi.org/10.1109/TNSM.2021.3051234",
+                                                  "https://doi.org/10.1016/j.comnet.2022.109012", ""]
+    assert bucket[1]["issn"] == "18727069"
+    assert bucket[0]["X-Country-First-Author"] == "fra"
+
+
+def test_load_response_from_openalex_scopus_reads_projected_fields():
+    read = set()
+    bucket = []
+    for entry in _entries(read):
+        business.load_response_from_openAlex_scopus(bucket, _openalex_work(entry), entry)
+    _assert_projected(read)
+    assert bucket[0]["X-Country-First-affiliation"] == "Université de Bordeaux"
+
+
+def test_first_author_helpers_read_projected_fields():
+    read = set()
+    for entry in _entries(read):
+        business.get_first_auth_affil(entry)
+        business.get_first_auth_country(entry)
+    _assert_projected(read)
+    assert read >= {"affilname", "affiliation-country"}